@@ -13,15 +13,78 @@ class SimulationResponse(BaseModel):
     times: List[float]
 
 
+class OutputWindowInput(BaseModel):
+    # Optional query parameters reducing the output before it is sent, times are in the same units as the output
+    start: float | None = None # Earliest time to include
+    end: float | None = None # Latest time to include
+    max_points: int | None = None # Most samples to return
+    method: str = "stride" # How to reduce to max_points, one of "stride", "mean" or "lttb"
+
+
 class ZeroDimensionEBMInput(SimulationInput):
     initial_temperature: float  # Starting temperature for this simulation
     insolation: float # Area-averaged solar radiation
     albedo: float # Proportion of light reflected from surface
     tau: float # Capacity of atmosphere to transmit radiation to space
+    duration: float = 50. # Length of run in years
+    timestep: float = 30. # Length of each timestep in days
+    sample_interval: float = 1. # Years between recorded temperatures
+    convergence_tolerance: float | None = None # If set, stop once temperature changes less than this per year
+
+
+class EBMSnapshot(BaseModel):
+    # State at the end of an EBM run which can be sent to /execute/EBM/continue to carry the run on
+    temperature: float # Final temperature in degrees C
+    elapsed_time: float # Years run so far
+    elapsed_steps: int # Timesteps run so far
+    timestep: float # Length of each timestep in days
+    insolation: float
+    albedo: float
+    tau: float
+    engine: str
+    engine_version: int
 
 
 class ZeroDimensionEBMResponse(ZeroDimensionEBMInput, SimulationResponse):
-    pass
+    time_steps_completed: int # Number of timesteps run (fewer than requested if the run converged early)
+    converged: bool
+    snapshot: EBMSnapshot
+
+
+class ZeroDimensionEBMContinueInput(SimulationInput):
+    snapshot: EBMSnapshot # Snapshot returned by an earlier run
+    duration: float = 50. # Extra years to run for
+    sample_interval: float = 1. # Years between recorded temperatures
+    convergence_tolerance: float | None = None # If set, stop once temperature changes less than this per year
+
+
+class ZeroDimensionEBMContinueResponse(ZeroDimensionEBMContinueInput, SimulationResponse):
+    # Only the newly computed samples are returned, with times carrying on from the snapshot
+    time_steps_completed: int # Number of timesteps run in this continuation
+    converged: bool
+    snapshot: EBMSnapshot # Snapshot at the end of the continuation, to continue again
+
+
+class ZeroDimensionEBMBatchInput(SimulationInput):
+    # Parameter sweep over the EBM
+    # If grid is false member i uses the ith value of each list (lists of length 1 are shared by all members)
+    # If grid is true every combination of the supplied values is run
+    initial_temperature: List[float]
+    insolation: List[float]
+    albedo: List[float]
+    tau: List[float]
+    grid: bool = False
+
+
+class ZeroDimensionEBMBatchResponse(SimulationInput):
+    grid: bool
+    # Parameters of each member, in the same order as the rows of temperatures
+    initial_temperature: List[float]
+    insolation: List[float]
+    albedo: List[float]
+    tau: List[float]
+    temperatures: List[List[float]]  # One row of temperatures per member
+    times: List[float]  # Shared by all members
 
 
 # class FAIRInput(SimulationInput):
@@ -32,9 +95,67 @@ class ZeroDimensionEBMResponse(ZeroDimensionEBMInput, SimulationResponse):
 # class FAIRResponse(FAIRInput, SimulationResponse):
 #     pass
 
+class FAIRCustomInput(SimulationInput):
+    # Emissions are sent as the request body rather than in this model
+    start_year: int = 1765 # Year of the first emissions value
+
+
+class FAIRCustomResponse(FAIRCustomInput, SimulationResponse):
+    pass
+
+
+class FAIRCustomJobInput(FAIRCustomInput):
+    # Jobs cannot stream their emissions so they are included as a list
+    emissions: List[float] # Yearly CO2 emissions in GtC/yr
+
+
 class FAIRPresetInput(SimulationInput):
     rcp_scenario: int # scenario choice
 
 
 class FAIRPresetResponse(FAIRPresetInput, SimulationResponse):
     pass
+
+
+class FAIRCompareInput(SimulationInput):
+    rcp_scenarios: List[int] # Scenarios to compare, in the order of the rows of the output
+    include_concentrations: bool = False # Also return CO2 concentrations
+    include_forcing: bool = False # Also return total radiative forcing
+    baseline_scenario: int | None = None # If set, also return each scenario's temperature minus this scenario's
+
+
+class FAIRCompareResponse(FAIRCompareInput):
+    times: List[float] # Shared by all scenarios
+    temperatures: List[List[float]] # One row of temperatures per scenario
+    co2_concentrations: List[List[float]] | None = None # One row of CO2 concentrations (ppm) per scenario
+    forcing: List[List[float]] | None = None # One row of total forcing (W/m2) per scenario
+    temperature_differences: List[List[float]] | None = None # One row per scenario of the difference from the baseline
+
+
+class FAIRMonteCarloInput(SimulationInput):
+    rcp_scenario: int # scenario choice
+    number_of_members: int = 100 # Number of parameter sets drawn (at most 200 unless run as a job)
+    seed: int = 0 # Random seed, the same seed always gives the same output
+    percentiles: List[float] = [5., 17., 50., 83., 95.]
+
+
+class FAIRMonteCarloResponse(FAIRMonteCarloInput):
+    temperatures: List[List[float]] # One row of yearly temperatures per percentile
+    times: List[float]
+
+
+class JobInput(BaseModel):
+    model_type: str # One of "EBM", "EBM/continue", "EBM/batch", "FAIR/preset", "FAIR/compare", "FAIR/custom" or "FAIR/montecarlo"
+    priority: int = 0 # Jobs with higher priority run first
+    simulation_input: dict # Input for the simulation, in the same form as for its /execute endpoint
+
+
+class JobStatusResponse(BaseModel):
+    id: str
+    model_type: str
+    priority: int
+    status: str # One of "queued", "running", "completed" or "failed"
+    progress: float # Proportion of the job completed, from 0 to 1
+    error: str | None = None # Reason the job failed
+    created_at: float # Unix timestamps
+    updated_at: float
@@ -0,0 +1,445 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Benchmark suite for the models, validators and endpoints
+# Run from the repository root with: python -m benchmarks.run_benchmarks
+# Results are compared with benchmarks/baseline.json (created with --save-baseline on a reference machine)
+# and the run fails if anything has become slower than the baseline by more than the regression threshold
+# (or if there is no baseline). Save a new baseline when moving to a different machine
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_ROOT)
+
+import numpy as np  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from api_models import ZeroDimensionEBMInput, ZeroDimensionEBMBatchInput, FAIRPresetInput  # noqa: E402
+from main import app  # noqa: E402
+from models import Constants, ZeroDimensionalEnergyBalanceModel, ZeroDimensionalEnergyBalanceEnsemble, RcpModel  # noqa: E402
+from validation import EBMValidator, EBMBatchValidator, RcpFAIRValidator  # noqa: E402
+
+BASELINE_PATH = os.path.join(REPOSITORY_ROOT, "benchmarks", "baseline.json")
+REGRESSION_THRESHOLD = 1.5  # Fail if a benchmark takes more than 1.5 times as long as its baseline
+BATCH_SPEEDUP_TARGET = 100  # Batch endpoint must run members at least this many times faster than the single endpoint
+
+# Modules which are slow to import and must not be loaded just by importing the server or the models
+HEAVY_MODULES = ("matplotlib", "climlab", "fair", "fair.RCPs.rcp26", "fair.RCPs.rcp45", "fair.RCPs.rcp60", "fair.RCPs.rcp85")
+# Run in a fresh interpreter to time importing a module and measure the peak memory of the process afterwards
+# On Linux ru_maxrss keeps the peak of the benchmark process the interpreter was started from, so the peak since
+# the interpreter started (VmHWM) is read instead
+STARTUP_SCRIPT = """
+import json, os, resource, sys, time
+start_time = time.perf_counter()
+import {module}
+import_seconds = time.perf_counter() - start_time
+if os.path.exists("/proc/self/status"):
+    with open("/proc/self/status") as file:
+        max_rss = next(int(line.split()[1]) * 1024 for line in file if line.startswith("VmHWM:"))
+else:
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+print(json.dumps({{"import_seconds": import_seconds, "max_rss_bytes": max_rss,
+                  "heavy_modules": [name for name in {heavy_modules!r} if name in sys.modules]}}))
+"""
+STARTUP_MODULES = ("models", "main")
+MEMORY_SERVERS = 4  # Server processes started to measure how much memory sharing arrays between them saves
+
+
+class Benchmark:
+    # Times a function by calling it repeatedly, reporting the median and fastest time per call
+    def __init__(self, name, function, number=1, repeat=5):
+        # params number: calls per timing (so very fast functions are measured accurately)
+        # params repeat: number of timings taken
+        self.name = name
+        self.function = function
+        self.number = number
+        self.repeat = repeat
+
+    def run(self):
+        timings = []
+        for _ in range(self.repeat):
+            start_time = time.perf_counter()
+            for _ in range(self.number):
+                self.function()
+            timings.append((time.perf_counter() - start_time) / self.number)
+        return {"median_seconds": statistics.median(timings), "min_seconds": min(timings)}
+
+
+def ebm_input(initial_temperature=30.0):
+    return {"model_name": "Benchmark", "initial_temperature": initial_temperature,
+            "insolation": Constants.INSOLATION_OBSERVED, "albedo": Constants.ALPHA, "tau": Constants.TAU}
+
+
+def run_ebm(engine):
+    model = ZeroDimensionalEnergyBalanceModel("Benchmark", 30.0, Constants.INSOLATION_OBSERVED, Constants.ALPHA,
+                                              Constants.TAU, engine=engine)
+    model.run()
+
+
+def run_ensemble(number_of_members):
+    model = ZeroDimensionalEnergyBalanceEnsemble("Benchmark", list(range(number_of_members)), [Constants.INSOLATION_OBSERVED],
+                                                 [Constants.ALPHA], [Constants.TAU])
+    model.run()
+
+
+def run_rcp(scenario_number):
+    model = RcpModel("Benchmark", scenario_number)
+    model.run()
+
+
+class UncachedEBMRequests:
+    # Posts EBM requests with a different initial temperature each time so the result cache is never hit
+    def __init__(self, client):
+        self.client = client
+        self.initial_temperature = -100.
+
+    def post(self):
+        self.initial_temperature = self.initial_temperature + 0.001 if self.initial_temperature < 100 else -100.
+        self.client.post("/execute/EBM", json=ebm_input(self.initial_temperature))
+
+
+class UncachedEBMContinueRequests:
+    # Posts continuations of an EBM run from a snapshot with a different temperature each time so the cache is never hit
+    def __init__(self, client):
+        self.client = client
+        self.snapshot = client.post("/execute/EBM", json=ebm_input()).json()["snapshot"]
+
+    def post(self):
+        self.snapshot["temperature"] = self.snapshot["temperature"] + 0.001 if self.snapshot["temperature"] < 100 else -100.
+        self.client.post("/execute/EBM/continue", json={"model_name": "Benchmark", "snapshot": self.snapshot})
+
+
+def get_benchmarks():
+    client = TestClient(app)
+    uncached_requests = UncachedEBMRequests(client)
+    uncached_continue_requests = UncachedEBMContinueRequests(client)
+    batch_members = 1000
+    batch_input = {"model_name": "Benchmark", "initial_temperature": list(range(-50, 50)),
+                   "insolation": [Constants.INSOLATION_OBSERVED], "albedo": [0.2, 0.3, 0.4, 0.5, 0.6],
+                   "tau": [0.5, 0.6], "grid": True}
+    # Emissions rising steadily from 1765 to 2100, the same length as the RCP scenarios
+    custom_years = 336
+    custom_emissions = np.linspace(0., 20., custom_years)
+    custom_csv = "\n".join(str(value) for value in custom_emissions)
+    custom_float64 = custom_emissions.astype("<f8").tobytes()
+    compare_input = {"model_name": "Benchmark", "rcp_scenarios": list(RcpModel.rcp_scenario_dict),
+                     "include_concentrations": True, "include_forcing": True, "baseline_scenario": 1}
+    monte_carlo_members = 10
+    monte_carlo_input = {"model_name": "Benchmark", "rcp_scenario": 2, "number_of_members": monte_carlo_members}
+
+    benchmarks = [
+        # Models
+        Benchmark("model.ebm.numpy", lambda: run_ebm("numpy"), number=10),
+        Benchmark("model.ebm.climlab", lambda: run_ebm("climlab")),
+        Benchmark(f"model.ebm_ensemble.{batch_members}_members", lambda: run_ensemble(batch_members)),
+        # Validators
+        Benchmark("validator.ebm", lambda: EBMValidator(ZeroDimensionEBMInput(**ebm_input())).validate_all(), number=1000),
+        Benchmark("validator.ebm_batch",
+                  lambda: EBMBatchValidator(ZeroDimensionEBMBatchInput(**batch_input)).validate_all(), number=100),
+        Benchmark("validator.rcp_fair",
+                  lambda: RcpFAIRValidator(FAIRPresetInput(model_name="Benchmark", rcp_scenario=1)).validate_all(),
+                  number=1000),
+        # Endpoints
+        Benchmark("endpoint.root", lambda: client.get("/"), number=100),
+        Benchmark("endpoint.ebm.uncached", uncached_requests.post, number=20),
+        Benchmark("endpoint.ebm.cached", lambda: client.post("/execute/EBM", json=ebm_input()), number=100),
+        Benchmark(f"endpoint.ebm_batch.{batch_members}_members", lambda: client.post("/execute/EBM/batch", json=batch_input)),
+        Benchmark("endpoint.ebm_continue.uncached", uncached_continue_requests.post, number=20),
+        # Custom emissions are not cached, so every request runs the model
+        Benchmark(f"endpoint.fair_custom.{custom_years}_years_csv",
+                  lambda: client.post("/execute/FAIR/custom", params={"model_name": "Benchmark"}, data=custom_csv,
+                                      headers={"Content-Type": "text/csv"})),
+        Benchmark(f"endpoint.fair_custom.{custom_years}_years_float64",
+                  lambda: client.post("/execute/FAIR/custom", params={"model_name": "Benchmark"}, data=custom_float64,
+                                      headers={"Content-Type": "application/octet-stream"})),
+        # Scenarios come from the preset cache (after the first call) so this measures combining and serialising them
+        Benchmark("endpoint.fair_compare.all_scenarios", lambda: client.post("/execute/FAIR/compare", json=compare_input),
+                  number=20),
+        # Ensembles are not cached, and each member takes a large fraction of a second, so only a few are run
+        Benchmark(f"endpoint.fair_montecarlo.{monte_carlo_members}_members",
+                  lambda: client.post("/execute/FAIR/montecarlo", json=monte_carlo_input), repeat=3),
+    ]
+    for scenario_number in RcpModel.rcp_scenario_dict:
+        benchmarks.append(Benchmark(f"model.rcp.scenario_{scenario_number}", lambda number=scenario_number: run_rcp(number)))
+        benchmarks.append(Benchmark(f"endpoint.fair_preset.scenario_{scenario_number}",
+                                    lambda number=scenario_number: client.post("/execute/FAIR/preset",
+                                                                               json={"model_name": "Benchmark",
+                                                                                     "rcp_scenario": number}),
+                                    number=20))
+    return benchmarks
+
+
+def measure_startup(module, repeat=5):
+    # Imports the module in fresh interpreters, returning the median import time, the median peak memory (RSS)
+    # and the heavy modules which were loaded along with it
+    measurements = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)],
+                                cwd=REPOSITORY_ROOT, capture_output=True, text=True, check=True).stdout
+        measurements.append(json.loads(output.splitlines()[-1]))
+    return {"import_seconds": statistics.median(measurement["import_seconds"] for measurement in measurements),
+            "max_rss_bytes": statistics.median(measurement["max_rss_bytes"] for measurement in measurements),
+            "heavy_modules": measurements[0]["heavy_modules"]}
+
+
+def find_startup_problems(results):
+    # Heavy modules loaded at startup are always a problem, whatever the baseline
+    return [f"startup.{module}: imports {', '.join(result['heavy_modules'])}"
+            for module, result in results.get("startup", {}).items() if result["heavy_modules"]]
+
+
+def run_load_test(number_of_requests=2000, concurrency=16, port=None):
+    # Starts a local uvicorn server and sends it requests from several threads at once
+    # Returns latency percentiles in seconds and throughput in requests per second
+    port = port or find_free_port()
+    # The queue is made deep enough for every client, otherwise on machines with few cores requests are rejected
+    # by the simulation pool and the errors depend on the number of cores rather than on the code
+    # Jobs stored by the server are kept in a temporary directory rather than the checkout
+    jobs_directory = tempfile.TemporaryDirectory()
+    environment = os.environ | {"SIMULATION_POOL_MAX_QUEUE": str(concurrency), "JOBS_DIRECTORY": jobs_directory.name}
+    server = start_server(port, environment)
+    try:
+        wait_for_server(port)
+        wait_for_rcp_presets(port)
+        request_bodies = [json.dumps(ebm_input(-100 + 200 * request_num / number_of_requests))
+                          if request_num % 2 else json.dumps({"model_name": "Benchmark", "rcp_scenario": request_num % 4 + 1})
+                          for request_num in range(number_of_requests)]
+
+        def send(request_body):
+            path = "/execute/FAIR/preset" if "rcp_scenario" in request_body else "/execute/EBM"
+            connection = http.client.HTTPConnection("127.0.0.1", port)
+            start_time = time.perf_counter()
+            connection.request("POST", path, body=request_body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            return time.perf_counter() - start_time, response.status
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send, request_bodies))
+        total_time = time.perf_counter() - start_time
+    finally:
+        server.terminate()
+        server.wait()
+        jobs_directory.cleanup()
+
+    latencies = sorted(latency for latency, status in results)
+    return {"p50_seconds": percentile(latencies, 50),
+            "p95_seconds": percentile(latencies, 95),
+            "p99_seconds": percentile(latencies, 99),
+            "throughput_per_second": number_of_requests / total_time,
+            "errors": sum(1 for latency, status in results if status != 200)}
+
+
+def measure_server_memory(shared, number_of_servers=MEMORY_SERVERS):
+    # Starts several uvicorn servers and returns the mean memory of each (including its simulation pool workers)
+    # once they have all precomputed the RCP presets. Each server runs on its own port, rather than as one of the
+    # workers of a single uvicorn, so that every one of them can be waited for. Reads /proc so only runs on Linux
+    # params shared: whether the servers share the RCP arrays through SHARED_DATA_DIRECTORY
+    with tempfile.TemporaryDirectory() as directory:
+        environment = os.environ | {"JOBS_DIRECTORY": os.path.join(directory, "jobs"), "SIMULATION_POOL_WORKERS": "1"}
+        environment.pop("SHARED_DATA_DIRECTORY", None)
+        if shared:
+            environment["SHARED_DATA_DIRECTORY"] = os.path.join(directory, "shared")
+        ports = [find_free_port() for _ in range(number_of_servers)]
+        servers = [start_server(port, environment) for port in ports]
+        try:
+            for port in ports:
+                wait_for_server(port)
+                wait_for_rcp_presets(port)
+            memory = [read_memory(pid) for server in servers for pid in get_process_tree(server.pid)]
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+    return {"rss_bytes_per_server": sum(process["rss_bytes"] for process in memory) / number_of_servers,
+            "pss_bytes_per_server": sum(process["pss_bytes"] for process in memory) / number_of_servers}
+
+
+def get_process_tree(pid):
+    # The process and all of its descendants
+    pids = [pid]
+    for thread_id in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{thread_id}/children") as file:
+            for child_pid in file.read().split():
+                pids.extend(get_process_tree(int(child_pid)))
+    return pids
+
+
+def read_memory(pid):
+    # Resident set size and proportional set size of a process in bytes
+    # Pages shared by several processes count in full towards the RSS of each, but are divided between them in the PSS,
+    # so only the PSS shows the saving of sharing arrays
+    memory = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            fields = line.split()
+            if fields[0] in ("Rss:", "Pss:"):
+                memory[f"{fields[0][:-1].lower()}_bytes"] = int(fields[1]) * 1024
+    return memory
+
+
+def start_server(port, environment):
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=REPOSITORY_ROOT, env=environment)
+
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile of an already sorted list
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def find_free_port():
+    with socket.socket() as free_socket:
+        free_socket.bind(("127.0.0.1", 0))
+        return free_socket.getsockname()[1]
+
+
+def wait_for_server(port, timeout=60.):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start within {timeout} seconds")
+
+
+def wait_for_rcp_presets(port, timeout=120.):
+    # Waits for the server to finish precomputing the RCP presets, which otherwise keeps the simulation pool busy
+    # for the first few seconds so the load test would measure startup rather than steady-state handling
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+        connection.request("GET", "/metrics")
+        for line in connection.getresponse().read().decode().splitlines():
+            if line.startswith("rcp_cache_scenarios ") and float(line.split()[1]) >= len(RcpModel.rcp_scenario_dict):
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"RCP presets were not precomputed within {timeout} seconds")
+
+
+def find_regressions(results, baseline, threshold):
+    # Returns descriptions of every result which is worse than its baseline by more than the threshold
+    regressions = []
+    for name, result in results.get("benchmarks", {}).items():
+        baseline_result = baseline.get("benchmarks", {}).get(name)
+        if baseline_result is not None and result["median_seconds"] > baseline_result["median_seconds"] * threshold:
+            regressions.append(f"{name}: {result['median_seconds']:.6f}s vs baseline {baseline_result['median_seconds']:.6f}s")
+    # An absolute target rather than relative to the baseline, as it is the reason the batch endpoint exists
+    if results.get("batch_speedup") is not None and results["batch_speedup"] < BATCH_SPEEDUP_TARGET:
+        regressions.append(f"batch_speedup: {results['batch_speedup']:.1f}x vs target {BATCH_SPEEDUP_TARGET}x")
+
+    load_result, baseline_load_result = results.get("load"), baseline.get("load")
+    if load_result is not None and baseline_load_result is not None:
+        for name in ("p50_seconds", "p95_seconds", "p99_seconds"):
+            if load_result[name] > baseline_load_result[name] * threshold:
+                regressions.append(f"load.{name}: {load_result[name]:.4f}s vs baseline {baseline_load_result[name]:.4f}s")
+        if load_result["throughput_per_second"] < baseline_load_result["throughput_per_second"] / threshold:
+            regressions.append(f"load.throughput_per_second: {load_result['throughput_per_second']:.1f} vs baseline "
+                               f"{baseline_load_result['throughput_per_second']:.1f}")
+        if load_result["errors"] > baseline_load_result["errors"]:
+            regressions.append(f"load.errors: {load_result['errors']} vs baseline {baseline_load_result['errors']}")
+
+    for configuration, result in results.get("memory", {}).items():
+        baseline_result = baseline.get("memory", {}).get(configuration)
+        if baseline_result is not None and result["pss_bytes_per_server"] > baseline_result["pss_bytes_per_server"] * threshold:
+            regressions.append(f"memory.{configuration}.pss_bytes_per_server: {result['pss_bytes_per_server']:.0f} vs "
+                               f"baseline {baseline_result['pss_bytes_per_server']:.0f}")
+
+    for module, result in results.get("startup", {}).items():
+        baseline_result = baseline.get("startup", {}).get(module)
+        if baseline_result is None:
+            continue
+        if result["import_seconds"] > baseline_result["import_seconds"] * threshold:
+            regressions.append(f"startup.{module}.import_seconds: {result['import_seconds']:.4f}s vs baseline "
+                               f"{baseline_result['import_seconds']:.4f}s")
+        if result["max_rss_bytes"] > baseline_result["max_rss_bytes"] * threshold:
+            regressions.append(f"startup.{module}.max_rss_bytes: {result['max_rss_bytes']} vs baseline "
+                               f"{baseline_result['max_rss_bytes']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the climate models and API")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--skip-load", action="store_true", help="do not run the uvicorn load test")
+    parser.add_argument("--skip-startup", action="store_true", help="do not measure import time and memory at startup")
+    parser.add_argument("--skip-memory", action="store_true",
+                        help="do not measure the memory of several servers with and without shared arrays")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this text")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="slowdown relative to the baseline which counts as a regression")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    arguments = parser.parse_args()
+
+    results = {"benchmarks": {}}
+    for benchmark in get_benchmarks():
+        if arguments.filter in benchmark.name:
+            results["benchmarks"][benchmark.name] = benchmark.run()
+            print(f"{benchmark.name:45} {results['benchmarks'][benchmark.name]['median_seconds'] * 1000:10.3f} ms")
+
+    # Members per second of the batch endpoint compared with looping over the single endpoint
+    batch_result = results["benchmarks"].get("endpoint.ebm_batch.1000_members")
+    single_result = results["benchmarks"].get("endpoint.ebm.uncached")
+    if batch_result is not None and single_result is not None:
+        results["batch_speedup"] = single_result["median_seconds"] * 1000 / batch_result["median_seconds"]
+        print(f"{'batch members/s vs single endpoint':45} {results['batch_speedup']:10.1f} x")
+
+    if not arguments.skip_load:
+        results["load"] = run_load_test()
+        print("load test: " + ", ".join(f"{name}={value:.4f}" for name, value in results["load"].items()))
+
+    if not arguments.skip_memory:
+        results["memory"] = {"unshared": measure_server_memory(shared=False), "shared": measure_server_memory(shared=True)}
+        for configuration, result in results["memory"].items():
+            print(f"memory of {MEMORY_SERVERS} servers, {configuration} arrays: "
+                  f"RSS {result['rss_bytes_per_server'] / 2 ** 20:.1f} MiB, "
+                  f"PSS {result['pss_bytes_per_server'] / 2 ** 20:.1f} MiB per server")
+
+    if not arguments.skip_startup:
+        results["startup"] = {module: measure_startup(module) for module in STARTUP_MODULES}
+        for module, result in results["startup"].items():
+            print(f"startup {module}: import {result['import_seconds'] * 1000:.1f} ms, "
+                  f"max RSS {result['max_rss_bytes'] / 2 ** 20:.1f} MiB")
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    startup_problems = find_startup_problems(results)
+    for problem in startup_problems:
+        print(f"REGRESSION {problem}")
+
+    if arguments.save_baseline:
+        with open(BASELINE_PATH, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved baseline to {BASELINE_PATH}")
+        return 1 if startup_problems else 0
+
+    if not os.path.exists(BASELINE_PATH):
+        # Fails rather than passing so a deleted or misplaced baseline cannot hide regressions
+        print("No baseline to compare with, run with --save-baseline to create one")
+        return 1
+    with open(BASELINE_PATH) as file:
+        baseline = json.load(file)
+    regressions = find_regressions(results, baseline, arguments.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions or startup_problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+from collections import OrderedDict
+import numpy as np
+from models import ZeroDimensionalEnergyBalanceModel
+from shared_data import atomic_write
+
+# Caches of simulation results so that repeated requests do not re-run the models
+
+
+def canonical_key(inputs):
+    # Hash of a dictionary of inputs so equal inputs always give the same key
+    # Numbers (also inside lists) are converted to floats so that for example 30 and 30.0 share a key
+    def canonical(value):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value) + 0.0
+        if isinstance(value, (list, tuple)):
+            return [canonical(item) for item in value]
+        return value
+
+    canonical_inputs = {name: canonical(value) for name, value in inputs.items()}
+    return hashlib.sha256(json.dumps(canonical_inputs, sort_keys=True).encode()).hexdigest()
+
+
+class RcpResultCache:
+    # The preset RCP scenarios always give the same output so each scenario is only run once
+    # Results are also stored already serialised to JSON so repeat requests skip both the model run and the
+    # conversion of the output lists; only the echoed input is serialised per request
+    OUTPUTS = ("temperatures", "times", "co2_concentrations", "forcing")
+
+    def __init__(self, shared_store=None):
+        # params shared_store: SharedArrayStore so the output arrays are stored once for every server worker, or None
+        self.results = {}  # Mapping of RCP scenario number to dictionary of output arrays (see OUTPUTS)
+        self.serialised_results = {}  # Mapping of RCP scenario number to serialised temperature-time data
+        self.shared_store = shared_store
+
+    def contains(self, scenario_number):
+        return scenario_number in self.results
+
+    def attach_shared(self, scenario_number):
+        # Uses output another worker has already stored in the shared store, returning whether there was any
+        if self.shared_store is None:
+            return False
+        simulation_data = {name: self.shared_store.get(f"rcp_{scenario_number}_output_{name}") for name in self.OUTPUTS}
+        if any(array is None for array in simulation_data.values()):
+            return False
+        self.store(scenario_number, simulation_data)
+        return True
+
+    def get(self, scenario_number):
+        # Dictionary of temperature and time arrays for the scenario
+        return {name: self.results[scenario_number][name] for name in ("temperatures", "times")}
+
+    def get_all(self, scenario_number):
+        # Dictionary of every output array for the scenario, including CO2 concentrations and forcing
+        return self.results[scenario_number]
+
+    def store(self, scenario_number, simulation_data):
+        # params simulation_data: dictionary of the arrays in OUTPUTS from the model (temperatures and times are required)
+        arrays = {name: np.asarray(simulation_data[name], dtype=float) for name in self.OUTPUTS if name in simulation_data}
+        if self.shared_store is not None:
+            # Replaced by the read-only shared copies so this worker does not keep its own
+            arrays = {name: self.shared_store.put(f"rcp_{scenario_number}_output_{name}", array)
+                      for name, array in arrays.items()}
+        self.results[scenario_number] = arrays
+        temperatures, times = arrays["temperatures"], arrays["times"]
+        # Outer braces are removed so that the echoed input can be joined on in response_body
+        serialised_data = json.dumps({"temperatures": temperatures.tolist(), "times": times.tolist()})
+        self.serialised_results[scenario_number] = serialised_data[1:-1].encode()
+
+    def response_body(self, model_input):
+        # JSON response body of the input fields combined with the cached output for its scenario
+        serialised_input = json.dumps(model_input.dict())
+        return serialised_input[:-1].encode() + b", " + self.serialised_results[model_input.rcp_scenario] + b"}"
+
+
+class EBMResultCache:
+    # Least recently used cache of EBM outputs keyed on a hash of the physics inputs of the model
+    # Has an in-memory tier limited by number of entries and bytes, and an optional on-disk tier which survives restarts
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, directory=None,
+                 engine_version=ZeroDimensionalEnergyBalanceModel.ENGINE_VERSION):
+        # params directory: folder for the on-disk tier, or None to only cache in memory
+        # params engine_version: results from other engine versions in the directory are deleted
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # Mapping of key to (temperatures, times) arrays, least recently used first
+        self.size_in_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0  # Hits which were found on disk (also counted in hits)
+        self.misses = 0
+
+        self.directory = None
+        if directory is not None:
+            self.directory = os.path.join(directory, f"engine_version_{engine_version}")
+            os.makedirs(self.directory, exist_ok=True)
+            # Invalidate results produced by any other engine version
+            for folder_name in os.listdir(directory):
+                folder_path = os.path.join(directory, folder_name)
+                if folder_name.startswith("engine_version_") and folder_path != self.directory:
+                    shutil.rmtree(folder_path, ignore_errors=True)
+
+    @classmethod
+    def from_environment(cls):
+        # Cache configured through EBM_CACHE_MAX_ENTRIES, EBM_CACHE_MAX_BYTES and EBM_CACHE_DIRECTORY environment variables
+        return cls(max_entries=int(os.environ.get("EBM_CACHE_MAX_ENTRIES", 1024)),
+                   max_bytes=int(os.environ.get("EBM_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+                   directory=os.environ.get("EBM_CACHE_DIRECTORY") or None)
+
+    @staticmethod
+    def key(physics_inputs):
+        # Canonical hash of the physics inputs so equal inputs always give the same key
+        return canonical_key(physics_inputs)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def get(self, key):
+        # Returns dictionary of temperature and time arrays for the key or None if it is not cached
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            temperatures, times = self.entries[key]
+        elif self.directory is not None and os.path.exists(self.get_path(key)):
+            times, temperatures = np.load(self.get_path(key))
+            self.add_to_memory(key, temperatures, times)
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"temperatures": temperatures, "times": times}
+
+    def put(self, key, simulation_data):
+        # params simulation_data: dictionary of temperatures and times from the model
+        temperatures = np.asarray(simulation_data["temperatures"], dtype=float)
+        times = np.asarray(simulation_data["times"], dtype=float)
+        self.add_to_memory(key, temperatures, times)
+        if self.directory is not None:
+            # Other processes never read a partly written result
+            with atomic_write(self.get_path(key)) as file:
+                np.save(file, np.stack([times, temperatures]))
+
+    def add_to_memory(self, key, temperatures, times):
+        if key in self.entries:
+            old_temperatures, old_times = self.entries.pop(key)
+            self.size_in_bytes -= old_temperatures.nbytes + old_times.nbytes
+        self.entries[key] = (temperatures, times)
+        self.size_in_bytes += temperatures.nbytes + times.nbytes
+        # Remove least recently used entries until within limits
+        while len(self.entries) > self.max_entries or (self.size_in_bytes > self.max_bytes and len(self.entries) > 1):
+            old_temperatures, old_times = self.entries.popitem(last=False)[1]
+            self.size_in_bytes -= old_temperatures.nbytes + old_times.nbytes
+
+    def get_path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def clear(self):
+        # Remove every cached result from memory and disk
+        self.entries.clear()
+        self.size_in_bytes = 0
+        if self.directory is not None:
+            for file_name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, file_name))
+
+
+class SingleFlight:
+    # Lets identical simulations requested at the same time share one run
+    # The first request for a key starts the run and later requests for the same key wait for its result
+    # (including any error) instead of starting their own; the key is released as soon as the run finishes
+    def __init__(self):
+        self.in_flight = {}  # Mapping of key to the task running the simulation
+        self.runs = 0
+        self.coalesced = 0  # Requests which shared a run already in progress
+
+    async def run(self, key, function):
+        # params function: coroutine function (taking no arguments) whose result is shared
+        task = self.in_flight.get(key)
+        if task is None:
+            # Run as its own task so the shared run carries on even if the request which started it is cancelled
+            task = asyncio.create_task(function())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda finished_task: self.release(key, finished_task))
+            self.runs += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def release(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
@@ -0,0 +1,90 @@
+import numpy as np
+
+# Reducing simulation output to a window of time and a maximum number of points before it is serialised
+# so the size of a response depends on what the client asked for rather than the length of the run
+
+METHODS = ("stride", "mean", "lttb")
+
+
+def slice_window(times, temperatures, start=None, end=None):
+    # Views of the arrays keeping only samples with start <= time <= end (times must be in increasing order)
+    # params temperatures: 1-D array, or 2-D array with one row per member which share the times
+    first = 0 if start is None else np.searchsorted(times, start, side="left")
+    last = len(times) if end is None else np.searchsorted(times, end, side="right")
+    return times[first:last], temperatures[..., first:last]
+
+
+def stride_indices(number_of_points, max_points):
+    # Evenly spaced indices which always include the first and last point
+    return np.unique(np.linspace(0, number_of_points - 1, max_points).round().astype(int))
+
+
+def bucket_means(times, temperatures, max_points):
+    # Splits the points into max_points buckets of consecutive samples and returns the mean of each
+    bucket_starts = np.linspace(0, len(times), max_points, endpoint=False).astype(int)
+    bucket_sizes = np.diff(np.append(bucket_starts, len(times)))
+    return (np.add.reduceat(times, bucket_starts) / bucket_sizes,
+            np.add.reduceat(temperatures, bucket_starts, axis=-1) / bucket_sizes)
+
+
+def lttb_indices(times, temperatures, max_points):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point, then from each bucket of the points in between
+    # keeps the one making the largest triangle with the previous kept point and the mean of the next bucket
+    # This keeps peaks and troughs which striding or averaging would lose
+    # For 2-D temperatures the areas of every member are summed so all members keep the same times
+    number_of_points = len(times)
+    if max_points < 3:
+        return stride_indices(number_of_points, max_points)
+    values = np.atleast_2d(temperatures)
+    bucket_edges = np.linspace(1, number_of_points - 1, max_points - 1).astype(int)
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, number_of_points - 1
+
+    selected = 0
+    for bucket_num in range(max_points - 2):
+        bucket_start, bucket_end = bucket_edges[bucket_num], bucket_edges[bucket_num + 1]
+        if bucket_num < max_points - 3:
+            next_start, next_end = bucket_edges[bucket_num + 1], bucket_edges[bucket_num + 2]
+        else:
+            next_start, next_end = number_of_points - 1, number_of_points
+        mean_time = times[next_start:next_end].mean()
+        mean_values = values[:, next_start:next_end].mean(axis=1, keepdims=True)
+        selected_values = values[:, selected:selected + 1]
+        # Twice the area of each triangle, which has the same maximum
+        areas = np.abs((times[selected] - mean_time) * (values[:, bucket_start:bucket_end] - selected_values)
+                       - (times[selected] - times[bucket_start:bucket_end]) * (mean_values - selected_values)).sum(axis=0)
+        selected = bucket_start + int(np.argmax(areas))
+        indices[bucket_num + 1] = selected
+    return indices
+
+
+def downsample(times, temperatures, start=None, end=None, max_points=None, method="stride"):
+    # Applies the time window and then reduces the output to at most max_points samples with the chosen method
+    # Returns (times, temperatures) with temperatures keeping its number of dimensions
+    times, temperatures = slice_window(times, temperatures, start, end)
+    if max_points is None or len(times) <= max_points:
+        return times, temperatures
+    if method == "mean":
+        return bucket_means(times, temperatures, max_points)
+    indices = lttb_indices(times, temperatures, max_points) if method == "lttb" else stride_indices(len(times), max_points)
+    return times[indices], temperatures[..., indices]
+
+
+def downsample_arrays(times, arrays, start=None, end=None, max_points=None, method="stride"):
+    # Applies downsample to several arrays sharing the times, keeping the same samples of every array
+    # params arrays: dictionary of 1-D arrays or 2-D arrays with one row per series
+    # Returns (times, dictionary of the reduced arrays) with each array keeping its number of dimensions
+    if len(arrays) == 1:
+        name, array = next(iter(arrays.items()))
+        times, array = downsample(times, array, start, end, max_points, method)
+        return times, {name: array}
+
+    # Rows of every array are reduced together as one 2-D array, after the window is applied so less is copied
+    windowed_arrays = {name: slice_window(times, array, start, end)[1] for name, array in arrays.items()}
+    times, _ = slice_window(times, times, start, end)
+    times, rows = downsample(times, np.vstack([np.atleast_2d(array) for array in windowed_arrays.values()]),
+                             max_points=max_points, method=method)
+    row_counts = [int(np.prod(array.shape[:-1])) for array in windowed_arrays.values()]
+    split_rows = np.split(rows, np.cumsum(row_counts)[:-1])
+    return times, {name: array_rows.reshape(array.shape[:-1] + (-1,))
+                   for (name, array), array_rows in zip(windowed_arrays.items(), split_rows)}
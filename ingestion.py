@@ -0,0 +1,117 @@
+import codecs
+import json
+import numpy as np
+
+# Reads arrays of numbers from request bodies as they arrive, without building one large list of Python floats
+
+CSV_MEDIA_TYPE = "text/csv"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+FLOAT64_MEDIA_TYPE = "application/octet-stream"  # raw little-endian float64 values
+MEDIA_TYPES = (CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE, FLOAT64_MEDIA_TYPE)
+
+
+class IngestionError(Exception):
+    # Raised when the request body cannot be read as an array of numbers
+    pass
+
+
+class ArrayBuilder:
+    # Collects floats into a numpy array which grows (doubling in size) as values are added
+    def __init__(self, max_length, capacity=1024):
+        # params max_length: most values allowed, reading stops with an error if the body has more
+        self.buffer = np.empty(capacity)
+        self.length = 0
+        self.max_length = max_length
+
+    @property
+    def array(self):
+        # Array of the values added so far (a view of the buffer, not a copy)
+        return self.buffer[:self.length]
+
+    def extend(self, values):
+        if self.length + len(values) > self.max_length:
+            raise IngestionError(f"Too many values, at most {self.max_length} are allowed")
+        if self.length + len(values) > self.buffer.size:
+            self.buffer = np.resize(self.buffer, max(self.length + len(values), 2 * self.buffer.size))
+        self.buffer[self.length:self.length + len(values)] = values
+        self.length += len(values)
+
+
+class CsvParser:
+    # Each line is either a value or "year,value"; only the last column is kept
+    # The first line may be a header, which is skipped if it is not numeric
+    def __init__(self):
+        self.first_line = True
+
+    def parse_lines(self, lines):
+        values = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                values.append(float(line.rsplit(",", 1)[-1]))
+            except ValueError:
+                if not self.first_line:
+                    raise IngestionError(f"Could not read '{line.strip()}' as a number")
+            self.first_line = False
+        return values
+
+
+class NdjsonParser:
+    # Each line is a JSON number or an array of JSON numbers
+    def parse_lines(self, lines):
+        values = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                value = json.loads(line)
+            except ValueError:
+                raise IngestionError(f"Could not read '{line.strip()}' as JSON")
+            values.extend(value if isinstance(value, list) else [value])
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            raise IngestionError("Every value must be a JSON number")
+        return values
+
+
+async def read_text(stream, parser, builder):
+    # Parses the complete lines of each chunk as it arrives, keeping any partial line until the next chunk
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    partial_line = ""
+    try:
+        async for chunk in stream:
+            lines = (partial_line + decoder.decode(chunk)).split("\n")
+            partial_line = lines.pop()
+            builder.extend(parser.parse_lines(lines))
+        builder.extend(parser.parse_lines([partial_line + decoder.decode(b"", final=True)]))
+    except UnicodeDecodeError:
+        raise IngestionError("Request body must be UTF-8 text")
+
+
+async def read_float64(stream, builder):
+    # Copies whole float64 values straight from each chunk, keeping any partial value until the next chunk
+    partial_value = b""
+    async for chunk in stream:
+        data = partial_value + chunk
+        whole_length = len(data) - len(data) % 8
+        builder.extend(np.frombuffer(data, dtype="<f8", count=whole_length // 8))
+        partial_value = data[whole_length:]
+    if partial_value:
+        raise IngestionError("Request body length must be a multiple of 8 bytes (float64 values)")
+
+
+async def read_array(stream, content_type, max_length):
+    # Reads a request body stream into a float64 numpy array according to its content type
+    # params stream: async iterator of bytes chunks
+    # params max_length: most values allowed
+    media_type = (content_type or "").split(";")[0].strip()
+    builder = ArrayBuilder(max_length)
+    if media_type == CSV_MEDIA_TYPE:
+        await read_text(stream, CsvParser(), builder)
+    elif media_type == NDJSON_MEDIA_TYPE:
+        await read_text(stream, NdjsonParser(), builder)
+    elif media_type == FLOAT64_MEDIA_TYPE:
+        await read_float64(stream, builder)
+    else:
+        raise IngestionError(f"Content type must be one of {', '.join(MEDIA_TYPES)}")
+    return builder.array
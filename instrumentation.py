@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Timing of each phase of a request, Prometheus metrics and structured logging
+
+
+class PhaseTimer:
+    # Records how long each phase of handling one request took
+    def __init__(self):
+        self.durations = {}  # Mapping of phase name to seconds, in the order the phases happened
+
+    @contextmanager
+    def phase(self, name):
+        # Times the code inside the with block as the named phase
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+    def add(self, name, seconds):
+        # Adds time to a phase (phases which happen more than once are summed)
+        self.durations[name] = self.durations.get(name, 0.) + seconds
+
+    def add_all(self, durations):
+        for name, seconds in durations.items():
+            self.add(name, seconds)
+
+    def server_timing_header(self):
+        # Value of the Server-Timing header, with durations in milliseconds
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.durations.items())
+
+
+# Timer of the request currently being handled
+current_timer: ContextVar[PhaseTimer | None] = ContextVar("current_timer", default=None)
+
+
+@contextmanager
+def timed_phase(name):
+    # Times the code inside the with block as a phase of the current request (does nothing outside a request)
+    timer = current_timer.get()
+    if timer is None:
+        yield
+    else:
+        with timer.phase(name):
+            yield
+
+
+def add_phase_timings(durations):
+    # Adds timings measured elsewhere (for example inside a worker process) to the current request
+    timer = current_timer.get()
+    if timer is not None:
+        timer.add_all(durations)
+
+
+class Histogram:
+    # Prometheus histogram with one series per label value
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+    def __init__(self, name, description, label_name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_name = label_name
+        self.buckets = buckets
+        self.series = {}  # Mapping of label value to [bucket counts..., sum, count]
+
+    def observe(self, label_value, seconds):
+        if label_value not in self.series:
+            self.series[label_value] = [0] * len(self.buckets) + [0., 0]
+        series = self.series[label_value]
+        # Only the first bucket the value fits in is counted here, render makes the counts cumulative
+        bucket_num = bisect_left(self.buckets, seconds)
+        if bucket_num < len(self.buckets):
+            series[bucket_num] += 1
+        series[-2] += seconds
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for label_value, series in self.series.items():
+            cumulative_count = 0
+            for upper_bound, count in zip(self.buckets, series):
+                cumulative_count += count
+                lines.append(f'{self.name}_bucket{{{self.label_name}="{label_value}",le="{upper_bound}"}} {cumulative_count}')
+            lines.append(f'{self.name}_bucket{{{self.label_name}="{label_value}",le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{self.label_name}="{label_value}"}} {series[-2]}')
+            lines.append(f'{self.name}_count{{{self.label_name}="{label_value}"}} {series[-1]}')
+        return lines
+
+
+class Metrics:
+    # Collection of metrics rendered in the Prometheus text format
+    def __init__(self):
+        self.request_duration = Histogram("http_request_duration_seconds", "Time taken to handle each request", "handler")
+        self.phase_duration = Histogram("request_phase_duration_seconds", "Time taken by each phase of handling a request",
+                                        "phase")
+        self.gauges = []  # List of (name, description, type, function returning the current value)
+
+    def add_gauge(self, name, description, value_function, metric_type="gauge"):
+        # Value is read from value_function each time the metrics are rendered
+        self.gauges.append((name, description, metric_type, value_function))
+
+    def observe_request(self, handler, seconds, timer):
+        self.request_duration.observe(handler, seconds)
+        for phase, phase_seconds in timer.durations.items():
+            self.phase_duration.observe(phase, phase_seconds)
+
+    def render(self):
+        lines = self.request_duration.render() + self.phase_duration.render()
+        for name, description, metric_type, value_function in self.gauges:
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}", f"{name} {value_function()}"]
+        return "\n".join(lines) + "\n"
+
+
+class JsonFormatter(logging.Formatter):
+    # Formats each log record as one JSON object per line, including any fields passed with extra=
+    STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+    def format(self, record):
+        log_entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                     "message": record.getMessage()}
+        log_entry |= {name: value for name, value in vars(record).items() if name not in self.STANDARD_ATTRIBUTES}
+        if record.exc_info:
+            log_entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(log_entry, default=str)
+
+
+def configure_logging(name="climate_api"):
+    # Logger writing structured JSON lines, with the level set by the LOG_LEVEL environment variable (default INFO)
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    return logger
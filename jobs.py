@@ -0,0 +1,277 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from contextvars import ContextVar
+import numpy as np
+from shared_data import atomic_write
+
+# Asynchronous simulation jobs which run in the background and whose results are stored on disk
+
+logger = logging.getLogger("climate_api")
+
+
+class JobQueueFullError(Exception):
+    # Raised when too many jobs are already waiting to run
+    pass
+
+
+class JobRetryError(Exception):
+    # Raised by run_job when a job cannot run yet (for example the simulation pool is full) and should be tried again
+    pass
+
+
+# Function the running job reports its progress to, set by the scheduler while it runs a job
+current_progress_reporter = ContextVar("current_progress_reporter", default=None)
+
+
+def report_progress(progress):
+    # Records the fraction (0 to 1) of the current job which is done (does nothing outside a job)
+    reporter = current_progress_reporter.get()
+    if reporter is not None:
+        reporter(progress)
+
+
+class JobStore:
+    # Stores jobs in an SQLite database, with the output arrays of completed jobs in .npz files alongside it
+    # so results survive restarts and can be fetched any number of times without re-running the model
+    STATUSES = ("queued", "running", "completed", "failed")
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(directory, "jobs.sqlite3"), check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                         id TEXT PRIMARY KEY,
+                                         model_type TEXT NOT NULL,
+                                         priority INTEGER NOT NULL,
+                                         status TEXT NOT NULL,
+                                         progress REAL NOT NULL,
+                                         input TEXT NOT NULL,
+                                         response_input TEXT,
+                                         error TEXT,
+                                         created_at REAL NOT NULL,
+                                         updated_at REAL NOT NULL)""")
+
+    def create(self, model_type, priority, model_input):
+        # Adds a new queued job and returns its id
+        # params model_input: dictionary of the input fields of the simulation
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self.connection:
+            self.connection.execute("INSERT INTO jobs VALUES (?, ?, ?, 'queued', 0, ?, NULL, NULL, ?, ?)",
+                                    (job_id, model_type, priority, json.dumps(model_input), now, now))
+        return job_id
+
+    def get(self, job_id):
+        # Dictionary of the job's details or None if there is no such job
+        row = self.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["input"] = json.loads(job["input"])
+        job["response_input"] = json.loads(job["response_input"]) if job["response_input"] is not None else None
+        return job
+
+    def claim(self, job_id):
+        # Marks a queued job as running, returning False if it is not queued (another worker has already claimed it)
+        # The check and the update are one statement so only one of the server processes sharing the store can claim it
+        with self.connection:
+            cursor = self.connection.execute("UPDATE jobs SET status = 'running', progress = 0, updated_at = ? "
+                                             "WHERE id = ? AND status = 'queued'", (time.time(), job_id))
+        return cursor.rowcount == 1
+
+    def set_progress(self, job_id, progress):
+        # Also shows the job's worker is still alive, as it updates the time the job was last updated
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                                    (progress, time.time(), job_id))
+
+    def touch(self, job_ids):
+        # Shows the workers running these jobs are still alive
+        with self.connection:
+            self.connection.executemany("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'",
+                                        [(time.time(), job_id) for job_id in job_ids])
+
+    def set_status(self, job_id, status, progress=None, error=None):
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = ?, progress = COALESCE(?, progress), error = ?, updated_at = ? "
+                                    "WHERE id = ?", (status, progress, error, time.time(), job_id))
+
+    def store_result(self, job_id, response_input, simulation_data):
+        # Saves the output arrays and marks the job as completed
+        # A result is never partly written
+        with atomic_write(self.get_result_path(job_id)) as file:
+            np.savez(file, **simulation_data)
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'completed', progress = 1, response_input = ?, updated_at = ? "
+                                    "WHERE id = ?", (json.dumps(response_input), time.time(), job_id))
+
+    def load_result(self, job_id):
+        # Dictionary of every output array of a completed job (temperatures, times and any others such as forcing)
+        with np.load(self.get_result_path(job_id)) as result:
+            return {name: result[name] for name in result.files}
+
+    def requeue_abandoned_jobs(self, updated_before):
+        # Queues running jobs again if they have not been updated since updated_before, as the worker running them
+        # must have stopped (running jobs of live workers are updated regularly)
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'queued', progress = 0, updated_at = ? "
+                                    "WHERE status = 'running' AND updated_at < ?", (time.time(), updated_before))
+
+    def get_queued_jobs(self):
+        # Jobs waiting to run (submitted to any server process sharing the store), highest priority first
+        rows = self.connection.execute("SELECT id, priority FROM jobs WHERE status = 'queued' "
+                                       "ORDER BY priority DESC, created_at").fetchall()
+        return [(row["id"], row["priority"]) for row in rows]
+
+    def delete_finished_jobs(self, updated_before):
+        # Removes completed and failed jobs (and their results) which finished before updated_before
+        rows = self.connection.execute("SELECT id FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+                                       (updated_before,)).fetchall()
+        for row in rows:
+            try:
+                os.remove(self.get_result_path(row["id"]))
+            except FileNotFoundError:
+                pass  # failed jobs have no result, and another server process may have removed it already
+        with self.connection:
+            self.connection.executemany("DELETE FROM jobs WHERE id = ?", [(row["id"],) for row in rows])
+        return len(rows)
+
+    def get_result_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.npz")
+
+    def close(self):
+        self.connection.close()
+
+
+class JobScheduler:
+    # Runs stored jobs on a fixed number of background workers, highest priority first
+    # Several server processes can share one store: each job is claimed by exactly one of them, and jobs whose
+    # process stopped while running them are run again by another once they have not been updated for a while
+    HEARTBEAT_INTERVAL = 10.  # seconds between marking running jobs as alive and checking the store for new jobs
+    ABANDONED_AFTER = 60.  # seconds without an update after which a running job is assumed to be abandoned
+    PROGRESS_STEP = 0.01  # smallest change in progress which is written to the store
+    RETRY_DELAY = 0.5  # seconds before a job which could not run yet is tried again, doubling with every attempt
+    MAX_RETRY_DELAY = 30.
+
+    def __init__(self, store, run_job, number_of_workers=2, max_queued_jobs=1000, result_retention=7 * 24 * 60 * 60.):
+        # params store: JobStore, which may be set later (before start) so it is only created when the server starts
+        # params run_job: coroutine function taking (model_type, model_input) and returning (response_input, simulation_data)
+        # params result_retention: seconds finished jobs and their results are kept for
+        self.store = store
+        self.result_retention = result_retention
+        self.run_job = run_job
+        self.number_of_workers = number_of_workers
+        self.max_queued_jobs = max_queued_jobs
+        self.queue = None
+        self.workers = []
+        self.sequence = itertools.count()  # Keeps jobs with the same priority in the order they were submitted
+        self.queued_job_ids = set()  # Jobs in this process's queue, so a job is not queued twice
+        self.running_job_ids = set()
+
+    def start(self):
+        # Starts the workers, and the heartbeat which queues jobs left unfinished by a stopped server process
+        if self.queue is not None:
+            return
+        self.queue = asyncio.PriorityQueue()
+        self.queue_stored_jobs()
+        self.workers = [asyncio.create_task(self.work()) for _ in range(self.number_of_workers)]
+        self.workers.append(asyncio.create_task(self.heartbeat()))
+
+    async def shutdown(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        self.queue = None
+        self.queued_job_ids.clear()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def submit(self, model_type, priority, model_input):
+        # Stores a new job, queues it and returns its id
+        if self.queue_depth >= self.max_queued_jobs:
+            raise JobQueueFullError("Too many jobs are waiting to run, try again later")
+        self.start()
+        job_id = self.store.create(model_type, priority, model_input)
+        self.enqueue(job_id, priority)
+        return job_id
+
+    def enqueue(self, job_id, priority):
+        if job_id not in self.queued_job_ids:
+            self.queued_job_ids.add(job_id)
+            self.queue.put_nowait((-priority, next(self.sequence), job_id))
+
+    def queue_stored_jobs(self):
+        # Queues jobs abandoned by stopped server processes and jobs submitted to other processes
+        # Every process may queue the same job, but only the first to claim it runs it
+        self.store.requeue_abandoned_jobs(time.time() - self.ABANDONED_AFTER)
+        for job_id, priority in self.store.get_queued_jobs():
+            self.enqueue(job_id, priority)
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(self.HEARTBEAT_INTERVAL)
+            self.store.touch(self.running_job_ids)
+            self.queue_stored_jobs()
+            self.store.delete_finished_jobs(time.time() - self.result_retention)
+
+    async def work(self):
+        while True:
+            _, _, job_id = await self.queue.get()
+            self.queued_job_ids.discard(job_id)
+            try:
+                if self.store.claim(job_id):
+                    await self.run(job_id)
+            finally:
+                self.queue.task_done()
+
+    async def run(self, job_id):
+        # Runs a job which this process has claimed
+        job = self.store.get(job_id)
+        self.running_job_ids.add(job_id)
+        last_progress = 0.
+
+        def store_progress(progress):
+            nonlocal last_progress
+            if progress - last_progress >= self.PROGRESS_STEP:
+                last_progress = progress
+                self.store.set_progress(job_id, progress)
+
+        progress_token = current_progress_reporter.set(store_progress)
+        try:
+            response_input, simulation_data = await self.run_until_accepted(job_id, job["model_type"], job["input"])
+        except asyncio.CancelledError:
+            # Server is stopping, so the job is queued again for this or another server process to run
+            self.store.set_status(job_id, "queued", progress=0.)
+            raise
+        except Exception as error:
+            logger.exception("Job failed", extra={"job_id": job_id})
+            self.store.set_status(job_id, "failed", error=getattr(error, "detail", None) or str(error))
+            return
+        finally:
+            current_progress_reporter.reset(progress_token)
+            self.running_job_ids.discard(job_id)
+        self.store.store_result(job_id, response_input, simulation_data)
+
+    async def run_until_accepted(self, job_id, model_type, model_input):
+        # Background jobs exist to absorb load, so a job which cannot run yet waits and is tried again rather than failing
+        # It keeps its claim (and its heartbeat) while waiting so no other server process takes it
+        retry_delay = self.RETRY_DELAY
+        while True:
+            try:
+                return await self.run_job(model_type, model_input)
+            except JobRetryError as error:
+                logger.info("Job waiting to retry", extra={"job_id": job_id, "reason": str(error),
+                                                           "retry_delay": retry_delay})
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, self.MAX_RETRY_DELAY)
@@ -1,12 +1,149 @@
-from fastapi import FastAPI, HTTPException
-from models import ZeroDimensionalEnergyBalanceModel, RcpModel
-from validation import EBMValidator, RcpFAIRValidator
-from api_models import ZeroDimensionEBMInput, ZeroDimensionEBMResponse, FAIRPresetInput, FAIRPresetResponse
+import asyncio
+import hashlib
+import os
+import time
+import numpy as np
+from pydantic import ValidationError
+from fastapi import FastAPI, HTTPException, Header, Request, Depends
+from fastapi.responses import Response, StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from models import ZeroDimensionalEnergyBalanceModel, ZeroDimensionalEnergyBalanceEnsemble, RcpModel, CustomEmissionsModel
+from validation import EBMValidator, EBMContinueValidator, EBMBatchValidator, RcpFAIRValidator, RcpFAIRCompareValidator, \
+    RcpFAIRMonteCarloValidator, RcpFAIRMonteCarloSynchronousValidator, FAIRValidator, OutputWindowValidator
+from api_models import ZeroDimensionEBMInput, ZeroDimensionEBMResponse, ZeroDimensionEBMContinueInput, \
+    ZeroDimensionEBMContinueResponse, ZeroDimensionEBMBatchInput, ZeroDimensionEBMBatchResponse, FAIRPresetInput, \
+    FAIRPresetResponse, FAIRCustomInput, FAIRCustomResponse, FAIRCustomJobInput, FAIRCompareInput, FAIRCompareResponse, \
+    FAIRMonteCarloInput, FAIRMonteCarloResponse, JobInput, JobStatusResponse, OutputWindowInput
+from simulation_pool import SimulationPool, PoolFullError, SimulationTimeoutError
+from caching import RcpResultCache, EBMResultCache, SingleFlight, canonical_key
+from ingestion import read_array, IngestionError
+from serialisation import ndjson_lines, sse_events, choose_stream_format, choose_response_format, build_response, \
+    SSE_MEDIA_TYPE, JSON_MEDIA_TYPE
+from downsampling import downsample_arrays
+from monte_carlo import create_chunks, PercentileAccumulator
+from jobs import JobStore, JobScheduler, JobQueueFullError, JobRetryError, report_progress
+from instrumentation import PhaseTimer, Metrics, current_timer, timed_phase, add_phase_timings, configure_logging
 
-DEBUG = True
+EBM_ENGINE = "numpy"  # Engine used to integrate the EBM, see ZeroDimensionalEnergyBalanceModel.ENGINES
+PRECOMPUTE_RCP_PRESETS = True  # Run every RCP preset in the background at startup so first requests are served from cache
 
 app = FastAPI()
 
+# Structured logging, level set by the LOG_LEVEL environment variable
+logger = configure_logging()
+
+# Simulations are run on a pool of workers so the event loop stays free to answer other requests
+simulation_pool = SimulationPool.from_environment()
+
+# Serialised outputs of the RCP preset scenarios
+# If SHARED_DATA_DIRECTORY is set the output arrays (and the RCP emissions) are shared by every server worker
+rcp_result_cache = RcpResultCache(shared_store=RcpModel.shared_store)
+# Outputs of recent EBM runs
+ebm_result_cache = EBMResultCache.from_environment()
+
+# Identical simulations requested at the same time share one run
+simulation_flights = SingleFlight()
+
+# Prometheus metrics served at /metrics
+metrics = Metrics()
+metrics.add_gauge("ebm_cache_hits_total", "EBM requests served from the result cache", lambda: ebm_result_cache.hits, "counter")
+metrics.add_gauge("ebm_cache_misses_total", "EBM requests which had to run the model", lambda: ebm_result_cache.misses, "counter")
+metrics.add_gauge("ebm_cache_hit_rate", "Proportion of EBM requests served from the result cache", lambda: ebm_result_cache.hit_rate)
+metrics.add_gauge("ebm_cache_size_bytes", "Memory used by the EBM result cache", lambda: ebm_result_cache.size_in_bytes)
+metrics.add_gauge("rcp_cache_scenarios", "Number of RCP preset scenarios cached", lambda: len(rcp_result_cache.results))
+metrics.add_gauge("simulation_runs_total", "Simulation runs started by requests (not counting cache hits)",
+                  lambda: simulation_flights.runs, "counter")
+metrics.add_gauge("simulation_coalesced_total", "Requests which shared an identical simulation already in progress",
+                  lambda: simulation_flights.coalesced, "counter")
+metrics.add_gauge("simulation_pool_queue_depth", "Simulations running or waiting for a worker",
+                  lambda: simulation_pool.queue_depth)
+metrics.add_gauge("simulation_pool_max_queue_depth", "Queue depth at which requests are rejected",
+                  lambda: simulation_pool.max_queue_depth)
+
+
+@app.on_event("startup")
+async def start_simulation_pool():
+    simulation_pool.start()
+    # The job store is only created when the server starts, so importing main (for example in tests or benchmarks)
+    # does not create a database
+    job_scheduler.store = JobStore(os.environ.get("JOBS_DIRECTORY", "job_store"))
+    job_scheduler.start()
+    if PRECOMPUTE_RCP_PRESETS:
+        asyncio.create_task(precompute_rcp_results())
+
+
+@app.middleware("http")
+async def time_request(request: Request, call_next):
+    # Times the phases of every request, reporting them in the Server-Timing header, metrics and logs
+    timer = PhaseTimer()
+    token = current_timer.set(timer)
+    start_time = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_timer.reset(token)
+    duration = time.perf_counter() - start_time
+    timer.add("total", duration)
+
+    response.headers["Server-Timing"] = timer.server_timing_header()
+    # Labelled by handler rather than path so that paths with parameters do not create new series
+    handler_name = getattr(request.scope.get("endpoint"), "__name__", "unmatched")
+    metrics.observe_request(handler_name, duration, timer)
+    logger.info("Request handled", extra={"method": request.method, "path": request.url.path,
+                                          "status_code": response.status_code, "duration_seconds": duration,
+                                          "phases": timer.durations})
+    return response
+
+
+@app.on_event("shutdown")
+async def shutdown_simulation_pool():
+    await job_scheduler.shutdown()
+    job_scheduler.store.close()
+    simulation_pool.shutdown()
+
+
+async def run_simulation(model):
+    # Runs the model on the simulation pool and returns the completed model
+    # Raises 503 error if the pool is overloaded and 504 error if the run takes too long
+    try:
+        with timed_phase("simulation"):
+            model = await simulation_pool.run(model)
+    except PoolFullError as error:
+        logger.warning("Simulation pool full", extra={"queue_depth": simulation_pool.queue_depth})
+        raise HTTPException(status_code=503, detail=str(error))
+    except SimulationTimeoutError as error:
+        logger.warning("Simulation timed out", extra={"model_name": model.name})
+        raise HTTPException(status_code=504, detail=str(error))
+    # Timings measured by the model inside the worker
+    add_phase_timings(model.timings)
+    return model
+
+
+async def cache_rcp_result(scenario_number):
+    # Runs the RCP scenario and stores its output if it has not already been cached (by this or another worker)
+    if rcp_result_cache.contains(scenario_number) or rcp_result_cache.attach_shared(scenario_number):
+        return
+
+    async def run_and_cache():
+        model = await run_simulation(RcpModel(name=f"rcp_scenario_{scenario_number}", rcp_scenario=scenario_number))
+        simulation_data = model.get_temperature_time_arrays() | model.get_concentration_forcing_arrays()
+        logger.debug("RCP scenario output", extra={"rcp_scenario": scenario_number} | simulation_data)
+        rcp_result_cache.store(scenario_number, simulation_data)
+
+    # Requests arriving while the scenario is running (including the startup precompute) wait for the same run
+    await simulation_flights.run(f"FAIR/preset:{scenario_number}", run_and_cache)
+
+
+async def precompute_rcp_results():
+    for scenario_number in RcpModel.rcp_scenario_dict:
+        await cache_rcp_result(scenario_number)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Metrics in the Prometheus text format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 @app.get("/")
 async def root():
@@ -14,59 +151,377 @@ async def root():
     return {"message": "Hello World"}
 
 
+def validate(validator):
+    # Raises 400 error if any of the validator's rules are broken
+    with timed_phase("validation"):
+        validation_result = validator.validate_all()
+    if not validation_result["success"]:
+        raise HTTPException(status_code=400, detail=validation_result["message"])
+
+
+def create_EBM(model_input: ZeroDimensionEBMInput):
+    return ZeroDimensionalEnergyBalanceModel(name=model_input.model_name,
+                                             initial_temperature=model_input.initial_temperature,
+                                             insolation=model_input.insolation,
+                                             albedo=model_input.albedo,
+                                             tau=model_input.tau,
+                                             engine=EBM_ENGINE,
+                                             duration=model_input.duration,
+                                             timestep=model_input.timestep,
+                                             sample_interval=model_input.sample_interval,
+                                             convergence_tolerance=model_input.convergence_tolerance)
+
+
+def create_EBM_continuation(model_input: ZeroDimensionEBMContinueInput):
+    # Engine is taken from the snapshot so the continuation joins on to the earlier run
+    return ZeroDimensionalEnergyBalanceModel.from_snapshot(name=model_input.model_name,
+                                                           snapshot=model_input.snapshot.dict(),
+                                                           duration=model_input.duration,
+                                                           sample_interval=model_input.sample_interval,
+                                                           convergence_tolerance=model_input.convergence_tolerance)
+
+
+# Each run_ function runs an already validated simulation and returns a tuple of
+# (dictionary of fields echoed in the response, dictionary of temperature and time arrays)
+
+async def run_EBM(model_input: ZeroDimensionEBMInput):
+    return await run_cached_EBM(create_EBM(model_input), model_input)
+
+
+async def run_EBM_continue(model_input: ZeroDimensionEBMContinueInput):
+    # Only the extension is run, starting from the snapshot's temperature
+    return await run_cached_EBM(create_EBM_continuation(model_input), model_input)
+
+
+async def run_cached_EBM(model: ZeroDimensionalEnergyBalanceModel, model_input):
+    # Output only depends on the physics inputs so identical runs are served from the cache
+    with timed_phase("cache"):
+        cache_key = ebm_result_cache.key(model.get_physics_inputs())
+        simulation_data = ebm_result_cache.get(cache_key)
+    if simulation_data is None:
+        async def run_and_cache():
+            completed_model = await run_simulation(model)
+            # Get output data
+            output = completed_model.get_temperature_time_arrays()
+            with timed_phase("cache"):
+                ebm_result_cache.put(cache_key, output)
+            return output
+
+        # Identical requests arriving before the run finishes share it, each echoing its own input
+        simulation_data = await simulation_flights.run(f"EBM:{cache_key}", run_and_cache)
+
+    logger.debug("EBM output", extra={"model_name": model_input.model_name} | simulation_data)
+    return model_input.dict() | model.get_run_summary(simulation_data["temperatures"]), simulation_data
+
+
+async def run_EBM_batch(model_input: ZeroDimensionEBMBatchInput):
+    model = ZeroDimensionalEnergyBalanceEnsemble(name=model_input.model_name,
+                                                 initial_temperatures=model_input.initial_temperature,
+                                                 insolations=model_input.insolation,
+                                                 albedos=model_input.albedo,
+                                                 taus=model_input.tau,
+                                                 grid=model_input.grid)
+
+    async def run():
+        completed_model = await run_simulation(model)
+        return completed_model.get_member_parameters(), completed_model.get_temperature_time_arrays()
+
+    key = canonical_key({"model_type": "EBM/batch"} | model_input.dict(exclude={"model_name"}))
+    member_parameters, simulation_data = await simulation_flights.run(key, run)
+    response_input = {"model_name": model_input.model_name, "grid": model_input.grid} | member_parameters
+    return response_input, simulation_data
+
+
+async def run_FAIR_preset(model_input: FAIRPresetInput):
+    # Preset scenarios always give the same output so are only run once
+    await cache_rcp_result(model_input.rcp_scenario)
+    return model_input.dict(), rcp_result_cache.get(model_input.rcp_scenario)
+
+
+async def run_FAIR_compare(model_input: FAIRCompareInput):
+    # Scenarios are run at the same time on the simulation pool (or taken from the preset cache)
+    # and combined into matrices with one row per scenario sharing the time axis of the RCP datasets
+    await asyncio.gather(*(cache_rcp_result(scenario_number) for scenario_number in model_input.rcp_scenarios))
+    results = [rcp_result_cache.get_all(scenario_number) for scenario_number in model_input.rcp_scenarios]
+
+    with timed_phase("aggregation"):
+        temperatures = np.vstack([result["temperatures"] for result in results])
+        simulation_data = {"times": results[0]["times"], "temperatures": temperatures}
+        if model_input.include_concentrations:
+            simulation_data["co2_concentrations"] = np.vstack([result["co2_concentrations"] for result in results])
+        if model_input.include_forcing:
+            simulation_data["forcing"] = np.vstack([result["forcing"] for result in results])
+        if model_input.baseline_scenario is not None:
+            baseline_row = model_input.rcp_scenarios.index(model_input.baseline_scenario)
+            simulation_data["temperature_differences"] = temperatures - temperatures[baseline_row]
+    return model_input.dict(), simulation_data
+
+
+async def run_FAIR_custom(model_input: FAIRCustomInput, emissions):
+    model = CustomEmissionsModel(name=model_input.model_name, emissions=emissions, start_year=model_input.start_year)
+
+    async def run():
+        return (await run_simulation(model)).get_temperature_time_arrays()
+
+    key = canonical_key({"model_type": "FAIR/custom", "start_year": model_input.start_year,
+                         "emissions": hashlib.sha256(np.ascontiguousarray(emissions, dtype="<f8").tobytes()).hexdigest()})
+    return model_input.dict(exclude={"emissions"}), await simulation_flights.run(key, run)
+
+
+async def run_FAIR_monte_carlo(model_input: FAIRMonteCarloInput):
+    key = canonical_key({"model_type": "FAIR/montecarlo"} | model_input.dict(exclude={"model_name"}))
+    return model_input.dict(), await simulation_flights.run(key, lambda: run_monte_carlo_chunks(model_input))
+
+
+async def run_monte_carlo_chunks(model_input: FAIRMonteCarloInput):
+    # Chunks of members are run on the pool at most one per worker at a time, and each chunk's temperatures
+    # are added to the percentile histograms and discarded as soon as it finishes
+    chunks = create_chunks(model_input.model_name, model_input.rcp_scenario, model_input.number_of_members,
+                           model_input.seed)
+    running_chunks = asyncio.Semaphore(simulation_pool.max_workers)
+    accumulator = None
+    times = None
+
+    async def run_chunk(chunk):
+        nonlocal accumulator, times
+        async with running_chunks:
+            chunk = await run_simulation(chunk)
+        if accumulator is None:
+            accumulator = PercentileAccumulator(len(chunk.times))
+            times = chunk.times
+        with timed_phase("aggregation"):
+            accumulator.add(chunk.temperatures)
+        # Shown as the job's progress when the ensemble is run as a job
+        report_progress(accumulator.number_of_members / model_input.number_of_members)
+
+    await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+    return {"times": times, "temperatures": accumulator.percentiles(model_input.percentiles)}
+
+
+def is_whole_output(output_window: OutputWindowInput):
+    # True if no window or maximum number of points was asked for, so the output is sent unchanged
+    return output_window.start is None and output_window.end is None and output_window.max_points is None
+
+
+def serialise(accept, response_input, simulation_data, output_window: OutputWindowInput | None = None):
+    # Combine input with simulation data in the format asked for
+    # Output is reduced to the requested window and number of points first, so only what is sent is serialised
+    # Output arrays were generated by the server so are not revalidated through the response models
+    # Arrays other than the temperatures and times (such as CO2 concentrations) share the same times
+    times = simulation_data["times"]
+    arrays = {name: array for name, array in simulation_data.items() if name != "times"}
+    if output_window is not None and not is_whole_output(output_window):
+        with timed_phase("downsampling"):
+            times, arrays = downsample_arrays(times, arrays, output_window.start, output_window.end,
+                                              output_window.max_points, output_window.method)
+    temperatures = arrays.pop("temperatures")
+    with timed_phase("serialisation"):
+        return build_response(choose_response_format(accept), response_input, times, temperatures, arrays)
+
+
 @app.post("/execute/EBM", response_model=ZeroDimensionEBMResponse)
-async def execute_EBM(model_input: ZeroDimensionEBMInput):
+async def execute_EBM(model_input: ZeroDimensionEBMInput, output_window: OutputWindowInput = Depends(),
+                      accept: str | None = Header(default=None)):
     # Runs 0-dimensional energy balance model given the model name and the initial temperature in degrees C
-    # Returns temperature and time as list of floats
+    # Returns temperature and time as list of floats, or in a binary format if the Accept header asks for one
+    validate(EBMValidator(model_input))
+    validate(OutputWindowValidator(output_window))
+    response_input, simulation_data = await run_EBM(model_input)
+    return serialise(accept, response_input, simulation_data, output_window)
+
+
+@app.post("/execute/EBM/continue", response_model=ZeroDimensionEBMContinueResponse)
+async def execute_EBM_continue(model_input: ZeroDimensionEBMContinueInput, output_window: OutputWindowInput = Depends(),
+                               accept: str | None = Header(default=None)):
+    # Carries on an earlier EBM run from the snapshot it returned, for another duration years
+    # Returns only the new samples (with times following on from the earlier run) and a new snapshot to continue again
+    validate(EBMContinueValidator(model_input))
+    validate(OutputWindowValidator(output_window))
+    response_input, simulation_data = await run_EBM_continue(model_input)
+    return serialise(accept, response_input, simulation_data, output_window)
 
-    # Validate the data
-    validator = EBMValidator(model_input)
-    validation_result = validator.validate_all()
-    if not validation_result["success"]:
-        raise HTTPException(status_code=400, detail=validation_result["message"])
 
-    # Create and run model
-    model = ZeroDimensionalEnergyBalanceModel(name=model_input.model_name,
-                                              initial_temperature=model_input.initial_temperature,
-                                              insolation=model_input.insolation,
-                                              albedo=model_input.albedo,
-                                              tau=model_input.tau)
-    model.run()
+@app.post("/execute/EBM/stream")
+async def execute_EBM_stream(model_input: ZeroDimensionEBMInput, accept: str | None = Header(default=None)):
+    # Runs 0-dimensional energy balance model, streaming each yearly (temperature, time) sample as soon as it is produced
+    # Sent as Server-Sent Events if the Accept header asks for text/event-stream, otherwise as newline-delimited JSON
+    validate(EBMValidator(model_input))
+    model = create_EBM(model_input)
 
-    # Get output data
-    simulation_data = model.get_temperature_time_data()
+    # Cached output is streamed straight away, otherwise the model is stepped forward as the response is sent
+    # Samples are not stored in the history so memory use does not grow with the length of the run
+    simulation_data = ebm_result_cache.get(ebm_result_cache.key(model.get_physics_inputs()))
+    release = None
+    if simulation_data is not None:
+        samples = zip(simulation_data["temperatures"], simulation_data["times"])
+    else:
+        # The model is run on the server's thread pool rather than the simulation pool's workers, so it takes a place
+        # in the simulation pool's queue until the response has finished and is stopped once it reaches the timeout
+        try:
+            simulation_pool.reserve()
+        except PoolFullError as error:
+            logger.warning("Simulation pool full", extra={"queue_depth": simulation_pool.queue_depth})
+            raise HTTPException(status_code=503, detail=str(error))
+        # Runs after the response has finished, including when the client disconnects part way through
+        release = BackgroundTask(simulation_pool.decrease_queue_depth)
+        model.history.keep_samples = False
+        samples = simulation_pool.time_limited(model.stream())
 
-    if DEBUG:
-        print(simulation_data)
+    media_type = choose_stream_format(accept)
+    content = sse_events(samples) if media_type == SSE_MEDIA_TYPE else ndjson_lines(samples)
+    return StreamingResponse(content, media_type=media_type, background=release)
 
-    # Combine input dictionary with simulation data dictionary to instantiate SimulationResponse object which is returned
-    response_dictionary = model_input.dict() | simulation_data
-    model_output = ZeroDimensionEBMResponse(**response_dictionary)
-    return model_output
+
+@app.post("/execute/EBM/batch", response_model=ZeroDimensionEBMBatchResponse)
+async def execute_EBM_batch(model_input: ZeroDimensionEBMBatchInput, output_window: OutputWindowInput = Depends(),
+                            accept: str | None = Header(default=None)):
+    # Runs an ensemble of 0-dimensional energy balance models as a single array computation
+    # Returns the parameters of each member, the shared times and a matrix of temperatures with one row per member
+    validate(EBMBatchValidator(model_input))
+    validate(OutputWindowValidator(output_window))
+    response_input, simulation_data = await run_EBM_batch(model_input)
+    return serialise(accept, response_input, simulation_data, output_window)
 
 
 @app.post("/execute/FAIR/preset", response_model=FAIRPresetResponse)
-async def execute_FAIR_preset(model_input: FAIRPresetInput):
+async def execute_FAIR_preset(model_input: FAIRPresetInput, output_window: OutputWindowInput = Depends(),
+                              accept: str | None = Header(default=None)):
     # Runs FAIR model with preset RCP scenario data supplied by library
-    # Returns lists of temperature and time
+    # Returns lists of temperature and time, or in a binary format if the Accept header asks for one
+    validate(RcpFAIRValidator(model_input))
+    validate(OutputWindowValidator(output_window))
+    response_input, simulation_data = await run_FAIR_preset(model_input)
+
+    # The cached JSON output is already serialised so it is not revalidated through FAIRPresetResponse
+    if choose_response_format(accept) == JSON_MEDIA_TYPE and is_whole_output(output_window):
+        with timed_phase("serialisation"):
+            return Response(content=rcp_result_cache.response_body(model_input), media_type=JSON_MEDIA_TYPE)
+    return serialise(accept, response_input, simulation_data, output_window)
+
+
+@app.post("/execute/FAIR/compare", response_model=FAIRCompareResponse)
+async def execute_FAIR_compare(model_input: FAIRCompareInput, output_window: OutputWindowInput = Depends(),
+                               accept: str | None = Header(default=None)):
+    # Runs several preset RCP scenarios at once for comparison
+    # Returns one time axis and a matrix of temperatures with one row per scenario, optionally with matching
+    # matrices of CO2 concentrations, forcing and temperature differences from a baseline scenario
+    validate(RcpFAIRCompareValidator(model_input))
+    validate(OutputWindowValidator(output_window))
+    response_input, simulation_data = await run_FAIR_compare(model_input)
+    return serialise(accept, response_input, simulation_data, output_window)
+
+
+@app.post("/execute/FAIR/custom", response_model=FAIRCustomResponse)
+async def execute_FAIR_custom(request: Request, model_input: FAIRCustomInput = Depends(),
+                              output_window: OutputWindowInput = Depends(), accept: str | None = Header(default=None)):
+    # Runs FAIR model with yearly CO2 emissions (GtC/yr) sent as the request body
+    # Body may be CSV (text/csv), NDJSON (application/x-ndjson) or raw little-endian float64 (application/octet-stream)
+    # and is read into a numpy array as it arrives; model name and start year are query parameters
+    # Returns lists of temperature and time, or in a binary format if the Accept header asks for one
+    try:
+        with timed_phase("ingestion"):
+            emissions = await read_array(request.stream(), request.headers.get("content-type"), FAIRValidator.MAX_YEARS)
+    except IngestionError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+    validate(FAIRValidator(model_input, emissions))
+    validate(OutputWindowValidator(output_window))
+    response_input, simulation_data = await run_FAIR_custom(model_input, emissions)
+    return serialise(accept, response_input, simulation_data, output_window)
+
+
+@app.post("/execute/FAIR/montecarlo", response_model=FAIRMonteCarloResponse)
+async def execute_FAIR_monte_carlo(model_input: FAIRMonteCarloInput, output_window: OutputWindowInput = Depends(),
+                                   accept: str | None = Header(default=None)):
+    # Runs a Monte Carlo ensemble of the FAIR model for a preset RCP scenario, drawing climate sensitivity and
+    # carbon-cycle parameters from their uncertainty distributions (members are spread across the simulation pool)
+    # Returns only the requested percentiles of temperature for each year, one row per percentile
+    # Larger ensembles are rejected here and must be submitted to POST /jobs instead
+    validate(RcpFAIRMonteCarloValidator(model_input))
+    validate(RcpFAIRMonteCarloSynchronousValidator(model_input))
+    validate(OutputWindowValidator(output_window))
+    response_input, simulation_data = await run_FAIR_monte_carlo(model_input)
+    return serialise(accept, response_input, simulation_data, output_window)
+
+
+# Simulations which can be submitted as jobs
+# Mapping of model type to (input model, function creating the validator, function running the simulation)
+JOB_TYPES = {
+    "EBM": (ZeroDimensionEBMInput, EBMValidator, run_EBM),
+    "EBM/continue": (ZeroDimensionEBMContinueInput, EBMContinueValidator, run_EBM_continue),
+    "EBM/batch": (ZeroDimensionEBMBatchInput, EBMBatchValidator, run_EBM_batch),
+    "FAIR/preset": (FAIRPresetInput, RcpFAIRValidator, run_FAIR_preset),
+    "FAIR/compare": (FAIRCompareInput, RcpFAIRCompareValidator, run_FAIR_compare),
+    "FAIR/montecarlo": (FAIRMonteCarloInput, RcpFAIRMonteCarloValidator, run_FAIR_monte_carlo),
+    "FAIR/custom": (FAIRCustomJobInput,
+                    lambda model_input: FAIRValidator(model_input, np.asarray(model_input.emissions, dtype=float)),
+                    lambda model_input: run_FAIR_custom(model_input, np.asarray(model_input.emissions, dtype=float))),
+}
+
+
+async def run_job(model_type, model_input):
+    # Runs a stored job for the job scheduler
+    # A full simulation pool (503 error) makes the job wait and try again instead of failing
+    input_class, _, run_function = JOB_TYPES[model_type]
+    try:
+        return await run_function(input_class.parse_obj(model_input))
+    except HTTPException as error:
+        if error.status_code == 503:
+            raise JobRetryError(error.detail)
+        raise
+
+
+# Jobs are stored in JOBS_DIRECTORY (opened at startup) and run by JOBS_WORKERS background workers
+# Finished jobs and their results are deleted after JOBS_RESULT_RETENTION seconds (one week by default)
+job_scheduler = JobScheduler(None, run_job, number_of_workers=int(os.environ.get("JOBS_WORKERS", 2)),
+                             result_retention=float(os.environ.get("JOBS_RESULT_RETENTION", 7 * 24 * 60 * 60)))
+metrics.add_gauge("jobs_queue_depth", "Jobs waiting to run", lambda: job_scheduler.queue_depth)
+
+
+def get_job_status(job):
+    return JobStatusResponse(id=job["id"], model_type=job["model_type"], priority=job["priority"], status=job["status"],
+                             progress=job["progress"], error=job["error"], created_at=job["created_at"],
+                             updated_at=job["updated_at"])
+
+
+@app.post("/jobs", response_model=JobStatusResponse, status_code=202)
+async def submit_job(job_input: JobInput):
+    # Validates a simulation and queues it to run in the background
+    # Returns the job's status, which can be checked with GET /jobs/{id}
+    if job_input.model_type not in JOB_TYPES:
+        raise HTTPException(status_code=400, detail=f"Model type must be one of {', '.join(JOB_TYPES)}")
+    input_class, create_validator, _ = JOB_TYPES[job_input.model_type]
+    try:
+        model_input = input_class.parse_obj(job_input.simulation_input)
+    except ValidationError as error:
+        raise HTTPException(status_code=422, detail=error.errors())
+    validate(create_validator(model_input))
+
+    try:
+        job_id = job_scheduler.submit(job_input.model_type, job_input.priority, model_input.dict())
+    except JobQueueFullError as error:
+        raise HTTPException(status_code=503, detail=str(error))
+    return get_job_status(job_scheduler.store.get(job_id))
 
-    # Validation
-    validator = RcpFAIRValidator(model_input)
-    validation_result = validator.validate_all()
-    if not validation_result["success"]:
-        raise HTTPException(status_code=400, detail=validation_result["message"])
 
-    # Create model and run
-    model = RcpModel(name=model_input.model_name,
-                     rcp_scenario=model_input.rcp_scenario)
-    model.run()
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    job = job_scheduler.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return get_job_status(job)
 
-    # Get temperature time data
-    simulation_data = model.get_temperature_time_data()
-    if DEBUG:
-        print(simulation_data)
 
-    # Combine input with simulation data (temperature-time data)
-    response_dictionary = model_input.dict() | simulation_data
-    model_output = FAIRPresetResponse(**response_dictionary)
-    return model_output
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, output_window: OutputWindowInput = Depends(),
+                         accept: str | None = Header(default=None)):
+    # Returns the stored output of a completed job in the same format as the matching /execute endpoint
+    job = job_scheduler.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {job['error']}")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    validate(OutputWindowValidator(output_window))
+    return serialise(accept, job["response_input"], job_scheduler.store.load_result(job_id), output_window)
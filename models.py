@@ -1,7 +1,11 @@
-import matplotlib.pyplot as plt
-import climlab
-import fair
-from fair.RCPs import rcp26, rcp45, rcp60, rcp85
+import importlib
+import time
+from collections.abc import Mapping
+import numpy as np
+from shared_data import SharedArrayStore
+
+# climlab, fair, the RCP datasets and matplotlib are slow to import and use a lot of memory, so they are imported
+# by the code that uses them rather than here, keeping server, test and worker process startup fast
 
 # Climate models
 
@@ -15,28 +19,74 @@ class Constants:
     F_REFLECTED = 101.9  # reflected shortwave flux in W/m2
     ALPHA = F_REFLECTED / INSOLATION_OBSERVED  # global albedo
     ASR_OBSERVED = INSOLATION_OBSERVED - F_REFLECTED  # Absorbed shortwave radiation in W/m2
+    C_WATER = 4181.3  # specific heat of liquid water in J/kg/K (same value as climlab)
+    RHO_WATER = 1000.  # density of liquid water in kg/m3
+    CELSIUS_TO_KELVIN = 273.15  # offset for converting degrees C to K
+    SECONDS_PER_DAY = 60. * 60. * 24.
+    DAYS_PER_YEAR = 360.  # model years are 12 months of 30 days
+    SECONDS_PER_YEAR = SECONDS_PER_DAY * DAYS_PER_YEAR
 
 
 class History:
     # Stores all the information about the output data from running the climate simulation
-    def __init__(self):
-        self.temperature = []  # in degrees Celsius
-        self.time = []  # in days
+    # Samples are kept in preallocated numpy arrays which grow (doubling in size) if they become full
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, keep_samples=True, capacity=INITIAL_CAPACITY):
+        # params keep_samples: if false samples are passed on by recorder without being stored,
+        #                      so streaming long runs does not use more memory
+        # params capacity: number of samples to allocate space for
+        self.temperature_buffer = np.empty(capacity)  # in degrees Celsius
+        self.time_buffer = np.empty(capacity)  # in years
+        self.length = 0  # number of samples recorded
+        self.keep_samples = keep_samples
+
+    @property
+    def temperature(self):
+        # Array of recorded temperatures (a view of the buffer, not a copy)
+        return self.temperature_buffer[:self.length]
+
+    @property
+    def time(self):
+        # Array of recorded times (a view of the buffer, not a copy)
+        return self.time_buffer[:self.length]
+
+    def reserve(self, number_of_samples):
+        # Makes sure there is space for another number_of_samples samples
+        required_capacity = self.length + number_of_samples
+        if required_capacity > self.temperature_buffer.size:
+            new_capacity = max(required_capacity, 2 * self.temperature_buffer.size)
+            self.temperature_buffer = np.resize(self.temperature_buffer, new_capacity)
+            self.time_buffer = np.resize(self.time_buffer, new_capacity)
 
     def record(self, temperature, current_time):
         # Stores the data of one timestep
         # params state: current temperature in degrees C
         # params current_time: current time elapsed from start given in years
-        self.temperature.append(temperature)
-        self.time.append(current_time)
+        if self.keep_samples:
+            self.reserve(1)
+            self.temperature_buffer[self.length] = temperature
+            self.time_buffer[self.length] = current_time
+            self.length += 1
 
     def record_all(self, temperatures, times):
         # Stores the temperature and year data for all supplied timesteps
-        self.temperature.extend(temperatures)
-        self.time.extend(times)
+        if self.keep_samples:
+            self.reserve(len(temperatures))
+            self.temperature_buffer[self.length:self.length + len(temperatures)] = temperatures
+            self.time_buffer[self.length:self.length + len(times)] = times
+            self.length += len(temperatures)
+
+    def recorder(self, samples):
+        # Generator which records each (temperature, time) sample and then passes it on as soon as it is produced
+        for temperature, current_time in samples:
+            self.record(temperature, current_time)
+            yield temperature, current_time
 
     def visualise(self):
         # Plots temperature vs time graph (for debugging purposes)
+        import matplotlib.pyplot as plt
+
         plt.plot(self.time, self.temperature)
         plt.xlabel("Time (years)")
         plt.ylabel("Temperature ($^\circ$C)")
@@ -49,38 +99,177 @@ class Simulation:
         self.name = name
         self.initial_temperature = initial_temperature
         self.history = History()
+        self.timings = {}  # Mapping of phase name to seconds taken, for instrumentation
+
+    def record_timing(self, phase, start_time):
+        # Records the time since start_time (from time.perf_counter) as the named phase
+        self.timings[phase] = self.timings.get(phase, 0.) + time.perf_counter() - start_time
 
     def show_history(self):
         # Visualise temperature vs time so far
         self.history.visualise()
 
     def get_temperature_time_data(self):
-        # Dictionary of temperature and time for ease of converting to response object
+        # Dictionary of temperature and time lists for ease of converting to response object
+        return {"temperatures": self.history.temperature.tolist(), "times": self.history.time.tolist()}
+
+    def get_temperature_time_arrays(self):
+        # Dictionary of temperature and time arrays, without converting to lists
         return {"temperatures": self.history.temperature, "times": self.history.time}
 
 
 class ZeroDimensionalEnergyBalanceModel(Simulation):
     # 0-dimensional energy balance model
-    def __init__(self, name, initial_temperature, insolation, albedo, tau):
+    # Two engines are available which integrate the same physics:
+    #   "climlab" - builds the full climlab process model and steps it forward
+    #   "numpy" - integrates the single-variable ODE directly, avoiding climlab's setup and per-step overhead
+    # The numpy engine agrees with the climlab engine to within NUMPY_ENGINE_TOLERANCE degrees C
+    ENGINES = ("climlab", "numpy")
+    NUMPY_ENGINE_TOLERANCE = 1e-6
+    # Stefan-Boltzmann constant climlab derives from the CODATA 2010 constants (climlab.utils.constants.sigma)
+    # The numpy engine must use it to agree with the climlab engine, as the rounded Constants.SIGMA changes
+    # the output by up to 5e-3 degrees C
+    ENGINE_SIGMA = 5.6703726225913323E-8
+    ENGINE_VERSION = 2  # Increase whenever a change to an engine changes its output (invalidates cached results)
+
+    WATER_DEPTH = 100.  # 100 meters slab of water (sets the heat capacity)
+    HEAT_CAPACITY = Constants.C_WATER * Constants.RHO_WATER * WATER_DEPTH  # in J/m2/K
+    # Default run configuration
+    DURATION = 50.  # run for 50 years
+    TIMESTEP = 30.  # time step of 1 month in days
+    SAMPLE_INTERVAL = 1.  # record every year
+    DELTA_T = TIMESTEP * Constants.SECONDS_PER_DAY  # time step of 1 month in seconds
+    TIME_STEPS = 600  # 600 iterations
+    STEPS_PER_YEAR = 12  # number of timesteps between recorded values
+
+    def __init__(self, name, initial_temperature, insolation, albedo, tau, engine="climlab",
+                 duration=DURATION, timestep=TIMESTEP, sample_interval=SAMPLE_INTERVAL, convergence_tolerance=None,
+                 start_step=0):
         # params name: name of simulation
         # params initial_temperature: temperature in degrees C
+        # params engine: which engine integrates the model, one of ENGINES
+        # params duration: length of run in years
+        # params timestep: length of each time step in days
+        # params sample_interval: years between recorded values, must be a whole number of timesteps
+        # params convergence_tolerance: if set the run stops early once the temperature changes by less than
+        #                               this many degrees C per year between samples
+        # params start_step: timesteps already run before initial_temperature was reached, when continuing from a
+        #                    snapshot (times carry on from there and the initial sample is not recorded again)
         super().__init__(name, initial_temperature)
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', must be one of {self.ENGINES}")
         self.insolation = insolation
         self.albedo = albedo
         self.tau = tau
+        self.engine = engine
+
+        self.delta_t = timestep * Constants.SECONDS_PER_DAY
+        self.time_steps = round(duration * Constants.DAYS_PER_YEAR / timestep)
+        self.steps_per_sample = round(sample_interval * Constants.DAYS_PER_YEAR / timestep)
+        self.sample_interval = sample_interval
+        self.convergence_tolerance = convergence_tolerance
+        self.start_step = start_step
+        self.time_steps_completed = 0  # Timesteps run by this model, not including start_step
+        self.converged = False
+
+        # Maximum number of samples is known in advance so the history never has to grow
+        self.history = History(capacity=self.time_steps // self.steps_per_sample + 1)
+
+    def get_physics_inputs(self):
+        # Everything the output of the model depends on (the name does not affect the output)
+        return {"initial_temperature": self.initial_temperature,
+                "insolation": self.insolation,
+                "albedo": self.albedo,
+                "tau": self.tau,
+                "delta_t": self.delta_t,
+                "time_steps": self.time_steps,
+                "steps_per_sample": self.steps_per_sample,
+                "convergence_tolerance": self.convergence_tolerance,
+                "start_step": self.start_step,
+                "engine": self.engine,
+                "engine_version": self.ENGINE_VERSION}
 
     def run(self):
+        # Runs the model using the chosen engine
+        start_time = time.perf_counter()
+        for _ in self.stream():
+            pass
+        self.record_timing("model_run", start_time)
+
+    def stream(self):
+        # Generator which runs the model, yielding each (temperature, time) sample as soon as it is recorded
+        return self.history.recorder(self.samples())
+
+    def samples(self):
+        # Generator of (temperature, time) samples from the chosen engine
+        # Stops early once converged if a convergence tolerance is set
+        engine_samples = self.numpy_samples() if self.engine == "numpy" else self.climlab_samples()
+        previous_temperature = None
+        for sample_num, (temperature, current_time) in enumerate(engine_samples):
+            self.time_steps_completed = sample_num * self.steps_per_sample
+            # A continued run does not repeat the sample its snapshot was taken at
+            if sample_num > 0 or self.start_step == 0:
+                yield temperature, current_time
+            if previous_temperature is not None and self.is_converged(previous_temperature, temperature):
+                self.converged = True
+                return
+            previous_temperature = temperature
+
+    def is_converged(self, previous_temperature, temperature):
+        # True if convergence mode is on and the temperature changed by less than the tolerance per year
+        if self.convergence_tolerance is None:
+            return False
+        return abs(temperature - previous_temperature) / self.sample_interval < self.convergence_tolerance
+
+    def get_run_summary(self, temperatures):
+        # Number of timesteps taken, whether the run stopped early and the snapshot to continue from, worked out
+        # from the recorded temperatures so that it can also be given for cached output
+        # A continued run compares its first sample with the snapshot temperature, as samples does
+        compared_temperatures = ([self.initial_temperature] if self.start_step else []) + list(temperatures[-2:])
+        converged = len(compared_temperatures) >= 2 and self.is_converged(*compared_temperatures[-2:])
+        # The initial sample is only recorded by runs which did not continue from a snapshot
+        time_steps_completed = (len(temperatures) - (1 if self.start_step == 0 else 0)) * self.steps_per_sample
+        return {"time_steps_completed": time_steps_completed, "converged": bool(converged),
+                "snapshot": self.get_snapshot(temperatures[-1], self.start_step + time_steps_completed)}
+
+    def get_snapshot(self, temperature, elapsed_steps):
+        # Compact state of the model after elapsed_steps timesteps which from_snapshot can carry on from
+        # The physics inputs are included so a continued run cannot use different ones by mistake
+        return {"temperature": float(temperature),
+                "elapsed_time": elapsed_steps * self.delta_t / Constants.SECONDS_PER_YEAR,
+                "elapsed_steps": elapsed_steps,
+                "timestep": self.delta_t / Constants.SECONDS_PER_DAY,
+                "insolation": self.insolation,
+                "albedo": self.albedo,
+                "tau": self.tau,
+                "engine": self.engine,
+                "engine_version": self.ENGINE_VERSION}
+
+    @classmethod
+    def from_snapshot(cls, name, snapshot, duration=DURATION, sample_interval=SAMPLE_INTERVAL, convergence_tolerance=None):
+        # Model which continues a run for another duration years from its snapshot, recording only the new samples
+        # Raises ValueError if the snapshot was made by a different version of the engine
+        if snapshot["engine_version"] != cls.ENGINE_VERSION:
+            raise ValueError(f"Snapshot was made by engine version {snapshot['engine_version']}, "
+                             f"the current version is {cls.ENGINE_VERSION}")
+        return cls(name, snapshot["temperature"], snapshot["insolation"], snapshot["albedo"], snapshot["tau"],
+                   engine=snapshot["engine"], duration=duration, timestep=snapshot["timestep"],
+                   sample_interval=sample_interval, convergence_tolerance=convergence_tolerance,
+                   start_step=snapshot["elapsed_steps"])
+
+    def climlab_samples(self):
         # Sets up climate model and runs it in accordance with time
-        # Run time is currently fixed at 50 years / 600 months
-        # Timestep is currently fixed at 1 month
-        delta_t = 60. * 60. * 24. * 30.  # time step of 1 month
-        time_steps = 600 # 600 iterations
+        import climlab
+
+        start_time = time.perf_counter()
+        delta_t = self.delta_t
+        time_steps = self.time_steps
 
         # Initialising components of environment and defining the interactions between
         # Create zero-dimensional domain
         state = climlab.surface_state(
             num_lat=1,  # a single point
-            water_depth=100.,  # 100 meters slab of water (sets the heat capacity)
+            water_depth=self.WATER_DEPTH,  # 100 meters slab of water (sets the heat capacity)
             T0=self.initial_temperature, # global mean initial temperature
             T2=0, # no gradient in initial temperature
         )
@@ -102,19 +291,109 @@ class ZeroDimensionalEnergyBalanceModel(Simulation):
         # Couple time-dependent processes to form EBM
         ebm = climlab.couple([olr, asr])
         ebm.name = self.name
+        self.record_timing("model_setup", start_time)
 
         # Running the simulation
         # step forward in time to run climate model
-        self.history.record(self.initial_temperature, 0) # Record initial values
+        yield self.initial_temperature, self.start_step * delta_t / Constants.SECONDS_PER_YEAR # Initial values
         for step_num in range(1, time_steps+1):
             ebm.step_forward()
-            # Only record every year
-            if step_num % 12 == 0:
+            # Only record every sample interval
+            if step_num % self.steps_per_sample == 0:
                 current_temperature = state.Ts[0][0]
-                current_year = step_num * delta_t // (60.0 * 60.0 * 24 * 30 * 12) # Convert from seconds to years
-                self.history.record(current_temperature, current_year)
+                current_year = (self.start_step + step_num) * delta_t / Constants.SECONDS_PER_YEAR # Convert from seconds to years
+                yield current_temperature, current_year
+
+    def numpy_samples(self):
+        # Integrates the model directly without building any climlab objects
+        for temperature, current_year in self.iterate(self.initial_temperature, self.insolation, self.albedo, self.tau,
+                                                      self.delta_t, self.time_steps, self.steps_per_sample,
+                                                      self.start_step):
+            yield float(temperature), current_year
+
+    @classmethod
+    def iterate(cls, initial_temperature, insolation, albedo, tau,
+                delta_t=DELTA_T, time_steps=TIME_STEPS, steps_per_sample=STEPS_PER_YEAR, start_step=0):
+        # Forward Euler integration of C dT/dt = (1 - albedo) * insolation - tau * sigma * T^4
+        # which is the same explicit scheme climlab uses to step the coupled Boltzmann and SimpleAbsorbedShortwave processes
+        # Parameters may be floats or numpy arrays which broadcast together (one element per ensemble member)
+        # Generator of (temperature in degrees C, time in years) for the initial state and every following sample
+        # Times start from start_step timesteps when continuing an earlier run
+        initial_temperature, insolation, albedo, tau = np.broadcast_arrays(
+            *(np.asarray(value, dtype=float) for value in (initial_temperature, insolation, albedo, tau)))
+
+        absorbed_shortwave = (1 - albedo) * insolation
+        emission_factor = tau * cls.ENGINE_SIGMA  # emissivity of surface is 1
+        timestep_factor = delta_t / cls.HEAT_CAPACITY
+
+        yield initial_temperature.copy(), start_step * delta_t / Constants.SECONDS_PER_YEAR
+        temperature = initial_temperature + Constants.CELSIUS_TO_KELVIN  # work in kelvin
+        for step_num in range(1, time_steps + 1):
+            temperature = temperature + timestep_factor * (absorbed_shortwave - emission_factor * temperature ** 4)
+            # Only record every sample interval
+            if step_num % steps_per_sample == 0:
+                current_year = (start_step + step_num) * delta_t / Constants.SECONDS_PER_YEAR # Convert from seconds to years
+                yield temperature - Constants.CELSIUS_TO_KELVIN, current_year
+
+    @classmethod
+    def integrate(cls, initial_temperature, insolation, albedo, tau,
+                  delta_t=DELTA_T, time_steps=TIME_STEPS, steps_per_sample=STEPS_PER_YEAR):
+        # Runs iterate to the end, returning the recorded temperatures in degrees C with the samples
+        # along the last axis, and the times in years
+        shape = np.broadcast(*(np.asarray(value) for value in (initial_temperature, insolation, albedo, tau))).shape
+        number_of_samples = time_steps // steps_per_sample + 1
+        temperatures = np.empty(shape + (number_of_samples,))
+        times = np.empty(number_of_samples)
+        samples = cls.iterate(initial_temperature, insolation, albedo, tau, delta_t, time_steps, steps_per_sample)
+        for sample_num, (temperature, current_year) in enumerate(samples):
+            temperatures[..., sample_num] = temperature
+            times[sample_num] = current_year
+        return temperatures, times
 
 
+class ZeroDimensionalEnergyBalanceEnsemble(Simulation):
+    # Ensemble of 0-dimensional energy balance models which are all integrated at once as one array computation
+    # Used for parameter sweeps rather than running many ZeroDimensionalEnergyBalanceModel objects
+    def __init__(self, name, initial_temperatures, insolations, albedos, taus, grid=False):
+        # params initial_temperatures, insolations, albedos, taus: lists of parameter values
+        # params grid: if true every combination of the parameter values is a member, otherwise member i takes
+        #              the ith value of each list (lists of length 1 are used by every member)
+        parameter_arrays = [np.asarray(values, dtype=float) for values in (initial_temperatures, insolations, albedos, taus)]
+        if grid:
+            members = [parameter.ravel() for parameter in np.meshgrid(*parameter_arrays, indexing="ij")]
+        else:
+            members = np.broadcast_arrays(*parameter_arrays)
+        super().__init__(name, members[0])
+        self.insolation, self.albedo, self.tau = members[1:]
+        self.temperatures = None  # 2-D array of temperatures with one row per member
+        self.times = None
+
+    @property
+    def number_of_members(self):
+        return self.initial_temperature.size
+
+    def run(self):
+        # Integrate every member together using the numpy engine
+        start_time = time.perf_counter()
+        self.temperatures, self.times = ZeroDimensionalEnergyBalanceModel.integrate(self.initial_temperature,
+                                                                                    self.insolation,
+                                                                                    self.albedo,
+                                                                                    self.tau)
+        self.record_timing("model_run", start_time)
+
+    def get_member_parameters(self):
+        # Dictionary of the parameters of each member in the same order as the rows of the temperature matrix
+        return {"initial_temperature": self.initial_temperature.tolist(),
+                "insolation": self.insolation.tolist(),
+                "albedo": self.albedo.tolist(),
+                "tau": self.tau.tolist()}
+
+    def get_temperature_time_data(self):
+        return {"temperatures": self.temperatures.tolist(), "times": self.times.tolist()}
+
+    def get_temperature_time_arrays(self):
+        return {"temperatures": self.temperatures, "times": self.times}
+
 
 class FAIRModel(Simulation):
     # Finite Amplitude Impulse-Response model
@@ -125,21 +404,101 @@ class FAIRModel(Simulation):
         super().__init__(name=name, initial_temperature=0.0)
 
 
+class LazyModuleDict(Mapping):
+    # Mapping of keys to modules which are only imported the first time they are looked up
+    def __init__(self, module_names):
+        self.module_names = module_names
+
+    def __getitem__(self, key):
+        return importlib.import_module(self.module_names[key])
+
+    def __contains__(self, key):
+        # Checked without importing the module
+        return key in self.module_names
+
+    def __iter__(self):
+        return iter(self.module_names)
+
+    def __len__(self):
+        return len(self.module_names)
+
+
 class RcpModel(FAIRModel):
     # Runs FAIR model using pre-set RCP projection data
 
-    # Mapping of RCP scenario number to RCP scenario dataset
-    rcp_scenario_dict = {1: rcp26,
-                         2: rcp45,
-                         3: rcp60,
-                         4: rcp85}
+    # Mapping of RCP scenario number to RCP scenario dataset (loaded when a scenario is first used)
+    rcp_scenario_dict = LazyModuleDict({1: "fair.RCPs.rcp26",
+                                        2: "fair.RCPs.rcp45",
+                                        3: "fair.RCPs.rcp60",
+                                        4: "fair.RCPs.rcp85"})
+    # Store of the emissions shared by every process when several server workers are run, otherwise None
+    shared_store = SharedArrayStore.from_environment()
 
     def __init__(self, name, rcp_scenario):
         super().__init__(name)
-        self.rcp_scenario = self.rcp_scenario_dict[rcp_scenario]
+        # Only the scenario number is stored (not the dataset module) so the model can be sent to worker processes
+        if rcp_scenario not in self.rcp_scenario_dict:
+            raise KeyError(rcp_scenario)
+        self.rcp_scenario_number = rcp_scenario
+        self.co2_concentrations = None  # CO2 concentration in ppm for each year
+        self.forcing = None  # Total effective radiative forcing in W/m2 for each year
+
+    @property
+    def rcp_scenario(self):
+        # RCP scenario dataset
+        return self.rcp_scenario_dict[self.rcp_scenario_number]
+
+    @classmethod
+    def get_emissions(cls, scenario_number):
+        # Returns (years, emissions) arrays of the scenario
+        # With a shared store the dataset is only loaded by the first process to need it and the others attach to its copy
+        if cls.shared_store is not None:
+            years = cls.shared_store.get(f"rcp_{scenario_number}_years")
+            emissions = cls.shared_store.get(f"rcp_{scenario_number}_emissions")
+            if years is None or emissions is None:
+                dataset = cls.rcp_scenario_dict[scenario_number]
+                years = cls.shared_store.put(f"rcp_{scenario_number}_years", np.asarray(dataset.Emissions.year, dtype=float))
+                emissions = cls.shared_store.put(f"rcp_{scenario_number}_emissions", dataset.Emissions.emissions)
+            # FAIR only accepts exact numpy arrays, so plain array views of the mapped files are returned (without copying)
+            return np.asarray(years), np.asarray(emissions)
+        dataset = cls.rcp_scenario_dict[scenario_number]
+        return dataset.Emissions.year, dataset.Emissions.emissions
 
     def run(self):
         # Run the model using set RCP dataset
-        co2_concentrations, total_radioactive_forcing, temperatures = fair.forward.fair_scm(emissions=self.rcp_scenario.Emissions.emissions)
+        from fair.forward import fair_scm
+
+        start_time = time.perf_counter()
+        years, emissions = self.get_emissions(self.rcp_scenario_number)
+        concentrations, forcing, temperatures = fair_scm(emissions=emissions)
+        # Record all temperature data
+        self.history.record_all(temperatures, years)
+        # Multi-gas runs give a column per gas (CO2 first) and per forcing agent, which are summed for the total
+        self.co2_concentrations = concentrations[:, 0] if concentrations.ndim == 2 else concentrations
+        self.forcing = forcing.sum(axis=1) if forcing.ndim == 2 else forcing
+        self.record_timing("model_run", start_time)
+
+    def get_concentration_forcing_arrays(self):
+        # Dictionary of the yearly CO2 concentration and total forcing arrays
+        return {"co2_concentrations": self.co2_concentrations, "forcing": self.forcing}
+
+
+class CustomEmissionsModel(FAIRModel):
+    # Runs FAIR model in CO2-only mode using emissions supplied by the user
+
+    def __init__(self, name, emissions, start_year):
+        # params emissions: numpy array of yearly CO2 emissions in GtC/yr, passed to FAIR without copying
+        # params start_year: year of the first emissions value
+        super().__init__(name)
+        self.emissions = emissions
+        self.start_year = start_year
+
+    def run(self):
+        # Run the model using the supplied emissions
+        from fair.forward import fair_scm
+
+        start_time = time.perf_counter()
+        co2_concentrations, total_radioactive_forcing, temperatures = fair_scm(emissions=self.emissions, useMultigas=False)
         # Record all temperature data
-        self.history.record_all(temperatures, self.rcp_scenario.Emissions.year)
+        self.history.record_all(temperatures, self.start_year + np.arange(len(self.emissions)))
+        self.record_timing("model_run", start_time)
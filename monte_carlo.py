@@ -0,0 +1,124 @@
+import numpy as np
+from models import FAIRModel, RcpModel
+
+# Monte Carlo ensembles of the FAIR model over uncertain climate and carbon-cycle parameters
+# Members are run in chunks (each small enough for one worker) and their temperatures are added to per-year
+# histograms as each chunk finishes, so memory stays the same however many members are run
+
+
+class ParameterDistributions:
+    # Distributions the uncertain parameters are drawn from, centred on fair_scm's default values
+    TCR_MEDIAN = 1.6  # transient climate response in K, drawn from a log-normal distribution
+    TCR_LOG_STANDARD_DEVIATION = 0.2
+    ECS_MEDIAN = 2.75  # equilibrium climate sensitivity in K, found from the TCR and realised warming fraction
+    RWF_MEAN = TCR_MEDIAN / ECS_MEDIAN  # realised warming fraction (TCR / ECS), drawn from a normal distribution
+    RWF_STANDARD_DEVIATION = 0.09
+    RWF_LIMITS = (0.35, 0.9)
+    # Carbon-cycle parameters drawn from normal distributions with a standard deviation of 10% of the default
+    R0 = 35.  # pre-industrial time-integrated airborne fraction in years
+    RC = 0.019  # sensitivity of airborne fraction to cumulative emissions in years/GtC
+    RT = 4.165  # sensitivity of airborne fraction to temperature in years/K
+    RELATIVE_STANDARD_DEVIATION = 0.1
+
+    @classmethod
+    def sample(cls, random_generator, number_of_members):
+        # Dictionary of arrays of parameter values, one value per member
+        tcr = cls.TCR_MEDIAN * np.exp(random_generator.normal(0., cls.TCR_LOG_STANDARD_DEVIATION, number_of_members))
+        rwf = np.clip(random_generator.normal(cls.RWF_MEAN, cls.RWF_STANDARD_DEVIATION, number_of_members), *cls.RWF_LIMITS)
+        parameters = {"tcr": tcr, "ecs": tcr / rwf}
+        for name, default_value in (("r0", cls.R0), ("rc", cls.RC), ("rt", cls.RT)):
+            parameters[name] = np.maximum(
+                random_generator.normal(default_value, default_value * cls.RELATIVE_STANDARD_DEVIATION, number_of_members), 0.)
+        return parameters
+
+
+class RcpMonteCarloChunk(FAIRModel):
+    # Runs a chunk of the members of a Monte Carlo ensemble for a preset RCP scenario
+    def __init__(self, name, rcp_scenario, seed_sequence, number_of_members):
+        # params seed_sequence: numpy SeedSequence for this chunk, so the output depends only on the ensemble's seed
+        super().__init__(name)
+        self.rcp_scenario_number = rcp_scenario
+        self.seed_sequence = seed_sequence
+        self.number_of_members = number_of_members
+        self.temperatures = None  # 2-D array of temperatures with one row per member
+        self.times = None
+
+    def run(self):
+        from fair.forward import fair_scm
+
+        years, emissions = RcpModel.get_emissions(self.rcp_scenario_number)
+        parameters = ParameterDistributions.sample(np.random.default_rng(self.seed_sequence), self.number_of_members)
+
+        # Stored as float32 to halve the data sent back from the worker, which is well within the histogram resolution
+        self.temperatures = np.empty((self.number_of_members, len(emissions)), dtype=np.float32)
+        for member_num in range(self.number_of_members):
+            _, _, self.temperatures[member_num] = fair_scm(
+                emissions=emissions,
+                tcrecs=np.array([parameters["tcr"][member_num], parameters["ecs"][member_num]]),
+                r0=parameters["r0"][member_num],
+                rc=parameters["rc"][member_num],
+                rt=parameters["rt"][member_num])
+        self.times = np.asarray(years, dtype=float)
+
+
+# Members in each chunk, small enough for a chunk to finish well within the simulation pool's timeout
+# (each member is a multi-gas FAIR run taking up to about 0.7 s)
+CHUNK_SIZE = 10
+
+
+def create_chunks(name, rcp_scenario, number_of_members, seed, chunk_size=CHUNK_SIZE):
+    # Splits an ensemble into chunks with their own random seeds
+    # The chunk size is fixed (not based on the number of cores) so the same seed always gives the same members
+    seed_sequences = np.random.SeedSequence(seed).spawn(-(-number_of_members // chunk_size))
+    return [RcpMonteCarloChunk(name, rcp_scenario, seed_sequence,
+                               min(chunk_size, number_of_members - chunk_num * chunk_size))
+            for chunk_num, seed_sequence in enumerate(seed_sequences)]
+
+
+class PercentileAccumulator:
+    # Histogram of temperatures for each year which members are added to as they are produced
+    # Percentiles are interpolated within bins, so are accurate to within the bin width
+    # The range starts from lower to upper and bins are added whenever members fall outside it
+    def __init__(self, number_of_years, lower=-2., upper=16., bin_width=0.01):
+        self.lower = lower
+        self.bin_width = bin_width
+        self.number_of_bins = round((upper - lower) / bin_width)
+        self.counts = np.zeros((number_of_years, self.number_of_bins), dtype=np.int64)
+        self.number_of_members = 0
+
+    def extend_range(self, temperatures):
+        # Adds empty bins below or above the range so every temperature has its own bin
+        extra_below = max(0, int(np.ceil((self.lower - temperatures.min()) / self.bin_width)))
+        extra_above = max(0, int((temperatures.max() - self.lower) // self.bin_width) + 1 - self.number_of_bins)
+        if extra_below or extra_above:
+            self.counts = np.pad(self.counts, ((0, 0), (extra_below, extra_above)))
+            self.lower -= extra_below * self.bin_width
+            self.number_of_bins += extra_below + extra_above
+
+    def add(self, temperatures):
+        # params temperatures: 2-D array with one row of yearly temperatures per member
+        if not np.isfinite(temperatures).all():
+            raise ValueError("Monte Carlo members gave temperatures which are not finite")
+        self.extend_range(temperatures)
+        # Clipped only to guard against rounding at the edges of the range
+        bin_nums = np.clip(np.floor((temperatures - self.lower) / self.bin_width).astype(np.int64),
+                           0, self.number_of_bins - 1)
+        flat_bin_nums = bin_nums + np.arange(self.counts.shape[0]) * self.number_of_bins
+        self.counts += np.bincount(flat_bin_nums.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+        self.number_of_members += len(temperatures)
+
+    def percentiles(self, percents):
+        # 2-D array with one row per percentile of the temperature in each year
+        cumulative_counts = np.cumsum(self.counts, axis=1)
+        years = np.arange(self.counts.shape[0])
+        bands = np.empty((len(percents), self.counts.shape[0]))
+        for percent_num, percent in enumerate(percents):
+            target = percent / 100 * self.number_of_members
+            # First non-empty bin which takes the cumulative count to the target, then interpolate within it
+            # (without skipping empty bins the 0th percentile would always be the bottom of the range)
+            bin_nums = np.argmax((cumulative_counts >= target) & (self.counts > 0), axis=1)
+            count_before = np.where(bin_nums > 0, cumulative_counts[years, bin_nums - 1], 0)
+            count_in_bin = np.maximum(self.counts[years, bin_nums], 1)
+            fraction = np.clip((target - count_before) / count_in_bin, 0., 1.)
+            bands[percent_num] = self.lower + (bin_nums + fraction) * self.bin_width
+        return bands
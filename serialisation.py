@@ -0,0 +1,176 @@
+import io
+import json
+import numpy as np
+from fastapi.responses import Response
+from simulation_pool import SimulationTimeoutError
+
+# Formats for sending simulation output to clients
+
+JSON_MEDIA_TYPE = "application/json"
+NPY_MEDIA_TYPE = "application/x-npy"  # numpy .npy file of little-endian float64
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"  # only available if pyarrow is installed
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+def arrow_available():
+    # pyarrow is an optional dependency
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def orjson_available():
+    # orjson is an optional dependency which encodes numpy arrays directly, much faster than converting them to lists
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parse_accept(accept_header):
+    # List of (media range, quality) pairs in an Accept header, for example "application/json;q=0.5" gives
+    # ("application/json", 0.5); entries without a q-value have a quality of 1 and ones with an invalid q-value of 0
+    media_ranges = []
+    for entry in (accept_header or "").split(","):
+        media_range, *parameters = [part.strip() for part in entry.split(";")]
+        if not media_range:
+            continue
+        quality = 1.
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.
+        media_ranges.append((media_range.lower(), quality))
+    return media_ranges
+
+
+def negotiate(media_ranges, media_types, default):
+    # Returns the one of media_types the client prefers according to the parsed Accept header, or default if there is
+    # no Accept header or none of them are acceptable
+    # Each media type takes its quality from the most specific entry matching it (itself, then type/*, then */*)
+    # and is never chosen with a quality of 0. Ties go to the more specific match, then the entry given first,
+    # then the media type listed first
+    best_rank, best_media_type = None, default
+    for type_num, media_type in enumerate(media_types):
+        patterns = {media_type: 2, media_type.split("/")[0] + "/*": 1, "*/*": 0}
+        matches = [(patterns[media_range], -position, quality)
+                   for position, (media_range, quality) in enumerate(media_ranges) if media_range in patterns]
+        if not matches:
+            continue
+        specificity, position, quality = max(matches)
+        rank = (quality, specificity, position, -type_num)
+        if quality > 0 and (best_rank is None or rank > best_rank):
+            best_rank, best_media_type = rank, media_type
+    return best_media_type
+
+
+def choose_response_format(accept_header):
+    # Returns the media type to use for the Accept header of the request
+    # Binary formats are only used when asked for by name, otherwise (including for wildcards) JSON is used
+    media_ranges = parse_accept(accept_header)
+    media_types = [JSON_MEDIA_TYPE, NPY_MEDIA_TYPE]
+    # Only checked when asked for, as trying to import pyarrow when it is not installed is slow
+    if any(media_range == ARROW_MEDIA_TYPE for media_range, _ in media_ranges) and arrow_available():
+        media_types.append(ARROW_MEDIA_TYPE)
+    return negotiate(media_ranges, media_types, JSON_MEDIA_TYPE)
+
+
+def to_json(model_input, times, temperatures, extra_arrays=None):
+    # JSON object of the input fields with the temperatures, times and any other output arrays
+    # Arrays were generated by the server so are converted directly rather than revalidated through the response model
+    arrays = {"temperatures": temperatures, "times": times} | (extra_arrays or {})
+    if orjson_available():
+        import orjson
+
+        # orjson only encodes C-contiguous arrays (windows of ensemble output are views with gaps between rows)
+        outputs = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+        return orjson.dumps(model_input | outputs, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(model_input | {name: array.tolist() for name, array in arrays.items()})
+
+
+def to_npy(times, temperatures, extra_arrays=None):
+    # .npy file of a 2-D float64 array whose first row is the times and following rows are the temperatures
+    # (one row for a single run or one row per member of an ensemble), followed by the rows of any other output arrays
+    buffer = io.BytesIO()
+    rows = np.vstack([times, temperatures, *(extra_arrays or {}).values()])
+    np.lib.format.write_array(buffer, rows.astype("<f8", copy=False), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def to_arrow(model_input, times, temperatures, extra_arrays=None):
+    # Arrow IPC stream of a table with a time column and a temperature column (or one per ensemble member)
+    # Other output arrays are added the same way, named after their key
+    # The input fields are stored as JSON in the schema metadata
+    import pyarrow
+
+    columns = {"time": times}
+    for name, array in ({"temperature": temperatures} | (extra_arrays or {})).items():
+        if array.ndim == 1:
+            columns[name] = array
+        else:
+            for row_num, row in enumerate(array):
+                columns[f"{name}_{row_num}"] = row
+    table = pyarrow.table(columns, metadata={"input": json.dumps(model_input)})
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def build_response(media_type, model_input, times, temperatures, extra_arrays=None):
+    # Response with the simulation output in the chosen format
+    # params model_input: dictionary of input fields echoed back (not included in the .npy format)
+    # params times, temperatures: numpy arrays of output from the simulation
+    # params extra_arrays: dictionary of any other output arrays sharing the times, in the order they are sent
+    if media_type == NPY_MEDIA_TYPE:
+        content = to_npy(times, temperatures, extra_arrays)
+    elif media_type == ARROW_MEDIA_TYPE:
+        content = to_arrow(model_input, times, temperatures, extra_arrays)
+    else:
+        content = to_json(model_input, times, temperatures, extra_arrays)
+    return Response(content=content, media_type=media_type)
+
+
+def format_sample(temperature, current_time):
+    # JSON object for a single (temperature, time) sample
+    return json.dumps({"temperature": float(temperature), "time": float(current_time)})
+
+
+def format_error(detail):
+    # JSON object for an error which stopped a stream after its response had already started
+    return json.dumps({"error": detail})
+
+
+def ndjson_lines(samples):
+    # Generator of newline-delimited JSON, one line per sample
+    # If the simulation times out a final line with the error is sent, as the response status has already been sent
+    try:
+        for temperature, current_time in samples:
+            yield format_sample(temperature, current_time) + "\n"
+    except SimulationTimeoutError as error:
+        yield format_error(str(error)) + "\n"
+
+
+def sse_events(samples):
+    # Generator of Server-Sent Events, one "sample" event per sample followed by an "end" event
+    # If the simulation times out an "error" event is sent instead of the "end" event
+    try:
+        for temperature, current_time in samples:
+            yield f"event: sample\ndata: {format_sample(temperature, current_time)}\n\n"
+    except SimulationTimeoutError as error:
+        yield f"event: error\ndata: {format_error(str(error))}\n\n"
+        return
+    yield "event: end\ndata: {}\n\n"
+
+
+def choose_stream_format(accept_header):
+    # Returns the streaming media type to use for the Accept header of the request (NDJSON unless SSE is preferred)
+    return negotiate(parse_accept(accept_header), [NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE], NDJSON_MEDIA_TYPE)
@@ -0,0 +1,76 @@
+import importlib.metadata
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+
+# Read-only arrays shared between server processes through memory-mapped .npy files
+# Each array is written once and every process maps the same file, so the operating system keeps a single copy
+# in memory however many server workers (and their simulation pool workers) are running
+
+
+@contextmanager
+def atomic_write(path):
+    # Opens a file to write in binary mode which only replaces path once the with block has finished, so other
+    # processes reading path see either the old file or the whole new one and never a partly written file
+    # The temporary file is unique to this writer so several processes or threads can write the same path at once
+    directory, name = os.path.split(path)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory or ".", prefix=f"{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file:
+            yield file
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+class SharedArrayStore:
+    # Increase when the shared arrays are computed or laid out differently, so workers never attach to stale arrays
+    DATA_VERSION = 1
+
+    def __init__(self, directory, data_version=None):
+        # params directory: folder shared by every worker
+        # params data_version: arrays stored under other data versions in the directory are deleted, defaults to
+        # the installed fair version (the arrays are its datasets and outputs) combined with DATA_VERSION
+        data_version = data_version or self.get_data_version()
+        self.directory = os.path.join(directory, f"data_version_{data_version}")
+        os.makedirs(self.directory, exist_ok=True)
+        # Invalidate arrays stored by any other version (processes still using them keep their mapped copies)
+        for folder_name in os.listdir(directory):
+            folder_path = os.path.join(directory, folder_name)
+            if folder_name.startswith("data_version_") and folder_path != self.directory:
+                shutil.rmtree(folder_path, ignore_errors=True)
+        self.arrays = {}  # Mapping of name to the array attached in this process
+
+    @classmethod
+    def get_data_version(cls):
+        # Read from the package metadata so that fair itself is not imported at startup
+        return f"fair_{importlib.metadata.version('fair')}_{cls.DATA_VERSION}"
+
+    @classmethod
+    def from_environment(cls):
+        # Store in SHARED_DATA_DIRECTORY, or None if it is not set (each process then keeps its own copies)
+        directory = os.environ.get("SHARED_DATA_DIRECTORY")
+        return cls(directory) if directory else None
+
+    def get_path(self, name):
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def get(self, name):
+        # Read-only memory-mapped array, or None if no process has stored it yet
+        if name not in self.arrays:
+            try:
+                self.arrays[name] = np.load(self.get_path(name), mmap_mode="r")
+            except FileNotFoundError:
+                return None
+        return self.arrays[name]
+
+    def put(self, name, array):
+        # Stores the array if no other process has already, then returns the shared read-only copy
+        path = self.get_path(name)
+        if not os.path.exists(path):
+            with atomic_write(path) as file:
+                np.save(file, np.ascontiguousarray(array))
+        return self.get(name)
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Runs simulations away from the event loop so that one slow model run does not block other requests
+
+
+class PoolFullError(Exception):
+    # Raised when too many simulations are already waiting for or using the pool
+    pass
+
+
+class SimulationTimeoutError(Exception):
+    # Raised when a simulation takes longer than the pool's timeout
+    pass
+
+
+def warm_up():
+    # Runs once in every worker so the FAIR model is already imported before the first request
+    # climlab and the RCP datasets are left to be imported by the first run which needs them
+    import models  # noqa: F401
+    import fair.forward  # noqa: F401
+
+
+def run_model(model):
+    # Runs a simulation inside a worker and returns it so its history can be read by the caller
+    model.run()
+    return model
+
+
+class SimulationPool:
+    KINDS = ("process", "thread")
+
+    def __init__(self, kind="process", max_workers=None, max_queue_depth=None, timeout=30.):
+        # params kind: "process" to use worker processes (uses several cores) or "thread" to use worker threads
+        # params max_workers: number of workers, defaults to the number of cores
+        # params max_queue_depth: most simulations allowed to be running or waiting at once before rejecting requests
+        # params timeout: seconds a request waits for its simulation before giving up
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown pool kind '{kind}', must be one of {self.KINDS}")
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue_depth = max_queue_depth or self.max_workers * 4
+        self.timeout = timeout
+        self.queue_depth = 0  # simulations currently running or waiting for a worker
+        self.executor = None
+
+    @classmethod
+    def from_environment(cls):
+        # Pool configured through SIMULATION_POOL_KIND, SIMULATION_POOL_WORKERS,
+        # SIMULATION_POOL_MAX_QUEUE and SIMULATION_TIMEOUT environment variables
+        return cls(kind=os.environ.get("SIMULATION_POOL_KIND", "process"),
+                   max_workers=int(os.environ.get("SIMULATION_POOL_WORKERS", 0)) or None,
+                   max_queue_depth=int(os.environ.get("SIMULATION_POOL_MAX_QUEUE", 0)) or None,
+                   timeout=float(os.environ.get("SIMULATION_TIMEOUT", 30.)))
+
+    def start(self):
+        # Create the workers and make them import the climate libraries straight away
+        if self.executor is not None:
+            return
+        if self.kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=warm_up)
+            # Workers are only created when work is submitted so submit an empty task for each one
+            for _ in range(self.max_workers):
+                self.executor.submit(int)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, initializer=warm_up)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    async def submit(self, function, *args):
+        # Runs function(*args) on a worker and waits for the result
+        # Raises PoolFullError if the queue is full and SimulationTimeoutError if the result takes too long
+        self.reserve()
+        self.start()
+
+        loop = asyncio.get_running_loop()
+        try:
+            executor_future = self.executor.submit(function, *args)
+        except BaseException:
+            self.queue_depth -= 1
+            raise
+        # Only counted as finished once the worker is done with it (or it was cancelled before starting),
+        # so simulations abandoned after a timeout still take up the queue while they are running
+        executor_future.add_done_callback(lambda _: self.release(loop))
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(executor_future)), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            # A simulation still waiting for a worker is cancelled, but a running one cannot be interrupted so it
+            # finishes in the background and its result is discarded
+            executor_future.cancel()
+            raise SimulationTimeoutError(f"Simulation did not finish within {self.timeout} seconds")
+
+    def reserve(self):
+        # Takes a place in the queue, raising PoolFullError if the queue is full
+        # Also used for simulations run outside the workers (such as one stepped forward as its response is streamed)
+        # so they are limited in the same way; decrease_queue_depth must be called once they have finished
+        if self.queue_depth >= self.max_queue_depth:
+            raise PoolFullError("Too many simulations are in progress, try again later")
+        self.queue_depth += 1
+
+    def time_limited(self, samples):
+        # Generator of the samples of a simulation run outside the workers, which raises SimulationTimeoutError
+        # (rather than giving any more samples) once it has taken longer than the timeout
+        deadline = time.monotonic() + self.timeout
+        for sample in samples:
+            if time.monotonic() > deadline:
+                raise SimulationTimeoutError(f"Simulation did not finish within {self.timeout} seconds")
+            yield sample
+
+    def release(self, loop):
+        # Called from the executor when a simulation finishes, so the queue depth is changed on the event loop's thread
+        try:
+            loop.call_soon_threadsafe(self.decrease_queue_depth)
+        except RuntimeError:
+            pass  # the event loop has closed so nothing is left waiting on the pool
+
+    def decrease_queue_depth(self):
+        self.queue_depth -= 1
+
+    async def run(self, model):
+        # Runs a simulation on a worker and returns the completed simulation
+        return await self.submit(run_model, model)
@@ -1,7 +1,53 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
 import unittest
+import numpy as np
 from fastapi.testclient import TestClient
-from main import app
-from models import Constants, ZeroDimensionalEnergyBalanceModel, RcpModel
+from api_models import FAIRMonteCarloInput
+from jobs import current_progress_reporter
+from main import app, run_monte_carlo_chunks, simulation_pool
+from models import Constants, ZeroDimensionalEnergyBalanceModel, RcpModel, CustomEmissionsModel
+from serialisation import to_json
+from validation import RcpFAIRMonteCarloValidator
+
+
+def setUpModule():
+    # Jobs stored by the server started in these tests are kept in a temporary directory rather than the checkout
+    global jobs_directory
+    jobs_directory = tempfile.TemporaryDirectory()
+    os.environ["JOBS_DIRECTORY"] = jobs_directory.name
+
+
+def tearDownModule():
+    del os.environ["JOBS_DIRECTORY"]
+    jobs_directory.cleanup()
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_execute_EBM_reports_server_timing(self):
+        # Timings of each phase of the request are given in the Server-Timing header
+        client = TestClient(app)
+        response = client.post("/execute/EBM", json={"model_name": "Arbitrary Name", "initial_temperature": 12.5,
+                                                      "insolation": Constants.INSOLATION_OBSERVED,
+                                                      "albedo": Constants.ALPHA, "tau": Constants.TAU})
+        self.assertEqual(response.status_code, 200)
+        phases = [timing.split(";")[0] for timing in response.headers["Server-Timing"].split(", ")]
+        for phase in ["validation", "cache", "serialisation", "total"]:
+            self.assertIn(phase, phases)
+
+    def test_metrics_endpoint(self):
+        # Metrics include request latency histograms, cache hit rates and pool queue depth
+        client = TestClient(app)
+        client.get("/")
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{handler="root"}', response.text)
+        self.assertIn("ebm_cache_hit_rate", response.text)
+        self.assertIn("simulation_pool_queue_depth", response.text)
 
 
 class TestEBMEndpoint(unittest.TestCase):
@@ -32,7 +78,8 @@ class TestEBMEndpoint(unittest.TestCase):
                                                   initial_temperature,
                                                   Constants.INSOLATION_OBSERVED,
                                                   Constants.ALPHA,
-                                                  Constants.TAU)
+                                                  Constants.TAU,
+                                                  engine="numpy")
         model.run()
         simulation_data = model.get_temperature_time_data()
 
@@ -40,7 +87,13 @@ class TestEBMEndpoint(unittest.TestCase):
         self.assertEqual(response.json(),
                          {"temperatures": simulation_data["temperatures"], "times": simulation_data["times"],
                           "model_name": model_name, "initial_temperature": initial_temperature,
-                          "insolation": Constants.INSOLATION_OBSERVED, "albedo": Constants.ALPHA, "tau": Constants.TAU})
+                          "insolation": Constants.INSOLATION_OBSERVED, "albedo": Constants.ALPHA, "tau": Constants.TAU,
+                          "duration": 50, "timestep": 30, "sample_interval": 1, "convergence_tolerance": None,
+                          "time_steps_completed": 600, "converged": False,
+                          "snapshot": {"temperature": simulation_data["temperatures"][-1], "elapsed_time": 50,
+                                       "elapsed_steps": 600, "timestep": 30, "insolation": Constants.INSOLATION_OBSERVED,
+                                       "albedo": Constants.ALPHA, "tau": Constants.TAU, "engine": "numpy",
+                                       "engine_version": ZeroDimensionalEnergyBalanceModel.ENGINE_VERSION}})
 
     def test_execute_EBM_missing_required_parameters(self):
         # Raises 422 error if required parameters are missing
@@ -67,6 +120,244 @@ class TestEBMEndpoint(unittest.TestCase):
                                                   "insolation": Constants.INSOLATION_OBSERVED, "albedo": Constants.ALPHA, "tau": Constants.TAU})
         self.assertEqual(response.status_code, 400)
 
+class TestBinaryResponses(unittest.TestCase):
+    def test_execute_EBM_npy_response(self):
+        # .npy response holds the same times and temperatures as the JSON response
+        client = TestClient(app)
+        model_input = {"model_name": "Arbitrary Name", "initial_temperature": 30, "insolation": Constants.INSOLATION_OBSERVED,
+                       "albedo": Constants.ALPHA, "tau": Constants.TAU}
+        response = client.post("/execute/EBM", json=model_input, headers={"Accept": "application/x-npy"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/x-npy")
+        times, temperatures = np.load(io.BytesIO(response.content))
+
+        json_response = client.post("/execute/EBM", json=model_input).json()
+        self.assertEqual(times.tolist(), json_response["times"])
+        self.assertEqual(temperatures.tolist(), json_response["temperatures"])
+
+    def test_execute_Rcp_model_npy_response(self):
+        client = TestClient(app)
+        model_input = {"model_name": "Arbitrary Name", "rcp_scenario": 4}
+        response = client.post("/execute/FAIR/preset", json=model_input, headers={"Accept": "application/x-npy"})
+        self.assertEqual(response.status_code, 200)
+        times, temperatures = np.load(io.BytesIO(response.content))
+
+        json_response = client.post("/execute/FAIR/preset", json=model_input).json()
+        self.assertEqual(times.tolist(), json_response["times"])
+        self.assertEqual(temperatures.tolist(), json_response["temperatures"])
+
+
+    def test_accept_header_quality_values(self):
+        # Formats are chosen by their q-values rather than by being mentioned anywhere in the Accept header
+        client = TestClient(app)
+        model_input = {"model_name": "Arbitrary Name", "rcp_scenario": 4}
+        for accept, media_type in (("application/x-npy;q=0, application/json", "application/json"),
+                                   ("application/json;q=0.5, application/x-npy;q=0.9", "application/x-npy"),
+                                   ("*/*", "application/json"),
+                                   ("text/html, application/x-npy;q=0.1", "application/x-npy")):
+            response = client.post("/execute/FAIR/preset", json=model_input, headers={"Accept": accept})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers["content-type"], media_type, msg=accept)
+
+
+class TestJSONEncoding(unittest.TestCase):
+    def test_to_json_of_matrix_window(self):
+        # Windows of ensemble output are not contiguous in memory but are still encoded exactly
+        temperatures = np.random.default_rng(0).normal(size=(5, 20))[:, 3:17]
+        times = np.arange(20.)[3:17]
+        data = json.loads(to_json({"model_name": "Arbitrary Name"}, times, temperatures, {"forcing": times * 1e-5}))
+        self.assertEqual(data["model_name"], "Arbitrary Name")
+        self.assertEqual(data["temperatures"], temperatures.tolist())
+        self.assertEqual(data["times"], times.tolist())
+        self.assertEqual(data["forcing"], (times * 1e-5).tolist())
+
+
+class TestEBMStreamEndpoint(unittest.TestCase):
+    model_input = {"model_name": "Arbitrary Name", "initial_temperature": 30, "insolation": Constants.INSOLATION_OBSERVED,
+                   "albedo": Constants.ALPHA, "tau": Constants.TAU}
+
+    def test_execute_EBM_stream_ndjson_matches_full_response(self):
+        # Streamed samples are the same as the temperatures and times from the non-streaming endpoint
+        client = TestClient(app)
+        response = client.post("/execute/EBM/stream", json=self.model_input)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("application/x-ndjson"))
+        samples = [json.loads(line) for line in response.text.splitlines()]
+
+        full_response = client.post("/execute/EBM", json=self.model_input).json()
+        self.assertEqual([sample["temperature"] for sample in samples], full_response["temperatures"])
+        self.assertEqual([sample["time"] for sample in samples], full_response["times"])
+
+    def test_execute_EBM_stream_server_sent_events(self):
+        client = TestClient(app)
+        response = client.post("/execute/EBM/stream", json=self.model_input, headers={"Accept": "text/event-stream"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/event-stream"))
+        events = response.text.strip().split("\n\n")
+        self.assertEqual(events[-1], "event: end\ndata: {}")
+        self.assertEqual(len(events) - 1, ZeroDimensionalEnergyBalanceModel.TIME_STEPS // 12 + 1)
+
+    def test_execute_EBM_stream_invalid_temperature_value(self):
+        client = TestClient(app)
+        response = client.post("/execute/EBM/stream", json=self.model_input | {"initial_temperature": 1000})
+        self.assertEqual(response.status_code, 400)
+
+    def test_execute_EBM_stream_counts_towards_simulation_pool(self):
+        # Streamed simulations take a place in the simulation pool's queue until their response has finished
+        client = TestClient(app)
+        queue_depth = simulation_pool.queue_depth
+        response = client.post("/execute/EBM/stream", json=self.model_input | {"initial_temperature": 17.75})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(simulation_pool.queue_depth, queue_depth)
+
+        max_queue_depth = simulation_pool.max_queue_depth
+        simulation_pool.max_queue_depth = 0
+        try:
+            response = client.post("/execute/EBM/stream", json=self.model_input | {"initial_temperature": 17.5})
+        finally:
+            simulation_pool.max_queue_depth = max_queue_depth
+        self.assertEqual(response.status_code, 503)
+
+    def test_execute_EBM_stream_timeout(self):
+        # A stream which reaches the simulation pool's timeout is stopped with an error after its last sample
+        client = TestClient(app)
+        timeout = simulation_pool.timeout
+        simulation_pool.timeout = 0
+        try:
+            response = client.post("/execute/EBM/stream", json=self.model_input | {"initial_temperature": 17.25},
+                                   headers={"Accept": "text/event-stream"})
+        finally:
+            simulation_pool.timeout = timeout
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.text.strip().split("\n\n")[-1].startswith("event: error\ndata: {\"error\": "))
+
+
+class TestEBMRunConfiguration(unittest.TestCase):
+    model_input = {"model_name": "Arbitrary Name", "initial_temperature": 30, "insolation": Constants.INSOLATION_OBSERVED,
+                   "albedo": Constants.ALPHA, "tau": Constants.TAU}
+
+    def test_execute_EBM_custom_run_length(self):
+        # Runs for the requested duration, recording at the requested interval
+        client = TestClient(app)
+        response = client.post("/execute/EBM", json=self.model_input | {"duration": 10, "timestep": 10,
+                                                                         "sample_interval": 0.5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["times"], [sample_num * 0.5 for sample_num in range(21)])
+        self.assertEqual(response.json()["time_steps_completed"], 360)
+
+    def test_execute_EBM_convergence_stops_early(self):
+        client = TestClient(app)
+        response = client.post("/execute/EBM", json=self.model_input | {"duration": 1000, "convergence_tolerance": 0.01})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["converged"])
+        self.assertLess(response.json()["time_steps_completed"], 12000)
+
+    def test_execute_EBM_sample_interval_not_whole_number_of_timesteps(self):
+        # Raises 400 error if samples would not fall at the end of a timestep
+        client = TestClient(app)
+        response = client.post("/execute/EBM", json=self.model_input | {"timestep": 7, "sample_interval": 1})
+        self.assertEqual(response.status_code, 400)
+
+    def test_execute_EBM_invalid_duration(self):
+        client = TestClient(app)
+        response = client.post("/execute/EBM", json=self.model_input | {"duration": 0})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestEBMContinueEndpoint(unittest.TestCase):
+    model_input = {"model_name": "Arbitrary Name", "initial_temperature": 30, "insolation": Constants.INSOLATION_OBSERVED,
+                   "albedo": Constants.ALPHA, "tau": Constants.TAU}
+
+    def test_continue_returns_only_new_segment(self):
+        client = TestClient(app)
+        first_output = client.post("/execute/EBM", json=self.model_input).json()
+        response = client.post("/execute/EBM/continue", json={"model_name": "Continued Name",
+                                                               "snapshot": first_output["snapshot"], "duration": 50})
+        long_output = client.post("/execute/EBM", json=self.model_input | {"duration": 100}).json()
+
+        self.assertEqual(response.status_code, 200)
+        continued_output = response.json()
+        self.assertEqual(continued_output["model_name"], "Continued Name")
+        self.assertEqual(continued_output["times"], long_output["times"][51:])
+        np.testing.assert_allclose(continued_output["temperatures"], long_output["temperatures"][51:], atol=1e-9)
+        self.assertEqual(continued_output["time_steps_completed"], 600)
+        self.assertEqual(continued_output["snapshot"]["elapsed_steps"], 1200)
+
+        # The new snapshot can be continued again
+        response = client.post("/execute/EBM/continue", json={"model_name": "Continued Name",
+                                                               "snapshot": continued_output["snapshot"], "duration": 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["times"], list(range(101, 111)))
+
+    def test_continue_invalid_snapshot(self):
+        client = TestClient(app)
+        snapshot = client.post("/execute/EBM", json=self.model_input | {"duration": 1}).json()["snapshot"]
+        for invalid_snapshot in (snapshot | {"engine_version": -1}, snapshot | {"engine": "fortran"},
+                                 snapshot | {"temperature": -300}, snapshot | {"albedo": 2}):
+            response = client.post("/execute/EBM/continue", json={"model_name": "Arbitrary Name",
+                                                                   "snapshot": invalid_snapshot})
+            self.assertEqual(response.status_code, 400, msg=invalid_snapshot)
+
+
+class TestEBMBatchEndpoint(unittest.TestCase):
+    def test_execute_EBM_batch_returns_temperature_matrix(self):
+        # Batch endpoint returns one row of temperatures per member which matches the single endpoint
+        client = TestClient(app)
+        model_name = "Arbitrary Name"
+        initial_temperatures = [-20, 30]
+        response = client.post("/execute/EBM/batch", json={"model_name": model_name,
+                                                           "initial_temperature": initial_temperatures,
+                                                           "insolation": [Constants.INSOLATION_OBSERVED],
+                                                           "albedo": [Constants.ALPHA],
+                                                           "tau": [Constants.TAU]})
+        self.assertEqual(response.status_code, 200)
+        batch_data = response.json()
+        self.assertEqual(batch_data["initial_temperature"], initial_temperatures)
+        self.assertEqual(batch_data["albedo"], [Constants.ALPHA, Constants.ALPHA])
+        self.assertEqual(len(batch_data["temperatures"]), 2)
+
+        single_response = client.post("/execute/EBM", json={"model_name": model_name,
+                                                            "initial_temperature": initial_temperatures[1],
+                                                            "insolation": Constants.INSOLATION_OBSERVED,
+                                                            "albedo": Constants.ALPHA,
+                                                            "tau": Constants.TAU})
+        single_data = single_response.json()
+        self.assertEqual(batch_data["times"], single_data["times"])
+        for batch_temperature, single_temperature in zip(batch_data["temperatures"][1], single_data["temperatures"]):
+            self.assertAlmostEqual(batch_temperature, single_temperature, places=9)
+
+    def test_execute_EBM_batch_grid(self):
+        client = TestClient(app)
+        response = client.post("/execute/EBM/batch", json={"model_name": "Arbitrary Name",
+                                                           "initial_temperature": [0, 10, 20],
+                                                           "insolation": [Constants.INSOLATION_OBSERVED],
+                                                           "albedo": [0.2, 0.3],
+                                                           "tau": [0.5, 0.6],
+                                                           "grid": True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["temperatures"]), 12)
+
+    def test_execute_EBM_batch_mismatched_lengths(self):
+        # Raises 400 error if parameter lists cannot be paired up
+        client = TestClient(app)
+        response = client.post("/execute/EBM/batch", json={"model_name": "Arbitrary Name",
+                                                           "initial_temperature": [0, 10, 20],
+                                                           "insolation": [Constants.INSOLATION_OBSERVED],
+                                                           "albedo": [0.2, 0.3],
+                                                           "tau": [Constants.TAU]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_execute_EBM_batch_invalid_value(self):
+        # Raises 400 error if any member has a value outside the realistic range
+        client = TestClient(app)
+        response = client.post("/execute/EBM/batch", json={"model_name": "Arbitrary Name",
+                                                           "initial_temperature": [0, 1000],
+                                                           "insolation": [Constants.INSOLATION_OBSERVED],
+                                                           "albedo": [Constants.ALPHA],
+                                                           "tau": [Constants.TAU]})
+        self.assertEqual(response.status_code, 400)
+
+
 class TestFAIREndpoint(unittest.TestCase):
     def test_execute_Rcp_model_returns_correct_data(self):
         # Check API output for running RCP scenario returns expected data
@@ -80,6 +371,17 @@ class TestFAIREndpoint(unittest.TestCase):
         self.assertEqual(response.json(), {"model_name": model_name, "rcp_scenario": 1,
                                            "temperatures": simulation_data["temperatures"], "times": simulation_data["times"]})
 
+    def test_execute_Rcp_model_repeat_requests_echo_model_name(self):
+        # Repeat requests for the same scenario are served from cache but still echo their own model name
+        client = TestClient(app)
+        first_response = client.post("/execute/FAIR/preset", json={"model_name": "First Name", "rcp_scenario": 3})
+        second_response = client.post("/execute/FAIR/preset", json={"model_name": "Second Name", "rcp_scenario": 3})
+        self.assertEqual(first_response.status_code, 200)
+        self.assertEqual(second_response.status_code, 200)
+        self.assertEqual(first_response.json()["model_name"], "First Name")
+        self.assertEqual(second_response.json()["model_name"], "Second Name")
+        self.assertEqual(first_response.json()["temperatures"], second_response.json()["temperatures"])
+
     def test_execute_Rcp_model_missing_required_input(self):
         # Check API returns error if required is_rcp parameter not supplied
         client = TestClient(app)
@@ -95,7 +397,260 @@ class TestFAIREndpoint(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
 
 
+class TestFAIRCompareEndpoint(unittest.TestCase):
+    model_input = {"model_name": "Arbitrary Name", "rcp_scenarios": [4, 1], "include_concentrations": True,
+                   "include_forcing": True, "baseline_scenario": 1}
+
+    def test_compare_matches_preset_scenarios(self):
+        client = TestClient(app)
+        response = client.post("/execute/FAIR/compare", json=self.model_input)
+        self.assertEqual(response.status_code, 200)
+        output = response.json()
+        preset_outputs = [client.post("/execute/FAIR/preset", json={"model_name": "Arbitrary Name",
+                                                                     "rcp_scenario": scenario_number}).json()
+                          for scenario_number in (4, 1)]
+
+        self.assertEqual(output["model_name"], "Arbitrary Name")
+        self.assertEqual(output["times"], preset_outputs[0]["times"])
+        self.assertEqual(output["temperatures"], [preset_output["temperatures"] for preset_output in preset_outputs])
+        # Differences are from the baseline scenario, which is the second row
+        np.testing.assert_allclose(output["temperature_differences"],
+                                   np.array(output["temperatures"]) - np.array(output["temperatures"][1]))
+        self.assertEqual(np.array(output["co2_concentrations"]).shape, (2, len(output["times"])))
+        self.assertEqual(np.array(output["forcing"]).shape, (2, len(output["times"])))
+        # RCP8.5 ends with more CO2 and forcing than RCP2.6
+        self.assertGreater(output["co2_concentrations"][0][-1], output["co2_concentrations"][1][-1])
+        self.assertGreater(output["forcing"][0][-1], output["forcing"][1][-1])
+
+    def test_compare_optional_outputs_left_out(self):
+        client = TestClient(app)
+        output = client.post("/execute/FAIR/compare", json={"model_name": "Arbitrary Name", "rcp_scenarios": [2, 3]}).json()
+        self.assertEqual(np.array(output["temperatures"]).shape, (2, len(output["times"])))
+        for name in ("co2_concentrations", "forcing", "temperature_differences"):
+            self.assertNotIn(name, output)
+
+    def test_compare_binary_and_downsampled(self):
+        client = TestClient(app)
+        response = client.post("/execute/FAIR/compare", json=self.model_input, params={"max_points": 20, "method": "lttb"},
+                               headers={"Accept": "application/x-npy"})
+        self.assertEqual(response.status_code, 200)
+        rows = np.load(io.BytesIO(response.content))
+        # Times, then two rows each of temperatures, CO2 concentrations, forcing and temperature differences
+        self.assertEqual(rows.shape, (9, 20))
+
+    def test_compare_invalid_scenarios(self):
+        client = TestClient(app)
+        for invalid_input in ({"rcp_scenarios": []}, {"rcp_scenarios": [1, 5]}, {"rcp_scenarios": [1, 1]},
+                              {"rcp_scenarios": [1, 2], "baseline_scenario": 3}):
+            response = client.post("/execute/FAIR/compare", json={"model_name": "Arbitrary Name"} | invalid_input)
+            self.assertEqual(response.status_code, 400, msg=invalid_input)
+
+
+class TestOutputWindow(unittest.TestCase):
+    model_input = {"model_name": "Arbitrary Name", "rcp_scenario": 1}
+
+    def test_window_and_max_points_reduce_output(self):
+        client = TestClient(app)
+        full_output = client.post("/execute/FAIR/preset", json=self.model_input).json()
+        for method in ("stride", "mean", "lttb"):
+            response = client.post("/execute/FAIR/preset", json=self.model_input,
+                                   params={"start": 1900, "end": 2100, "max_points": 50, "method": method})
+            self.assertEqual(response.status_code, 200, msg=method)
+            output = response.json()
+            self.assertEqual(output["model_name"], "Arbitrary Name")
+            self.assertEqual(len(output["times"]), 50, msg=method)
+            self.assertEqual(len(output["temperatures"]), 50, msg=method)
+            self.assertTrue(1900 <= output["times"][0] and output["times"][-1] <= 2100, msg=method)
+        self.assertEqual(len(full_output["times"]), 736)
+
+    def test_window_only_matches_full_output(self):
+        client = TestClient(app)
+        full_output = client.post("/execute/FAIR/preset", json=self.model_input).json()
+        output = client.post("/execute/FAIR/preset", json=self.model_input, params={"start": 2000, "end": 2010}).json()
+        first = full_output["times"].index(2000)
+        self.assertEqual(output["times"], full_output["times"][first:first + 11])
+        self.assertEqual(output["temperatures"], full_output["temperatures"][first:first + 11])
+
+    def test_batch_output_is_downsampled(self):
+        client = TestClient(app)
+        response = client.post("/execute/EBM/batch", params={"max_points": 10},
+                               json={"model_name": "Arbitrary Name", "initial_temperature": [10., 20.],
+                                     "insolation": [Constants.INSOLATION_OBSERVED], "albedo": [Constants.ALPHA],
+                                     "tau": [Constants.TAU]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["times"]), 10)
+        self.assertEqual(np.array(response.json()["temperatures"]).shape, (2, 10))
+
+    def test_invalid_window(self):
+        client = TestClient(app)
+        for params in ({"start": 2000, "end": 1900}, {"max_points": 1}, {"max_points": 10, "method": "median"}):
+            response = client.post("/execute/FAIR/preset", json=self.model_input, params=params)
+            self.assertEqual(response.status_code, 400, msg=params)
+
+
+
+class TestFAIRCustomEndpoint(unittest.TestCase):
+    emissions = np.linspace(0, 10, 200)
+
+    def test_execute_FAIR_custom_csv_returns_correct_data(self):
+        # CSV emissions give the same output as running the model directly
+        client = TestClient(app)
+        model_name = "Arbitrary Name"
+        response = client.post("/execute/FAIR/custom", params={"model_name": model_name, "start_year": 1900},
+                               data="\n".join(str(value) for value in self.emissions),
+                               headers={"Content-Type": "text/csv"})
+        model = CustomEmissionsModel(model_name, self.emissions, 1900)
+        model.run()
+        simulation_data = model.get_temperature_time_data()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"model_name": model_name, "start_year": 1900,
+                                           "temperatures": simulation_data["temperatures"], "times": simulation_data["times"]})
+
+    def test_execute_FAIR_custom_float64_matches_csv(self):
+        client = TestClient(app)
+        binary_response = client.post("/execute/FAIR/custom", params={"model_name": "Arbitrary Name"},
+                                      data=self.emissions.astype("<f8").tobytes(),
+                                      headers={"Content-Type": "application/octet-stream"})
+        csv_response = client.post("/execute/FAIR/custom", params={"model_name": "Arbitrary Name"},
+                                   data="\n".join(str(value) for value in self.emissions),
+                                   headers={"Content-Type": "text/csv"})
+        self.assertEqual(binary_response.status_code, 200)
+        self.assertEqual(binary_response.json(), csv_response.json())
+
+    def test_execute_FAIR_custom_invalid_emissions(self):
+        # Raises 400 error if emissions are unreadable or unrealistic
+        client = TestClient(app)
+        invalid_bodies = [("1.0\nabc\n", "text/csv"), ("1.0\n1000.0\n", "text/csv"), ("1.0\nNaN\n", "text/csv"),
+                          ("1.0", "text/csv"), ("[1.0, 2.0]", "application/json")]
+        for content, content_type in invalid_bodies:
+            response = client.post("/execute/FAIR/custom", params={"model_name": "Arbitrary Name"}, data=content,
+                                   headers={"Content-Type": content_type})
+            self.assertEqual(response.status_code, 400, msg=content)
+
+
+class TestFAIRMonteCarloEndpoint(unittest.TestCase):
+    model_input = {"model_name": "Arbitrary Name", "rcp_scenario": 2, "number_of_members": 150, "seed": 11}
+
+    def test_execute_FAIR_monte_carlo_returns_ordered_bands(self):
+        client = TestClient(app)
+        response = client.post("/execute/FAIR/montecarlo", json=self.model_input)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result["percentiles"], [5., 17., 50., 83., 95.])
+        self.assertEqual(result["times"], RcpModel.rcp_scenario_dict[2].Emissions.year.tolist())
+        bands = np.array(result["temperatures"])
+        self.assertEqual(bands.shape, (5, len(result["times"])))
+        # Each percentile is at least as warm as the one below it in every year
+        self.assertTrue(np.all(np.diff(bands, axis=0) >= 0))
+
+    def test_execute_FAIR_monte_carlo_is_reproducible(self):
+        client = TestClient(app)
+        first = client.post("/execute/FAIR/montecarlo", json=self.model_input).json()
+        second = client.post("/execute/FAIR/montecarlo", json=self.model_input).json()
+        other_seed = client.post("/execute/FAIR/montecarlo", json=self.model_input | {"seed": 12}).json()
+        self.assertEqual(first, second)
+        self.assertNotEqual(first["temperatures"], other_seed["temperatures"])
+
+    def test_monte_carlo_reports_progress_as_chunks_finish(self):
+        # Progress goes up each time one of the three chunks finishes (in whichever order they finish)
+        progress = []
+        token = current_progress_reporter.set(progress.append)
+        try:
+            asyncio.run(run_monte_carlo_chunks(FAIRMonteCarloInput.parse_obj(self.model_input | {"number_of_members": 25})))
+        finally:
+            current_progress_reporter.reset(token)
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(progress, sorted(progress))
+        self.assertEqual(progress[-1], 1.)
+
+    def test_execute_FAIR_monte_carlo_invalid_input(self):
+        client = TestClient(app)
+        for invalid_input in ({"rcp_scenario": 5}, {"number_of_members": 0}, {"number_of_members": 50001},
+                              {"seed": -1}, {"percentiles": []}, {"percentiles": [50, 101]}):
+            response = client.post("/execute/FAIR/montecarlo", json=self.model_input | invalid_input)
+            self.assertEqual(response.status_code, 400, msg=invalid_input)
+
+    def test_large_ensemble_must_be_run_as_job(self):
+        # Ensembles too large to run while the connection is held open are rejected, but can be submitted as jobs
+        client = TestClient(app)
+        response = client.post("/execute/FAIR/montecarlo", json=self.model_input | {"number_of_members": 201})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("POST /jobs", response.json()["detail"])
+        large_input = FAIRMonteCarloInput.parse_obj(self.model_input | {"number_of_members": 201})
+        self.assertTrue(RcpFAIRMonteCarloValidator(large_input).validate_all()["success"])
+
+
+class TestJobsEndpoints(unittest.TestCase):
+    model_input = {"model_name": "Arbitrary Name", "initial_temperature": 42.5, "insolation": Constants.INSOLATION_OBSERVED,
+                   "albedo": Constants.ALPHA, "tau": Constants.TAU}
+
+    @staticmethod
+    def wait_for_job(client, job_id, timeout=30.):
+        # Polls the job's status until it has finished
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = client.get(f"/jobs/{job_id}").json()
+            if status["status"] in ("completed", "failed"):
+                return status
+            time.sleep(0.05)
+        raise AssertionError("Job did not finish in time")
+
+    def test_job_result_matches_execute_endpoint(self):
+        # Client is used as a context manager so the job scheduler is started
+        with TestClient(app) as client:
+            response = client.post("/jobs", json={"model_type": "EBM", "simulation_input": self.model_input})
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json()["id"]
+
+            status = self.wait_for_job(client, job_id)
+            self.assertEqual(status["status"], "completed")
+            self.assertEqual(status["progress"], 1)
+
+            result = client.get(f"/jobs/{job_id}/result")
+            self.assertEqual(result.status_code, 200)
+            self.assertEqual(result.json(), client.post("/execute/EBM", json=self.model_input).json())
+
+    def test_compare_job_keeps_every_output(self):
+        compare_input = {"model_name": "Arbitrary Name", "rcp_scenarios": [1, 4], "include_concentrations": True,
+                         "include_forcing": True, "baseline_scenario": 1}
+        with TestClient(app) as client:
+            response = client.post("/jobs", json={"model_type": "FAIR/compare", "simulation_input": compare_input})
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json()["id"]
+            self.assertEqual(self.wait_for_job(client, job_id)["status"], "completed")
+            result = client.get(f"/jobs/{job_id}/result").json()
+            for name in ("co2_concentrations", "forcing", "temperature_differences"):
+                self.assertIn(name, result)
+            self.assertEqual(result, client.post("/execute/FAIR/compare", json=compare_input).json())
+
+    def test_job_waits_while_simulation_pool_is_full(self):
+        with TestClient(app) as client:
+            max_queue_depth = simulation_pool.max_queue_depth
+            simulation_pool.max_queue_depth = 0
+            try:
+                response = client.post("/jobs", json={"model_type": "EBM",
+                                                      "simulation_input": self.model_input | {"initial_temperature": 41.25}})
+                job_id = response.json()["id"]
+                time.sleep(0.5)
+                self.assertEqual(client.get(f"/jobs/{job_id}").json()["status"], "running")
+            finally:
+                simulation_pool.max_queue_depth = max_queue_depth
+            self.assertEqual(self.wait_for_job(client, job_id)["status"], "completed")
+
+    def test_invalid_job_is_rejected(self):
+        with TestClient(app) as client:
+            response = client.post("/jobs", json={"model_type": "EBM",
+                                                  "simulation_input": self.model_input | {"initial_temperature": 1000}})
+            self.assertEqual(response.status_code, 400)
+            response = client.post("/jobs", json={"model_type": "Unknown", "simulation_input": self.model_input})
+            self.assertEqual(response.status_code, 400)
+            response = client.post("/jobs", json={"model_type": "FAIR/preset", "simulation_input": self.model_input})
+            self.assertEqual(response.status_code, 422)
 
+    def test_unknown_job_not_found(self):
+        with TestClient(app) as client:
+            self.assertEqual(client.get("/jobs/missing").status_code, 404)
+            self.assertEqual(client.get("/jobs/missing/result").status_code, 404)
 
 
 if __name__ == '__main__':
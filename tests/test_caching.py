@@ -0,0 +1,163 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from api_models import FAIRPresetInput
+from caching import RcpResultCache, EBMResultCache, SingleFlight, canonical_key
+from models import Constants, ZeroDimensionalEnergyBalanceModel, RcpModel
+from shared_data import SharedArrayStore
+
+
+class TestRcpResultCache(unittest.TestCase):
+    def test_response_body_matches_model_output(self):
+        # Cached response body is the same as serialising the input and model output directly
+        model = RcpModel("Arbitrary Name", 2)
+        model.run()
+        simulation_data = model.get_temperature_time_data()
+
+        cache = RcpResultCache()
+        self.assertFalse(cache.contains(2))
+        cache.store(2, simulation_data)
+        self.assertTrue(cache.contains(2))
+
+        for model_name in ["First Name", "Second \"Name\""]:
+            model_input = FAIRPresetInput(model_name=model_name, rcp_scenario=2)
+            self.assertEqual(json.loads(cache.response_body(model_input)),
+                             {"model_name": model_name, "rcp_scenario": 2,
+                              "temperatures": simulation_data["temperatures"], "times": simulation_data["times"]})
+
+    def test_shared_output_attached_by_other_workers(self):
+        # A second cache (as in another server worker) uses the output stored by the first without running the model
+        model = RcpModel("Arbitrary Name", 1)
+        model.run()
+        with tempfile.TemporaryDirectory() as directory:
+            first_cache = RcpResultCache(shared_store=SharedArrayStore(directory))
+            second_cache = RcpResultCache(shared_store=SharedArrayStore(directory))
+            self.assertFalse(second_cache.attach_shared(1))
+            first_cache.store(1, model.get_temperature_time_arrays() | model.get_concentration_forcing_arrays())
+            self.assertTrue(second_cache.attach_shared(1))
+            self.assertFalse(second_cache.get(1)["temperatures"].flags.writeable)
+            model_input = FAIRPresetInput(model_name="Arbitrary Name", rcp_scenario=1)
+            self.assertEqual(second_cache.response_body(model_input), first_cache.response_body(model_input))
+
+
+class TestEBMResultCache(unittest.TestCase):
+    @staticmethod
+    def run_model(initial_temperature, name="Arbitrary Name"):
+        model = ZeroDimensionalEnergyBalanceModel(name, initial_temperature, Constants.INSOLATION_OBSERVED,
+                                                  Constants.ALPHA, Constants.TAU, engine="numpy")
+        model.run()
+        return model
+
+    def test_key_ignores_model_name(self):
+        # Key only depends on the physics inputs
+        first_model = self.run_model(30, name="First Name")
+        second_model = self.run_model(30.0, name="Second Name")
+        third_model = self.run_model(31.0)
+        self.assertEqual(EBMResultCache.key(first_model.get_physics_inputs()),
+                         EBMResultCache.key(second_model.get_physics_inputs()))
+        self.assertNotEqual(EBMResultCache.key(first_model.get_physics_inputs()),
+                            EBMResultCache.key(third_model.get_physics_inputs()))
+
+    def test_hit_and_miss_counters(self):
+        cache = EBMResultCache()
+        model = self.run_model(30.0)
+        key = cache.key(model.get_physics_inputs())
+        self.assertIsNone(cache.get(key))
+        cache.put(key, model.get_temperature_time_data())
+        self.assertEqual(cache.get(key)["temperatures"].tolist(), model.get_temperature_time_data()["temperatures"])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_least_recently_used_entry_is_removed(self):
+        cache = EBMResultCache(max_entries=2)
+        models = [self.run_model(initial_temperature) for initial_temperature in (0.0, 10.0, 20.0)]
+        keys = [cache.key(model.get_physics_inputs()) for model in models]
+        cache.put(keys[0], models[0].get_temperature_time_data())
+        cache.put(keys[1], models[1].get_temperature_time_data())
+        cache.get(keys[0])  # First entry is now more recently used than the second
+        cache.put(keys[2], models[2].get_temperature_time_data())
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_byte_limit_is_respected(self):
+        model = self.run_model(30.0)
+        cache = EBMResultCache(max_bytes=1000)
+        for initial_temperature in range(10):
+            cache.put(cache.key({"initial_temperature": initial_temperature}), model.get_temperature_time_data())
+        self.assertLessEqual(cache.size_in_bytes, 1000)
+
+    def test_disk_tier_survives_restart(self):
+        model = self.run_model(30.0)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EBMResultCache(directory=directory)
+            key = cache.key(model.get_physics_inputs())
+            cache.put(key, model.get_temperature_time_data())
+
+            restarted_cache = EBMResultCache(directory=directory)
+            self.assertEqual(restarted_cache.get(key)["temperatures"].tolist(), model.get_temperature_time_data()["temperatures"])
+            self.assertEqual(restarted_cache.disk_hits, 1)
+
+    def test_new_engine_version_invalidates_disk_tier(self):
+        model = self.run_model(30.0)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EBMResultCache(directory=directory, engine_version=1)
+            key = cache.key(model.get_physics_inputs())
+            cache.put(key, model.get_temperature_time_data())
+
+            new_version_cache = EBMResultCache(directory=directory, engine_version=2)
+            self.assertIsNone(new_version_cache.get(key))
+            self.assertEqual(os.listdir(directory), ["engine_version_2"])
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_identical_requests_share_one_run(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def simulate():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"temperatures": [1., 2.]}
+
+        results = await asyncio.gather(*(flights.run("same", simulate) for _ in range(10)))
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual((flights.runs, flights.coalesced), (1, 9))
+        # Key is released once the run has finished so later requests run again
+        self.assertEqual(flights.in_flight, {})
+        await flights.run("same", simulate)
+        self.assertEqual(len(calls), 2)
+
+    async def test_different_keys_run_separately(self):
+        flights = SingleFlight()
+
+        async def simulate(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(flights.run("first", lambda: simulate(1)), flights.run("second", lambda: simulate(2)))
+        self.assertEqual(results, [1, 2])
+        self.assertEqual((flights.runs, flights.coalesced), (2, 0))
+
+    async def test_error_is_shared(self):
+        flights = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("Simulation failed")
+
+        results = await asyncio.gather(flights.run("key", fail), flights.run("key", fail), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertEqual(flights.runs, 1)
+        self.assertEqual(flights.in_flight, {})
+
+    def test_canonical_key_treats_ints_as_floats(self):
+        self.assertEqual(canonical_key({"values": [10, 20], "grid": False}), canonical_key({"values": [10., 20.], "grid": False}))
+        self.assertNotEqual(canonical_key({"grid": False}), canonical_key({"grid": 0.0}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+from downsampling import slice_window, stride_indices, bucket_means, lttb_indices, downsample, downsample_arrays
+
+
+class TestDownsampling(unittest.TestCase):
+    times = np.arange(1765., 2501.)
+    temperatures = np.sin(times / 20)
+
+    def test_slice_window_is_inclusive(self):
+        times, temperatures = slice_window(self.times, self.temperatures, 1900, 2000)
+        self.assertEqual((times[0], times[-1]), (1900, 2000))
+        np.testing.assert_array_equal(temperatures, self.temperatures[135:236])
+
+    def test_slice_window_without_limits_keeps_everything(self):
+        times, temperatures = slice_window(self.times, self.temperatures)
+        self.assertEqual(len(times), len(self.times))
+
+    def test_stride_keeps_first_and_last_point(self):
+        indices = stride_indices(736, 10)
+        self.assertEqual(len(indices), 10)
+        self.assertEqual((indices[0], indices[-1]), (0, 735))
+
+    def test_bucket_means(self):
+        times, temperatures = bucket_means(np.arange(6.), np.array([[0., 2., 4., 6., 8., 10.]]), 3)
+        np.testing.assert_array_equal(times, [0.5, 2.5, 4.5])
+        np.testing.assert_array_equal(temperatures, [[1., 5., 9.]])
+
+    def test_lttb_keeps_peak(self):
+        # A single spike is lost by striding but kept by LTTB
+        temperatures = np.zeros(1000)
+        temperatures[501] = 10.
+        indices = lttb_indices(np.arange(1000.), temperatures, 20)
+        self.assertEqual(len(indices), 20)
+        self.assertIn(501, indices)
+        self.assertNotIn(501, stride_indices(1000, 20))
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_downsample_2d_shares_times(self):
+        temperatures = np.vstack([self.temperatures, -self.temperatures])
+        for method in ("stride", "mean", "lttb"):
+            times, reduced = downsample(self.times, temperatures, start=1800, end=2100, max_points=50, method=method)
+            self.assertEqual(len(times), 50, msg=method)
+            self.assertEqual(reduced.shape, (2, 50), msg=method)
+            self.assertTrue(1800 <= times[0] and times[-1] <= 2100, msg=method)
+
+    def test_downsample_arrays_keeps_same_samples(self):
+        arrays = {"temperatures": np.vstack([self.temperatures, 2 * self.temperatures]), "forcing": self.times / 100}
+        for method in ("stride", "mean", "lttb"):
+            times, reduced = downsample_arrays(self.times, arrays, start=1900, max_points=30, method=method)
+            self.assertEqual(reduced["temperatures"].shape, (2, 30), msg=method)
+            self.assertEqual(reduced["forcing"].shape, (30,), msg=method)
+            np.testing.assert_allclose(reduced["forcing"], times / 100, err_msg=method)
+            np.testing.assert_allclose(reduced["temperatures"][1], 2 * reduced["temperatures"][0], err_msg=method)
+
+    def test_downsample_short_output_unchanged(self):
+        times, temperatures = downsample(self.times, self.temperatures, max_points=10000, method="lttb")
+        np.testing.assert_array_equal(times, self.times)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import json
+import unittest
+import numpy as np
+from ingestion import read_array, IngestionError
+
+
+async def chunked(data, chunk_size):
+    # Async stream of the data split into chunks of chunk_size bytes (splitting values and lines between chunks)
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+class TestReadArray(unittest.IsolatedAsyncioTestCase):
+    values = [float(value) for value in np.linspace(-5, 12.5, 300)]
+
+    async def test_csv_with_header_and_years(self):
+        data = ("year,emissions\n" + "\n".join(f"{1765 + year},{value}" for year, value in enumerate(self.values))).encode()
+        for chunk_size in (1, 7, 4096):
+            array = await read_array(chunked(data, chunk_size), "text/csv; charset=utf-8", 1000)
+            self.assertEqual(array.tolist(), self.values)
+
+    async def test_ndjson_numbers_and_arrays(self):
+        data = ("\n".join(json.dumps(value) for value in self.values[:100]) + "\n"
+                + json.dumps(self.values[100:]) + "\n").encode()
+        for chunk_size in (3, 4096):
+            array = await read_array(chunked(data, chunk_size), "application/x-ndjson", 1000)
+            self.assertEqual(array.tolist(), self.values)
+
+    async def test_float64_split_between_chunks(self):
+        data = np.array(self.values, dtype="<f8").tobytes()
+        for chunk_size in (5, 8, 4096):
+            array = await read_array(chunked(data, chunk_size), "application/octet-stream", 1000)
+            self.assertEqual(array.tolist(), self.values)
+
+    async def test_invalid_bodies_raise_error(self):
+        invalid_bodies = [(b"1.0\nnot a number\n", "text/csv"),
+                          (b"1.0\n\"text\"\n", "application/x-ndjson"),
+                          (b"\x00" * 12, "application/octet-stream"),
+                          (b"1.0", "application/json")]
+        for data, content_type in invalid_bodies:
+            with self.assertRaises(IngestionError, msg=content_type):
+                await read_array(chunked(data, 4096), content_type, 1000)
+
+    async def test_too_many_values_raises_error(self):
+        data = np.zeros(1001).tobytes()
+        with self.assertRaises(IngestionError):
+            await read_array(chunked(data, 4096), "application/octet-stream", 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
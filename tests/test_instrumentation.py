@@ -0,0 +1,40 @@
+import json
+import logging
+import unittest
+from instrumentation import PhaseTimer, Histogram, JsonFormatter
+
+
+class TestPhaseTimer(unittest.TestCase):
+    def test_server_timing_header_lists_phases_in_order(self):
+        timer = PhaseTimer()
+        timer.add("validation", 0.001)
+        timer.add("simulation", 0.25)
+        timer.add("validation", 0.001)
+        self.assertEqual(timer.server_timing_header(), "validation;dur=2.000, simulation;dur=250.000")
+
+
+class TestHistogram(unittest.TestCase):
+    def test_bucket_counts_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test histogram", "handler", buckets=(0.1, 1.))
+        for seconds in (0.0625, 0.5, 0.5, 5.):
+            histogram.observe("root", seconds)
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{handler="root",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{handler="root",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{handler="root",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{handler="root"} 4', lines)
+        self.assertIn('test_seconds_sum{handler="root"} 6.0625', lines)
+
+
+class TestJsonFormatter(unittest.TestCase):
+    def test_extra_fields_are_included(self):
+        record = logging.LogRecord("climate_api", logging.INFO, __file__, 1, "Request handled", None, None)
+        record.status_code = 200
+        log_entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(log_entry["message"], "Request handled")
+        self.assertEqual(log_entry["level"], "INFO")
+        self.assertEqual(log_entry["status_code"], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+from jobs import JobStore, JobScheduler, JobQueueFullError, JobRetryError, report_progress
+
+
+class TestJobStore(unittest.TestCase):
+    def test_result_survives_reopening_store(self):
+        simulation_data = {"times": np.arange(5.), "temperatures": np.linspace(10, 14, 5)}
+        with tempfile.TemporaryDirectory() as directory:
+            store = JobStore(directory)
+            job_id = store.create("EBM", 0, {"model_name": "Arbitrary Name"})
+            store.store_result(job_id, {"model_name": "Arbitrary Name"}, simulation_data)
+
+            reopened_store = JobStore(directory)
+            job = reopened_store.get(job_id)
+            self.assertEqual(job["status"], "completed")
+            self.assertEqual(job["progress"], 1)
+            self.assertEqual(job["response_input"], {"model_name": "Arbitrary Name"})
+            self.assertEqual(reopened_store.load_result(job_id)["temperatures"].tolist(),
+                             simulation_data["temperatures"].tolist())
+            reopened_store.connection.close()
+            store.connection.close()
+
+    def test_unknown_job_is_none(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = JobStore(directory)
+            self.assertIsNone(store.get("missing"))
+            store.connection.close()
+
+
+class TestJobScheduler(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JobStore(self.directory.name)
+        self.order = []
+
+    async def asyncTearDown(self):
+        self.store.connection.close()
+        self.directory.cleanup()
+
+    async def run_job(self, model_type, model_input):
+        self.order.append(model_input["name"])
+        if model_input["name"] == "fails":
+            raise ValueError("Model failed")
+        if model_input["name"] == "busy" and self.order.count("busy") < 3:
+            raise JobRetryError("Too many simulations are in progress, try again later")
+        if model_input["name"] == "reports progress":
+            report_progress(0.5)
+            self.progress = self.store.get(self.progress_job_id)["progress"]
+        return model_input, {"times": np.arange(3.), "temperatures": np.zeros(3)}
+
+    async def test_jobs_run_in_priority_order(self):
+        scheduler = JobScheduler(self.store, self.run_job, number_of_workers=1)
+        # Queue jobs before the worker starts so they are all waiting at once
+        scheduler.start()
+        job_ids = [scheduler.submit("EBM", priority, {"name": name})
+                   for name, priority in [("low", 0), ("high", 5), ("middle", 1), ("fails", 0)]]
+        await scheduler.queue.join()
+        await scheduler.shutdown()
+
+        # Jobs with the same priority run in the order they were submitted
+        self.assertEqual(self.order, ["high", "middle", "low", "fails"])
+        self.assertEqual([self.store.get(job_id)["status"] for job_id in job_ids],
+                         ["completed", "completed", "completed", "failed"])
+        self.assertEqual(self.store.get(job_ids[3])["error"], "Model failed")
+
+    async def test_job_retried_while_it_cannot_run(self):
+        scheduler = JobScheduler(self.store, self.run_job, number_of_workers=1)
+        scheduler.RETRY_DELAY = 0.01
+        scheduler.start()
+        job_id = scheduler.submit("EBM", 0, {"name": "busy"})
+        await scheduler.queue.join()
+        await scheduler.shutdown()
+        self.assertEqual(self.order, ["busy"] * 3)
+        self.assertEqual(self.store.get(job_id)["status"], "completed")
+
+    async def test_old_finished_jobs_are_deleted(self):
+        scheduler = JobScheduler(self.store, self.run_job, number_of_workers=1)
+        scheduler.start()
+        old_job_id, failed_job_id, new_job_id = (scheduler.submit("EBM", 0, {"name": name}) for name in ("old", "fails", "new"))
+        await scheduler.queue.join()
+        await scheduler.shutdown()
+        self.store.connection.execute("UPDATE jobs SET updated_at = 0 WHERE id IN (?, ?)", (old_job_id, failed_job_id))
+
+        self.assertEqual(self.store.delete_finished_jobs(time.time() - 60), 2)
+        self.assertIsNone(self.store.get(old_job_id))
+        self.assertIsNone(self.store.get(failed_job_id))
+        self.assertFalse(os.path.exists(self.store.get_result_path(old_job_id)))
+        self.assertEqual(self.store.get(new_job_id)["status"], "completed")
+        self.assertTrue(os.path.exists(self.store.get_result_path(new_job_id)))
+
+    async def test_unfinished_jobs_are_requeued_on_start(self):
+        # Jobs left queued, or left running by a server which stopped long enough ago, are run when the scheduler starts
+        queued_job_id = self.store.create("EBM", 0, {"name": "left queued"})
+        abandoned_job_id = self.store.create("EBM", 0, {"name": "left running"})
+        self.store.set_status(abandoned_job_id, "running")
+        self.store.connection.execute("UPDATE jobs SET updated_at = ? WHERE id = ?",
+                                      (time.time() - JobScheduler.ABANDONED_AFTER - 1, abandoned_job_id))
+        scheduler = JobScheduler(self.store, self.run_job, number_of_workers=1)
+        scheduler.start()
+        await scheduler.queue.join()
+        await scheduler.shutdown()
+        self.assertEqual(self.store.get(queued_job_id)["status"], "completed")
+        self.assertEqual(self.store.get(abandoned_job_id)["status"], "completed")
+
+    async def test_job_running_in_other_process_is_not_run_again(self):
+        job_id = self.store.create("EBM", 0, {"name": "running elsewhere"})
+        self.store.claim(job_id)
+        scheduler = JobScheduler(self.store, self.run_job, number_of_workers=1)
+        scheduler.start()
+        await scheduler.queue.join()
+        await scheduler.shutdown()
+        self.assertEqual(self.order, [])
+        self.assertEqual(self.store.get(job_id)["status"], "running")
+
+    async def test_jobs_shared_between_processes_run_once(self):
+        # Schedulers of several server processes with their own connections to the same store
+        job_ids = [self.store.create("EBM", 0, {"name": f"job {job_num}"}) for job_num in range(5)]
+        other_stores = [JobStore(self.directory.name) for _ in range(3)]
+        schedulers = [JobScheduler(store, self.run_job, number_of_workers=2) for store in other_stores]
+        for scheduler in schedulers:
+            scheduler.start()
+        for scheduler in schedulers:
+            await scheduler.queue.join()
+            await scheduler.shutdown()
+        for store in other_stores:
+            store.connection.close()
+        self.assertEqual(sorted(self.order), [f"job {job_num}" for job_num in range(5)])
+        self.assertEqual({self.store.get(job_id)["status"] for job_id in job_ids}, {"completed"})
+
+    async def test_job_reports_progress(self):
+        scheduler = JobScheduler(self.store, self.run_job, number_of_workers=1)
+        scheduler.start()
+        self.progress_job_id = scheduler.submit("EBM", 0, {"name": "reports progress"})
+        await scheduler.queue.join()
+        await scheduler.shutdown()
+        self.assertEqual(self.progress, 0.5)
+        self.assertEqual(self.store.get(self.progress_job_id)["progress"], 1)
+
+    async def test_full_queue_rejects_job(self):
+        scheduler = JobScheduler(self.store, self.run_job, number_of_workers=0, max_queued_jobs=1)
+        scheduler.start()
+        scheduler.submit("EBM", 0, {"name": "first"})
+        with self.assertRaises(JobQueueFullError):
+            scheduler.submit("EBM", 0, {"name": "second"})
+        await scheduler.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
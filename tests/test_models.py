@@ -1,5 +1,8 @@
+import json
+import subprocess
+import sys
 import unittest
-from models import Constants, ZeroDimensionalEnergyBalanceModel, RcpModel
+from models import Constants, ZeroDimensionalEnergyBalanceModel, ZeroDimensionalEnergyBalanceEnsemble, RcpModel
 from itertools import product
 
 
@@ -50,6 +53,143 @@ class TestOneDimensionalEnergyBalanceModel(unittest.TestCase):
                 return
         self.assertTrue(True)
 
+    def test_numpy_engine_matches_climlab_engine(self):
+        # Both engines integrate the same physics so their outputs should agree
+        # to within the stated tolerance of the numpy engine
+        parameter_sets = [(100, Constants.INSOLATION_OBSERVED, Constants.ALPHA, Constants.TAU),
+                          (-50, Constants.INSOLATION_OBSERVED / 2, 0.99, 0.99),
+                          (30.0, Constants.INSOLATION_OBSERVED * 2, 0.01, 0.01)]
+        for parameters in parameter_sets:
+            climlab_model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", *parameters, engine="climlab")
+            numpy_model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", *parameters, engine="numpy")
+            climlab_model.run()
+            numpy_model.run()
+            climlab_data = climlab_model.get_temperature_time_data()
+            numpy_data = numpy_model.get_temperature_time_data()
+
+            self.assertEqual(climlab_data["times"], numpy_data["times"])
+            self.assertEqual(len(climlab_data["temperatures"]), len(numpy_data["temperatures"]))
+            for climlab_temperature, numpy_temperature in zip(climlab_data["temperatures"], numpy_data["temperatures"]):
+                self.assertAlmostEqual(climlab_temperature, numpy_temperature,
+                                       delta=ZeroDimensionalEnergyBalanceModel.NUMPY_ENGINE_TOLERANCE,
+                                       msg=f"Engines disagree for parameters {parameters}")
+
+    def test_unknown_engine_raises_error(self):
+        with self.assertRaises(ValueError):
+            ZeroDimensionalEnergyBalanceModel("Arbitrary Name", 30.0, Constants.INSOLATION_OBSERVED, Constants.ALPHA,
+                                              Constants.TAU, engine="fortran")
+
+
+class TestEnergyBalanceRunConfiguration(unittest.TestCase):
+    def test_default_configuration_matches_fixed_run(self):
+        # Default run is 50 years of 1 month timesteps, recorded every year
+        test_model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", 30.0, Constants.INSOLATION_OBSERVED,
+                                                       Constants.ALPHA, Constants.TAU, engine="numpy")
+        test_model.run()
+        test_data = test_model.get_temperature_time_data()
+        self.assertEqual(test_data["times"], list(range(51)))
+        self.assertEqual(test_model.time_steps_completed, 600)
+        self.assertFalse(test_model.converged)
+
+    def test_convergence_mode_stops_at_equilibrium(self):
+        # Run stops once the temperature changes by less than the tolerance per year
+        # and the final temperature is still close to the analytical equilibrium
+        tolerance = 0.001
+        equilibrium_temperature = (((1 - Constants.ALPHA) * Constants.INSOLATION_OBSERVED) / (Constants.TAU * Constants.SIGMA)) ** 0.25
+        for engine in ZeroDimensionalEnergyBalanceModel.ENGINES:
+            test_model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", 100, Constants.INSOLATION_OBSERVED,
+                                                           Constants.ALPHA, Constants.TAU, engine=engine,
+                                                           duration=500, convergence_tolerance=tolerance)
+            test_model.run()
+            test_data = test_model.get_temperature_time_data()
+
+            self.assertTrue(test_model.converged)
+            self.assertLess(test_model.time_steps_completed, test_model.time_steps)
+            self.assertEqual(test_model.time_steps_completed, (len(test_data["times"]) - 1) * 12)
+            self.assertLess(abs(test_data["temperatures"][-1] - test_data["temperatures"][-2]), tolerance)
+            self.assertAlmostEqual(equilibrium_temperature, test_data["temperatures"][-1] + 273.15, delta=0.1)
+            run_summary = test_model.get_run_summary(test_data["temperatures"])
+            self.assertEqual(run_summary["time_steps_completed"], test_model.time_steps_completed)
+            self.assertTrue(run_summary["converged"])
+
+    def test_continuing_from_snapshot_matches_longer_run(self):
+        # A 50 year run continued for another 50 years gives the last 50 years of a 100 year run
+        for engine in ZeroDimensionalEnergyBalanceModel.ENGINES:
+            first_model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", 30.0, Constants.INSOLATION_OBSERVED,
+                                                            Constants.ALPHA, Constants.TAU, engine=engine)
+            first_model.run()
+            snapshot = first_model.get_run_summary(first_model.history.temperature)["snapshot"]
+            self.assertEqual(snapshot["elapsed_steps"], 600)
+            self.assertEqual(snapshot["elapsed_time"], 50)
+
+            continued_model = ZeroDimensionalEnergyBalanceModel.from_snapshot("Arbitrary Name", snapshot, duration=50)
+            continued_model.run()
+            long_model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", 30.0, Constants.INSOLATION_OBSERVED,
+                                                           Constants.ALPHA, Constants.TAU, engine=engine, duration=100)
+            long_model.run()
+
+            continued_data = continued_model.get_temperature_time_data()
+            long_data = long_model.get_temperature_time_data()
+            # Only the new samples are recorded
+            self.assertEqual(continued_data["times"], long_data["times"][51:])
+            for continued_temperature, long_temperature in zip(continued_data["temperatures"], long_data["temperatures"][51:]):
+                self.assertAlmostEqual(continued_temperature, long_temperature, places=9)
+            continued_summary = continued_model.get_run_summary(continued_model.history.temperature)
+            self.assertEqual(continued_summary["time_steps_completed"], 600)
+            self.assertEqual(continued_summary["snapshot"]["elapsed_steps"], 1200)
+
+    def test_continuation_converged_at_first_sample(self):
+        # The first new sample is compared with the snapshot temperature, so a continued run can converge straight away
+        model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", 30.0, Constants.INSOLATION_OBSERVED,
+                                                  Constants.ALPHA, Constants.TAU, engine="numpy")
+        model.run()
+        snapshot = model.get_run_summary(model.history.temperature)["snapshot"]
+        continued_model = ZeroDimensionalEnergyBalanceModel.from_snapshot("Arbitrary Name", snapshot,
+                                                                          convergence_tolerance=1.)
+        continued_model.run()
+        self.assertTrue(continued_model.converged)
+        run_summary = continued_model.get_run_summary(continued_model.history.temperature)
+        self.assertEqual(run_summary["time_steps_completed"], 12)
+        self.assertTrue(run_summary["converged"])
+
+    def test_snapshot_from_other_engine_version_rejected(self):
+        model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", 30.0, Constants.INSOLATION_OBSERVED,
+                                                  Constants.ALPHA, Constants.TAU, engine="numpy", duration=1)
+        model.run()
+        snapshot = model.get_run_summary(model.history.temperature)["snapshot"]
+        with self.assertRaises(ValueError):
+            ZeroDimensionalEnergyBalanceModel.from_snapshot("Arbitrary Name", snapshot | {"engine_version": -1})
+
+
+class TestEnergyBalanceEnsemble(unittest.TestCase):
+    def test_members_match_individual_runs(self):
+        # Each row of the ensemble output is the same as running that member on its own
+        initial_temperatures = [-50, 0, 100]
+        ensemble = ZeroDimensionalEnergyBalanceEnsemble("Arbitrary Name", initial_temperatures,
+                                                        [Constants.INSOLATION_OBSERVED], [Constants.ALPHA], [Constants.TAU])
+        ensemble.run()
+        ensemble_data = ensemble.get_temperature_time_data()
+
+        for row, initial_temperature in zip(ensemble_data["temperatures"], initial_temperatures):
+            model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", initial_temperature, Constants.INSOLATION_OBSERVED,
+                                                      Constants.ALPHA, Constants.TAU, engine="numpy")
+            model.run()
+            model_data = model.get_temperature_time_data()
+            self.assertEqual(ensemble_data["times"], model_data["times"])
+            for ensemble_temperature, model_temperature in zip(row, model_data["temperatures"]):
+                self.assertAlmostEqual(ensemble_temperature, model_temperature, places=9)
+
+    def test_grid_runs_every_combination(self):
+        ensemble = ZeroDimensionalEnergyBalanceEnsemble("Arbitrary Name", [0, 30], [Constants.INSOLATION_OBSERVED],
+                                                        [0.1, 0.3, 0.5], [Constants.TAU], grid=True)
+        ensemble.run()
+        parameters = ensemble.get_member_parameters()
+        self.assertEqual(ensemble.number_of_members, 6)
+        self.assertEqual(parameters["initial_temperature"], [0, 0, 0, 30, 30, 30])
+        self.assertEqual(parameters["albedo"], [0.1, 0.3, 0.5, 0.1, 0.3, 0.5])
+        self.assertEqual(len(ensemble.get_temperature_time_data()["temperatures"]), 6)
+
+
 class TestFAIRModel(unittest.TestCase):
     def test_all_rcp_scenarios_run_successfully(self):
         try:
@@ -60,6 +200,33 @@ class TestFAIRModel(unittest.TestCase):
             self.assertTrue(False)
         self.assertTrue(True)
 
+    def test_rcp_run_keeps_concentrations_and_forcing(self):
+        model = RcpModel(name="Arbitrary", rcp_scenario=2)
+        model.run()
+        outputs = model.get_concentration_forcing_arrays()
+        number_of_years = len(model.history.time)
+        self.assertEqual(outputs["co2_concentrations"].shape, (number_of_years,))
+        self.assertEqual(outputs["forcing"].shape, (number_of_years,))
+        # Pre-industrial CO2 concentration is around 278 ppm
+        self.assertAlmostEqual(outputs["co2_concentrations"][0], 278, delta=5)
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_heavy_modules_not_imported_at_startup(self):
+        # Importing the models or the server must not load matplotlib, climlab, fair or the RCP datasets
+        # (checked in a fresh interpreter as other tests will already have imported them)
+        for module in ("models", "main"):
+            output = subprocess.run([sys.executable, "-c", f"import json, sys, {module}; print(json.dumps(list(sys.modules)))"],
+                                    capture_output=True, text=True, check=True).stdout
+            loaded_modules = json.loads(output.splitlines()[-1])
+            for heavy_module in ("matplotlib", "climlab", "fair", "fair.RCPs.rcp26"):
+                self.assertNotIn(heavy_module, loaded_modules, msg=module)
+
+    def test_rcp_dataset_loaded_on_first_use(self):
+        self.assertIn(1, RcpModel.rcp_scenario_dict)
+        self.assertNotIn(5, RcpModel.rcp_scenario_dict)
+        self.assertEqual(list(RcpModel.rcp_scenario_dict), [1, 2, 3, 4])
+        self.assertTrue(hasattr(RcpModel.rcp_scenario_dict[1], "Emissions"))
 
 
 if __name__ == '__main__':
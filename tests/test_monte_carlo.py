@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+from monte_carlo import ParameterDistributions, create_chunks, PercentileAccumulator
+
+
+class TestPercentileAccumulator(unittest.TestCase):
+    def test_percentiles_match_numpy_within_bin_width(self):
+        temperatures = np.random.default_rng(1).normal(2., 1., (5000, 3))
+        accumulator = PercentileAccumulator(3)
+        # Added in several parts, as chunks of members are
+        for part in np.array_split(temperatures, 7):
+            accumulator.add(part)
+        percents = [5, 17, 50, 83, 95]
+        bands = accumulator.percentiles(percents)
+        self.assertEqual(bands.shape, (5, 3))
+        np.testing.assert_allclose(bands, np.percentile(temperatures, percents, axis=0), atol=accumulator.bin_width)
+
+    def test_range_grows_to_fit_temperatures(self):
+        accumulator = PercentileAccumulator(1, lower=0., upper=1., bin_width=0.1)
+        accumulator.add(np.array([[-5.], [0.55], [50.]]))
+        self.assertEqual(accumulator.counts.sum(), 3)
+        self.assertEqual(accumulator.number_of_members, 3)
+        np.testing.assert_allclose(accumulator.percentiles([0, 50, 100])[:, 0], [-5., 0.55, 50.], atol=0.1)
+
+    def test_extreme_percentiles_match_data(self):
+        temperatures = np.random.default_rng(2).normal(3., 0.5, (1000, 2))
+        accumulator = PercentileAccumulator(2)
+        accumulator.add(temperatures)
+        np.testing.assert_allclose(accumulator.percentiles([0, 100]), [temperatures.min(axis=0), temperatures.max(axis=0)],
+                                   atol=accumulator.bin_width)
+
+    def test_temperatures_which_are_not_finite_raise_error(self):
+        with self.assertRaises(ValueError):
+            PercentileAccumulator(1).add(np.array([[np.nan]]))
+
+
+class TestMonteCarloChunks(unittest.TestCase):
+    def test_chunks_cover_all_members(self):
+        chunks = create_chunks("Arbitrary Name", 1, 250, seed=0, chunk_size=100)
+        self.assertEqual([chunk.number_of_members for chunk in chunks], [100, 100, 50])
+
+    def test_same_seed_draws_same_parameters(self):
+        def draw(seed):
+            chunk = create_chunks("Arbitrary Name", 1, 10, seed=seed)[0]
+            return ParameterDistributions.sample(np.random.default_rng(chunk.seed_sequence), chunk.number_of_members)
+
+        first, second, other = draw(3), draw(3), draw(4)
+        for name in first:
+            np.testing.assert_array_equal(first[name], second[name])
+            self.assertFalse(np.array_equal(first[name], other[name]))
+
+    def test_chunk_run_is_reproducible(self):
+        first, second = create_chunks("Arbitrary Name", 2, 3, seed=7)[0], create_chunks("Arbitrary Name", 2, 3, seed=7)[0]
+        first.run()
+        second.run()
+        self.assertEqual(first.temperatures.shape, (3, len(first.times)))
+        np.testing.assert_array_equal(first.temperatures, second.temperatures)
+
+
+if __name__ == '__main__':
+    unittest.main()
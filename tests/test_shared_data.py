@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from models import RcpModel
+from shared_data import SharedArrayStore, atomic_write
+
+
+class TestSharedArrayStore(unittest.TestCase):
+    def test_put_then_get_from_other_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            array = np.arange(12.).reshape(3, 4)
+            shared_array = SharedArrayStore(directory).put("example", array)
+            np.testing.assert_array_equal(shared_array, array)
+            # Another process attaches to the same file read-only
+            attached_array = SharedArrayStore(directory).get("example")
+            np.testing.assert_array_equal(attached_array, array)
+            self.assertFalse(attached_array.flags.writeable)
+
+    def test_first_stored_array_is_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            SharedArrayStore(directory).put("example", np.zeros(3))
+            np.testing.assert_array_equal(SharedArrayStore(directory).put("example", np.ones(3)), np.zeros(3))
+
+    def test_missing_array(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertIsNone(SharedArrayStore(directory).get("missing"))
+
+    def test_other_data_versions_invalidated(self):
+        # Arrays stored by a different fair version (or DATA_VERSION) are never attached to and are deleted
+        with tempfile.TemporaryDirectory() as directory:
+            SharedArrayStore(directory, data_version="old").put("example", np.zeros(3))
+            store = SharedArrayStore(directory)
+            self.assertIsNone(store.get("example"))
+            self.assertEqual(os.listdir(directory), [f"data_version_{SharedArrayStore.get_data_version()}"])
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def test_failed_write_keeps_old_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "example.bin")
+            with atomic_write(path) as file:
+                file.write(b"old")
+            with self.assertRaises(ValueError):
+                with atomic_write(path) as file:
+                    file.write(b"partly written")
+                    raise ValueError("Write failed")
+            with open(path, "rb") as file:
+                self.assertEqual(file.read(), b"old")
+            # No temporary files are left behind
+            self.assertEqual(os.listdir(directory), ["example.bin"])
+
+
+class TestSharedRcpEmissions(unittest.TestCase):
+    def test_shared_emissions_match_dataset(self):
+        dataset = RcpModel.rcp_scenario_dict[3]
+        with tempfile.TemporaryDirectory() as directory:
+            original_store = RcpModel.shared_store
+            RcpModel.shared_store = SharedArrayStore(directory)
+            try:
+                years, emissions = RcpModel.get_emissions(3)
+                model = RcpModel("Arbitrary Name", 3)
+                model.run()
+            finally:
+                RcpModel.shared_store = original_store
+        np.testing.assert_array_equal(years, dataset.Emissions.year)
+        np.testing.assert_array_equal(emissions, dataset.Emissions.emissions)
+        # FAIR rejects subclasses of numpy arrays such as memmap
+        self.assertIs(type(emissions), np.ndarray)
+        unshared_model = RcpModel("Arbitrary Name", 3)
+        unshared_model.run()
+        self.assertEqual(model.get_temperature_time_data(), unshared_model.get_temperature_time_data())
+
+
+if __name__ == '__main__':
+    unittest.main()
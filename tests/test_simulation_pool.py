@@ -0,0 +1,87 @@
+import asyncio
+import time
+import unittest
+from models import Constants, ZeroDimensionalEnergyBalanceModel
+from simulation_pool import SimulationPool, PoolFullError, SimulationTimeoutError
+
+
+class TestSimulationPool(unittest.IsolatedAsyncioTestCase):
+    async def test_run_returns_completed_model(self):
+        # Model run in a worker process has the same output as running it directly
+        pool = SimulationPool(kind="process", max_workers=1)
+        model = ZeroDimensionalEnergyBalanceModel("Arbitrary Name", 30.0, Constants.INSOLATION_OBSERVED,
+                                                  Constants.ALPHA, Constants.TAU, engine="numpy")
+        try:
+            completed_model = await pool.run(model)
+        finally:
+            pool.shutdown()
+        model.run()
+        self.assertEqual(completed_model.get_temperature_time_data(), model.get_temperature_time_data())
+
+    async def test_full_queue_rejects_simulation(self):
+        # Simulations beyond the queue depth limit are rejected rather than queued
+        pool = SimulationPool(kind="thread", max_workers=1, max_queue_depth=1)
+        try:
+            running = asyncio.create_task(pool.submit(time.sleep, 0.5))
+            await asyncio.sleep(0.05)
+            with self.assertRaises(PoolFullError):
+                await pool.submit(time.sleep, 0)
+            await running
+            self.assertEqual(pool.queue_depth, 0)
+        finally:
+            pool.shutdown()
+
+    async def test_slow_simulation_times_out(self):
+        pool = SimulationPool(kind="thread", max_workers=1, timeout=0.05)
+        try:
+            with self.assertRaises(SimulationTimeoutError):
+                await pool.submit(time.sleep, 0.5)
+        finally:
+            pool.shutdown()
+
+    async def test_timed_out_simulation_keeps_queue_until_finished(self):
+        # The worker carries on with a timed out simulation, so it still counts towards the queue depth
+        # while a simulation which never started is cancelled straight away
+        pool = SimulationPool(kind="thread", max_workers=1, max_queue_depth=2, timeout=0.05)
+        try:
+            running = asyncio.create_task(pool.submit(time.sleep, 0.5))
+            waiting = asyncio.create_task(pool.submit(time.sleep, 0.5))
+            for task in (running, waiting):
+                with self.assertRaises(SimulationTimeoutError):
+                    await task
+            await asyncio.sleep(0.05)
+            self.assertEqual(pool.queue_depth, 1)
+            await asyncio.sleep(0.6)
+            self.assertEqual(pool.queue_depth, 0)
+        finally:
+            pool.shutdown()
+
+    async def test_reserved_place_fills_queue(self):
+        # Simulations run outside the workers share the queue depth limit
+        pool = SimulationPool(kind="thread", max_workers=1, max_queue_depth=1)
+        try:
+            pool.reserve()
+            with self.assertRaises(PoolFullError):
+                await pool.submit(time.sleep, 0)
+            pool.decrease_queue_depth()
+            await pool.submit(time.sleep, 0)
+        finally:
+            pool.shutdown()
+
+    async def test_time_limited_samples_stop_at_timeout(self):
+        pool = SimulationPool(kind="thread", max_workers=1, timeout=0.05)
+
+        def slow_samples():
+            for sample_num in range(10):
+                time.sleep(0.02)
+                yield sample_num
+
+        samples = []
+        with self.assertRaises(SimulationTimeoutError):
+            for sample in pool.time_limited(slow_samples()):
+                samples.append(sample)
+        self.assertLess(len(samples), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
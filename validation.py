@@ -1,6 +1,10 @@
 from typing import Callable
-from api_models import ZeroDimensionEBMInput, FAIRPresetInput
-from models import Constants
+from math import prod
+import numpy as np
+from api_models import ZeroDimensionEBMInput, ZeroDimensionEBMBatchInput, FAIRPresetInput, FAIRCustomInput, \
+    FAIRMonteCarloInput, OutputWindowInput, ZeroDimensionEBMContinueInput, FAIRCompareInput
+from models import Constants, ZeroDimensionalEnergyBalanceModel
+from downsampling import METHODS
 
 # Validation models
 
@@ -36,7 +40,16 @@ class EBMValidator(Validator):
         ValidationRule(EBMValidator.check_insolation, model_input.insolation,
                        "Insolation must be in the range 170.65 and 682.6"),
         ValidationRule(EBMValidator.check_albedo, model_input.albedo, "Albedo must be in the range 0.01 and 0.99"),
-        ValidationRule(EBMValidator.check_tau, model_input.tau, "Tau must be in the range 0.01 and 0.99")
+        ValidationRule(EBMValidator.check_tau, model_input.tau, "Tau must be in the range 0.01 and 0.99"),
+        ValidationRule(EBMValidator.check_duration, model_input.duration,
+                       "Duration must be greater than 0 and at most 1000 years"),
+        ValidationRule(EBMValidator.check_timestep, model_input.timestep, "Timestep must be in the range 1 and 360 days"),
+        ValidationRule(EBMValidator.check_whole_number_of_timesteps, (model_input.sample_interval, model_input.timestep),
+                       "Sample interval must be a whole number of timesteps"),
+        ValidationRule(EBMValidator.check_whole_number_of_samples, (model_input.duration, model_input.sample_interval),
+                       "Duration must be a whole number of sample intervals"),
+        ValidationRule(EBMValidator.check_convergence_tolerance, model_input.convergence_tolerance,
+                       "Convergence tolerance must be greater than 0")
         ]
         super().__init__(rules)
 
@@ -60,6 +73,138 @@ class EBMValidator(Validator):
         # Returns true if tau is between 0.01 and 0.99
         return 0.01 <= tau <= 0.99
 
+    @staticmethod
+    def check_duration(duration):
+        # Returns true if the run is between 0 (exclusive) and 1000 years long
+        return 0 < duration <= 1000
+
+    @staticmethod
+    def check_timestep(timestep):
+        # Returns true if timestep is between 1 day and 1 year
+        return 1 <= timestep <= Constants.DAYS_PER_YEAR
+
+    @staticmethod
+    def is_whole_multiple(value, unit):
+        # Returns true if value is a positive whole number of units (allowing for floating point error)
+        multiple = value / unit
+        return round(multiple) >= 1 and abs(multiple - round(multiple)) < 1e-9
+
+    @staticmethod
+    def check_whole_number_of_timesteps(sample_interval_and_timestep):
+        # Samples can only be recorded at the end of a timestep
+        sample_interval, timestep = sample_interval_and_timestep
+        return EBMValidator.is_whole_multiple(sample_interval * Constants.DAYS_PER_YEAR, timestep)
+
+    @staticmethod
+    def check_whole_number_of_samples(duration_and_sample_interval):
+        duration, sample_interval = duration_and_sample_interval
+        return EBMValidator.is_whole_multiple(duration, sample_interval)
+
+    @staticmethod
+    def check_convergence_tolerance(convergence_tolerance):
+        # Convergence mode is optional
+        return convergence_tolerance is None or convergence_tolerance > 0
+
+
+class EBMContinueValidator(Validator):
+    # Validates a continuation of an EBM run from a snapshot
+    # The snapshot's physics inputs are checked as well since it is sent by the client
+    def __init__(self, model_input: ZeroDimensionEBMContinueInput):
+        snapshot = model_input.snapshot
+        rules = [
+            ValidationRule(EBMContinueValidator.check_engine_version, snapshot.engine_version,
+                           "Snapshot was made by a different version of the model and cannot be continued, "
+                           "run the model again from the start"),
+            ValidationRule(EBMContinueValidator.check_engine, snapshot.engine,
+                           f"Engine must be one of {', '.join(ZeroDimensionalEnergyBalanceModel.ENGINES)}"),
+            ValidationRule(EBMContinueValidator.check_temperature, snapshot.temperature,
+                           "Snapshot temperature must be above absolute zero"),
+            ValidationRule(EBMContinueValidator.check_elapsed_steps, snapshot.elapsed_steps,
+                           "Snapshot elapsed steps must not be negative"),
+            ValidationRule(EBMValidator.check_insolation, snapshot.insolation, "Insolation must be in the range 170.65 and 682.6"),
+            ValidationRule(EBMValidator.check_albedo, snapshot.albedo, "Albedo must be in the range 0.01 and 0.99"),
+            ValidationRule(EBMValidator.check_tau, snapshot.tau, "Tau must be in the range 0.01 and 0.99"),
+            ValidationRule(EBMValidator.check_timestep, snapshot.timestep, "Timestep must be in the range 1 and 360 days"),
+            ValidationRule(EBMValidator.check_duration, model_input.duration,
+                           "Duration must be greater than 0 and at most 1000 years"),
+            ValidationRule(EBMValidator.check_whole_number_of_timesteps, (model_input.sample_interval, snapshot.timestep),
+                           "Sample interval must be a whole number of timesteps"),
+            ValidationRule(EBMValidator.check_whole_number_of_samples, (model_input.duration, model_input.sample_interval),
+                           "Duration must be a whole number of sample intervals"),
+            ValidationRule(EBMValidator.check_convergence_tolerance, model_input.convergence_tolerance,
+                           "Convergence tolerance must be greater than 0")
+        ]
+        super().__init__(rules)
+
+    @staticmethod
+    def check_engine_version(engine_version):
+        # Output of a different engine version would not join on to the earlier run
+        return engine_version == ZeroDimensionalEnergyBalanceModel.ENGINE_VERSION
+
+    @staticmethod
+    def check_engine(engine):
+        return engine in ZeroDimensionalEnergyBalanceModel.ENGINES
+
+    @staticmethod
+    def check_temperature(temperature):
+        # Runs can warm well beyond the range allowed for initial temperatures, so only impossible values are rejected
+        return bool(np.isfinite(temperature)) and temperature > -Constants.CELSIUS_TO_KELVIN
+
+    @staticmethod
+    def check_elapsed_steps(elapsed_steps):
+        return elapsed_steps >= 0
+
+
+class EBMBatchValidator(Validator):
+    MAX_MEMBERS = 20000  # Largest ensemble that can be run in one request
+
+    def __init__(self, model_input: ZeroDimensionEBMBatchInput):
+        parameter_lists = [model_input.initial_temperature, model_input.insolation, model_input.albedo, model_input.tau]
+        rules = [
+            ValidationRule(EBMBatchValidator.check_not_empty, parameter_lists, "Every parameter list must contain at least one value"),
+            ValidationRule(EBMBatchValidator.check_lengths_match, parameter_lists if not model_input.grid else [],
+                           "Parameter lists must all have the same length or a length of 1 unless grid is set"),
+            ValidationRule(EBMBatchValidator.check_number_of_members,
+                           EBMBatchValidator.count_members(parameter_lists, model_input.grid),
+                           f"Number of ensemble members must be at most {EBMBatchValidator.MAX_MEMBERS}"),
+            ValidationRule(EBMBatchValidator.check_all(EBMValidator.check_temperature), model_input.initial_temperature,
+                           "Initial temperature must be in the range -100 and 100"),
+            ValidationRule(EBMBatchValidator.check_all(EBMValidator.check_insolation), model_input.insolation,
+                           "Insolation must be in the range 170.65 and 682.6"),
+            ValidationRule(EBMBatchValidator.check_all(EBMValidator.check_albedo), model_input.albedo,
+                           "Albedo must be in the range 0.01 and 0.99"),
+            ValidationRule(EBMBatchValidator.check_all(EBMValidator.check_tau), model_input.tau,
+                           "Tau must be in the range 0.01 and 0.99")
+        ]
+        super().__init__(rules)
+
+    @staticmethod
+    def count_members(parameter_lists, grid):
+        # Number of models in the ensemble
+        if grid:
+            return prod(len(values) for values in parameter_lists)
+        return max(len(values) for values in parameter_lists)
+
+    @staticmethod
+    def check_all(check: Callable):
+        # Returns a validation function which applies the check to every value in a list
+        return lambda values: all(check(value) for value in values)
+
+    @staticmethod
+    def check_not_empty(parameter_lists):
+        return all(len(values) > 0 for values in parameter_lists)
+
+    @staticmethod
+    def check_lengths_match(parameter_lists):
+        # Lists of length 1 are broadcast to every member so are always allowed
+        lengths = {len(values) for values in parameter_lists} - {1}
+        return len(lengths) <= 1
+
+    @staticmethod
+    def check_number_of_members(number_of_members):
+        return number_of_members <= EBMBatchValidator.MAX_MEMBERS
+
+
 class RcpFAIRValidator(Validator):
     def __init__(self, model_input: FAIRPresetInput):
         rules = [
@@ -71,3 +216,133 @@ class RcpFAIRValidator(Validator):
     def check_rcp_scenario_number(scenario_num):
         # Must be 1 - 4 inclusive
         return True if scenario_num in range(1, 5) else False
+
+
+class RcpFAIRCompareValidator(Validator):
+    def __init__(self, model_input: FAIRCompareInput):
+        rules = [
+            ValidationRule(RcpFAIRCompareValidator.check_rcp_scenario_numbers, model_input.rcp_scenarios,
+                           "At least one RCP scenario must be chosen and every scenario number must be valid"),
+            ValidationRule(RcpFAIRCompareValidator.check_no_repeats, model_input.rcp_scenarios,
+                           "Each RCP scenario can only be chosen once"),
+            ValidationRule(RcpFAIRCompareValidator.check_baseline_scenario,
+                           (model_input.baseline_scenario, model_input.rcp_scenarios),
+                           "Baseline scenario must be one of the chosen scenarios")
+        ]
+        super().__init__(rules)
+
+    @staticmethod
+    def check_rcp_scenario_numbers(scenario_nums):
+        return len(scenario_nums) >= 1 and all(RcpFAIRValidator.check_rcp_scenario_number(num) for num in scenario_nums)
+
+    @staticmethod
+    def check_no_repeats(scenario_nums):
+        return len(set(scenario_nums)) == len(scenario_nums)
+
+    @staticmethod
+    def check_baseline_scenario(baseline_and_scenario_nums):
+        baseline_scenario, scenario_nums = baseline_and_scenario_nums
+        return baseline_scenario is None or baseline_scenario in scenario_nums
+
+
+class RcpFAIRMonteCarloValidator(Validator):
+    MAX_MEMBERS = 50000  # Largest ensemble that can be run in one job
+
+    def __init__(self, model_input: FAIRMonteCarloInput):
+        rules = [
+            ValidationRule(RcpFAIRValidator.check_rcp_scenario_number, model_input.rcp_scenario, "Invalid RCP scenario number chosen"),
+            ValidationRule(RcpFAIRMonteCarloValidator.check_number_of_members, model_input.number_of_members,
+                           f"Number of members must be in the range 1 and {RcpFAIRMonteCarloValidator.MAX_MEMBERS}"),
+            ValidationRule(RcpFAIRMonteCarloValidator.check_seed, model_input.seed, "Seed must not be negative"),
+            ValidationRule(RcpFAIRMonteCarloValidator.check_percentiles, model_input.percentiles,
+                           "Between 1 and 20 percentiles must be given, each in the range 0 and 100")
+        ]
+        super().__init__(rules)
+
+    @staticmethod
+    def check_number_of_members(number_of_members):
+        return 1 <= number_of_members <= RcpFAIRMonteCarloValidator.MAX_MEMBERS
+
+    @staticmethod
+    def check_seed(seed):
+        return seed >= 0
+
+    @staticmethod
+    def check_percentiles(percentiles):
+        return 1 <= len(percentiles) <= 20 and all(0 <= percentile <= 100 for percentile in percentiles)
+
+
+class RcpFAIRMonteCarloSynchronousValidator(Validator):
+    # Further limits ensembles run by /execute/FAIR/montecarlo, which holds the connection open until every member
+    # has run (about a quarter of a second per member on one core), so larger ensembles must be submitted as jobs
+    MAX_MEMBERS = 200
+
+    def __init__(self, model_input: FAIRMonteCarloInput):
+        rules = [
+            ValidationRule(RcpFAIRMonteCarloSynchronousValidator.check_number_of_members, model_input.number_of_members,
+                           f"At most {RcpFAIRMonteCarloSynchronousValidator.MAX_MEMBERS} members can be run by this "
+                           f"endpoint, submit larger ensembles as a job with POST /jobs")
+        ]
+        super().__init__(rules)
+
+    @staticmethod
+    def check_number_of_members(number_of_members):
+        return number_of_members <= RcpFAIRMonteCarloSynchronousValidator.MAX_MEMBERS
+
+
+class FAIRValidator(Validator):
+    # Validates user supplied CO2 emissions for the FAIR model
+    MAX_YEARS = 10000  # Longest emissions series that can be run
+    MAX_EMISSIONS = 100.  # Largest yearly emissions (or removal) in GtC/yr
+
+    def __init__(self, model_input: FAIRCustomInput, emissions: np.ndarray):
+        rules = [
+            ValidationRule(FAIRValidator.check_number_of_years, emissions,
+                           f"Emissions must have between 2 and {FAIRValidator.MAX_YEARS} yearly values"),
+            ValidationRule(FAIRValidator.check_emissions, emissions,
+                           f"Emissions must be finite and in the range -{FAIRValidator.MAX_EMISSIONS} and {FAIRValidator.MAX_EMISSIONS} GtC/yr"),
+            ValidationRule(FAIRValidator.check_start_year, model_input.start_year, "Start year must be in the range 0 and 3000")
+        ]
+        super().__init__(rules)
+
+    @staticmethod
+    def check_number_of_years(emissions):
+        return 2 <= len(emissions) <= FAIRValidator.MAX_YEARS
+
+    @staticmethod
+    def check_emissions(emissions):
+        # Checked with reductions over the array so no copies are made
+        # (min and max are NaN if any value is NaN, and comparisons with NaN are false, so NaN is also ruled out)
+        return bool(-FAIRValidator.MAX_EMISSIONS <= np.min(emissions) and np.max(emissions) <= FAIRValidator.MAX_EMISSIONS)
+
+    @staticmethod
+    def check_start_year(start_year):
+        return 0 <= start_year <= 3000
+
+
+class OutputWindowValidator(Validator):
+    MAX_POINTS = 100000  # Largest number of samples which can be asked for
+
+    def __init__(self, output_window: OutputWindowInput):
+        rules = [
+            ValidationRule(OutputWindowValidator.check_window, (output_window.start, output_window.end),
+                           "Start must not be after end"),
+            ValidationRule(OutputWindowValidator.check_max_points, output_window.max_points,
+                           f"Max points must be in the range 2 and {OutputWindowValidator.MAX_POINTS}"),
+            ValidationRule(OutputWindowValidator.check_method, output_window.method,
+                           f"Method must be one of {', '.join(METHODS)}")
+        ]
+        super().__init__(rules)
+
+    @staticmethod
+    def check_window(window):
+        start, end = window
+        return start is None or end is None or start <= end
+
+    @staticmethod
+    def check_max_points(max_points):
+        return max_points is None or 2 <= max_points <= OutputWindowValidator.MAX_POINTS
+
+    @staticmethod
+    def check_method(method):
+        return method in METHODS